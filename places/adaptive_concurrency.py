@@ -0,0 +1,142 @@
+import threading
+import time
+
+# Per-endpoint adaptive concurrency limits (AIMD) for the SPARQL executor in reconcile_region.py (--workers).
+#
+# Every endpoint starts at INITIAL_CONCURRENCY_LIMIT requests in flight. Each healthy response raises the limit
+# by ADDITIVE_INCREASE / limit, i.e. by about ADDITIVE_INCREASE per round of requests, up to the maximum (the
+# largest --workers of the engines using the endpoint). An overload signal cuts the limit to
+# limit * MULTIPLICATIVE_DECREASE (at least 1). Overload signals are timeouts, connection errors, HTTP 429/5xx,
+# and latency spikes: a response slower than LATENCY_SPIKE_FACTOR times the endpoint's smoothed latency. Spikes
+# are kept out of the smoothed latency. Decreases are applied at most once per smoothed latency, so that the
+# requests already in flight when a server starts to struggle do not collapse the limit to 1. A limit only grows
+# while it is reached. The limits of the internal repository and the public Wikidata endpoint settle
+# independently.
+
+INITIAL_CONCURRENCY_LIMIT = 2
+ADDITIVE_INCREASE = 1.0
+MULTIPLICATIVE_DECREASE = 0.5
+LATENCY_SPIKE_FACTOR = 3.0
+LATENCY_SMOOTHING = 0.1
+# Successful responses needed before latency spikes count as overload
+LATENCY_BASELINE_SAMPLES = 10
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+class AimdLimiter:
+    """Concurrency limit of one endpoint. acquire() blocks while the limit is reached."""
+
+    def __init__(self, endpoint_url, max_limit):
+        self.endpoint_url = endpoint_url
+        self.max_limit = max_limit
+        self.limit = float(min(INITIAL_CONCURRENCY_LIMIT, max_limit))
+        self.in_flight = 0
+        self.smoothed_latency = None
+        self.latency_samples = 0
+        self.last_decrease_at = 0.0
+        self.decrease_count = 0
+        self.peak_limit = self.limit
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        with self.condition:
+            while self.in_flight >= max(int(self.limit), 1):
+                self.condition.wait()
+            self.in_flight += 1
+
+    def is_saturated(self):
+        # True if acquire() would block right now
+        with self.condition:
+            return self.in_flight >= max(int(self.limit), 1)
+
+    def release(self, latency_seconds, overloaded=False):
+        """Ends a request. overloaded marks a timeout, connection error or HTTP 429/5xx."""
+        with self.condition:
+            # Only grow a limit that is actually used; a mostly idle endpoint would otherwise drift to the maximum
+            limit_reached = self.in_flight >= int(self.limit)
+            self.in_flight -= 1
+            now = time.monotonic()
+            latency_spike = (
+                not overloaded and self.latency_samples >= LATENCY_BASELINE_SAMPLES
+                and latency_seconds > LATENCY_SPIKE_FACTOR * self.smoothed_latency
+            )
+            if overloaded or latency_spike:
+                if now - self.last_decrease_at >= (self.smoothed_latency or 0.0):
+                    self.limit = max(self.limit * MULTIPLICATIVE_DECREASE, 1.0)
+                    self.last_decrease_at = now
+                    self.decrease_count += 1
+            elif limit_reached:
+                self.limit = min(self.limit + ADDITIVE_INCREASE / self.limit, float(self.max_limit))
+                self.peak_limit = max(self.peak_limit, self.limit)
+            if not overloaded and not latency_spike:
+                self.smoothed_latency = latency_seconds if self.smoothed_latency is None else (1 - LATENCY_SMOOTHING) * self.smoothed_latency + LATENCY_SMOOTHING * latency_seconds
+                self.latency_samples += 1
+            self.condition.notify_all()
+
+    def abandon(self):
+        """Ends a request whose answer is no longer needed (the losing request of a hedge) without a latency sample."""
+        with self.condition:
+            self.in_flight -= 1
+            self.condition.notify_all()
+
+class ConcurrencySlot:
+    """
+    The slot of one request in an AimdLimiter, which another thread can give up. acquire() takes it unless it was
+    abandoned before; the first of release() and abandon() frees it, so the losing request of a hedge does not keep
+    its slot until its answer or timeout.
+    """
+
+    def __init__(self, limiter):
+        self.limiter = limiter
+        self.lock = threading.Lock()
+        self.held = False
+        self.abandoned = False
+
+    def acquire(self):
+        # Blocks like AimdLimiter.acquire(); returns False (holding nothing) if the slot was abandoned meanwhile
+        self.limiter.acquire()
+        with self.lock:
+            if not self.abandoned:
+                self.held = True
+                return True
+        self.limiter.abandon()
+        return False
+
+    def release(self, latency_seconds, overloaded=False):
+        with self.lock:
+            if not self.held:
+                return
+            self.held = False
+        self.limiter.release(latency_seconds, overloaded)
+
+    def abandon(self):
+        with self.lock:
+            self.abandoned = True
+            was_held = self.held
+            self.held = False
+        if was_held:
+            self.limiter.abandon()
+
+def get_concurrency_limiter(endpoint_url, max_concurrency=1):
+    """The limiter of endpoint_url, shared by all engines; its maximum is the largest max_concurrency (number of worker threads) asked for."""
+    max_concurrency = max(int(max_concurrency), 1)
+    with _limiters_lock:
+        limiter = _limiters.get(endpoint_url)
+        if limiter is None:
+            limiter = AimdLimiter(endpoint_url, max_concurrency)
+            _limiters[endpoint_url] = limiter
+    if max_concurrency > limiter.max_limit:
+        with limiter.condition:
+            limiter.max_limit = max(limiter.max_limit, max_concurrency)
+    return limiter
+
+def concurrency_report_lines():
+    # One line per endpoint that received requests
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    lines = []
+    for limiter in limiters:
+        latency_text = f"{limiter.smoothed_latency:.2f}s" if limiter.smoothed_latency is not None else "-"
+        lines.append(f"  {limiter.endpoint_url}: limit {limiter.limit:.1f} (peak {limiter.peak_limit:.1f}, max {limiter.max_limit}), {limiter.decrease_count} decreases, smoothed latency {latency_text}")
+    return lines
@@ -0,0 +1,209 @@
+import argparse
+import contextlib
+import csv
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError: # Not available on Windows; the RSS column stays empty there
+    resource = None
+
+# The benchmarks live next to the scripts they measure; make them importable without installing anything.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import reconcile_region
+from generate_synthetic_inputs import (
+    SYNTHETIC_RI_REGION_NAME_COL,
+    SYNTHETIC_RI_TOP_REGION_NAME_COLS,
+    SYNTHETIC_TOP_REGION_DEFS,
+    generate_synthetic_inputs,
+)
+from result_store import ResultStore
+
+# Benchmarks of the CPU-side parts of reconcile_region.py (no network access): input parsing and context lookup,
+# trailing-state stripping, TGN id parsing, binding extraction into the result store and the output writer.
+# Each benchmark is timed on its own; stderr (and stdout for the writer) go to os.devnull, so the message
+# formatting is measured but not the terminal. Results are written as CSV to stdout, like bench_match_modes.py.
+
+BENCHMARK_NAMES = ["context_index", "read_regions", "strip_trailing_state", "extract_tgn_id", "process_bindings", "write_output"]
+
+SYNTHETIC_SCOPE_NOTE = "Synthetic scope note. " * 20
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Measure the CPU-side cost of reconcile_region.py on synthetic multi-million-row inputs.")
+    parser.add_argument("--rows", type=int, default=1000000, help="Number of synthetic input rows (default: 1000000).")
+    parser.add_argument("--work-dir", help="Directory with the synthetic files. They are generated there if cities.csv is missing. Defaults to a temporary directory that is removed afterwards.")
+    parser.add_argument("--benchmarks", default=",".join(BENCHMARK_NAMES), help=f"Comma-separated benchmarks to run (default: all of {', '.join(BENCHMARK_NAMES)}).")
+    parser.add_argument("--repeat", type=int, default=1, help="How many times each benchmark is run; the fastest run is reported.")
+    parser.add_argument("--trace-memory", action='store_true', help="Also report the peak of Python allocations per benchmark (tracemalloc). Slows the benchmarks down, so timings are taken in separate runs.")
+    return parser.parse_args()
+
+def max_rss_mib():
+    # Process-wide high-water mark of the resident set size
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss / (1024 * 1024) if sys.platform == "darwin" else max_rss / 1024 # bytes on macOS, KiB elsewhere
+
+def build_synthetic_binding(row_idx):
+    # A contextual TGN query result as process_and_store_tgn_match receives it
+    def literal(value):
+        return {"type": "literal", "value": value}
+    town_id = 7100000 + row_idx % 50000
+    return {
+        "tgn_uri": {"type": "uri", "value": f"http://vocab.getty.edu/tgn/{town_id}"},
+        "label": literal(f"Town {town_id}"), "label_en": literal(f"Town {town_id}"), "label_it": literal(f"Città {town_id}"),
+        "label_de": literal(""), "label_fr": literal(""), "type": literal("inhabited places"),
+        "scope_note": literal(SYNTHETIC_SCOPE_NOTE), "wikidata_description": literal("synthetic place"),
+        "wikidata_uri": literal(f"http://www.wikidata.org/entity/Q{town_id}"), "matched_label": literal(f"Town {town_id}"),
+    }
+
+class BenchmarkInputs:
+    """Lazily built inputs shared by the benchmarks, so that each benchmark only times its own step."""
+
+    def __init__(self, work_dir):
+        self.work_dir = work_dir
+        self.top_region_configs = reconcile_region.build_top_region_configs(
+            [os.path.join(work_dir, file_name) for file_name, _, _ in SYNTHETIC_TOP_REGION_DEFS],
+            [name_cols for _, name_cols, _ in SYNTHETIC_TOP_REGION_DEFS],
+            [uri_col for _, _, uri_col in SYNTHETIC_TOP_REGION_DEFS],
+        )
+        self.context_index = None
+        self.regions = None
+        self.result_store = None
+
+    def build_context_index(self):
+        return reconcile_region.load_top_region_context_index(self.top_region_configs)
+
+    def read_regions(self):
+        return reconcile_region.read_regions_for_reconciliation(
+            os.path.join(self.work_dir, "cities.csv"), self.get_context_index(), SYNTHETIC_RI_TOP_REGION_NAME_COLS, SYNTHETIC_RI_REGION_NAME_COL, True
+        )
+
+    def get_context_index(self):
+        if self.context_index is None:
+            self.context_index = self.build_context_index()
+        return self.context_index
+
+    def get_regions(self):
+        if self.regions is None:
+            self.regions = self.read_regions()
+        return self.regions
+
+    def get_result_store(self):
+        if self.result_store is None:
+            self.result_store = process_bindings(self)
+        return self.result_store
+
+def strip_all_trailing_states(inputs):
+    _, original_data_rows, _ = inputs.get_regions()
+    for row in original_data_rows:
+        reconcile_region.strip_trailing_state(row[SYNTHETIC_RI_REGION_NAME_COL])
+    return len(original_data_rows)
+
+def extract_all_tgn_ids(inputs):
+    _, original_data_rows, _ = inputs.get_regions()
+    tgn_uris = [f"http://vocab.getty.edu/tgn/{7000000 + row_idx}" + ("-place" if row_idx % 10 == 0 else "") for row_idx in range(len(original_data_rows))]
+    started = time.perf_counter()
+    for tgn_uri in tgn_uris:
+        reconcile_region.extract_tgn_id_from_uri(tgn_uri)
+    return len(tgn_uris), time.perf_counter() - started
+
+def process_bindings(inputs):
+    _, original_data_rows, sparql_values_to_query = inputs.get_regions()
+    result_store = ResultStore(len(original_data_rows))
+    for region_name, _, original_row_idx in sparql_values_to_query:
+        response_json = {"results": {"bindings": [build_synthetic_binding(original_row_idx)]}}
+        reconcile_region.process_and_store_tgn_match(response_json, region_name, original_row_idx, result_store, context_label="TGN synthetic", match_mode="lcase")
+    return result_store
+
+def write_output(inputs):
+    original_header, original_data_rows, _ = inputs.get_regions()
+    result_store = inputs.get_result_store()
+    with open(os.devnull, 'w', newline='', encoding='utf-8') as devnull, contextlib.redirect_stdout(devnull):
+        reconcile_region.write_output_csv(original_header, original_data_rows, result_store)
+    return len(original_data_rows)
+
+def run_benchmark(benchmark_name, inputs):
+    """Runs one benchmark and returns (items processed, seconds)."""
+    started = time.perf_counter()
+    if benchmark_name == "context_index":
+        context_index = inputs.build_context_index()
+        return context_index["entry_count"], time.perf_counter() - started
+    if benchmark_name == "read_regions":
+        inputs.get_context_index()
+        started = time.perf_counter()
+        _, original_data_rows, _ = inputs.read_regions()
+        return len(original_data_rows), time.perf_counter() - started
+    if benchmark_name == "strip_trailing_state":
+        inputs.get_regions()
+        started = time.perf_counter()
+        return strip_all_trailing_states(inputs), time.perf_counter() - started
+    if benchmark_name == "extract_tgn_id":
+        return extract_all_tgn_ids(inputs)
+    if benchmark_name == "process_bindings":
+        inputs.get_regions()
+        started = time.perf_counter()
+        result_store = process_bindings(inputs)
+        return result_store.match_count(), time.perf_counter() - started
+    if benchmark_name == "write_output":
+        inputs.get_result_store()
+        started = time.perf_counter()
+        return write_output(inputs), time.perf_counter() - started
+    raise ValueError(f"Unknown benchmark '{benchmark_name}'")
+
+def traced_peak_mib(benchmark_name, inputs):
+    # Peak of Python allocations during one extra run of the benchmark (shared inputs are built before tracing)
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    run_benchmark(benchmark_name, inputs)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak / (1024 * 1024)
+
+def main():
+    args = parse_arguments()
+    benchmark_names = [name.strip() for name in args.benchmarks.split(",") if name.strip()]
+    unknown_names = [name for name in benchmark_names if name not in BENCHMARK_NAMES]
+    if unknown_names:
+        print(f"Error: Unknown benchmarks: {', '.join(unknown_names)}. Expected some of: {', '.join(BENCHMARK_NAMES)}.", file=sys.stderr)
+        sys.exit(1)
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="reconcile_bench_")
+    try:
+        if not os.path.exists(os.path.join(work_dir, "cities.csv")):
+            started = time.perf_counter()
+            generate_synthetic_inputs(work_dir, args.rows)
+            print(f"Info: Generated {args.rows} synthetic rows in '{work_dir}' in {time.perf_counter() - started:.1f}s.", file=sys.stderr)
+        else:
+            print(f"Info: Using the existing synthetic files in '{work_dir}'.", file=sys.stderr)
+
+        inputs = BenchmarkInputs(work_dir)
+        writer = csv.writer(sys.stdout)
+        writer.writerow(["benchmark", "items", "best_s", "items_per_s", "max_rss_mib", "traced_peak_mib"])
+        for benchmark_name in benchmark_names:
+            timings = []
+            with open(os.devnull, 'w', encoding='utf-8') as devnull, contextlib.redirect_stderr(devnull):
+                for _ in range(args.repeat):
+                    item_count, seconds = run_benchmark(benchmark_name, inputs)
+                    timings.append(seconds)
+                peak_mib = traced_peak_mib(benchmark_name, inputs) if args.trace_memory else None
+            best_seconds = min(timings)
+            rss_mib = max_rss_mib()
+            writer.writerow([
+                benchmark_name, item_count, f"{best_seconds:.3f}", f"{item_count / best_seconds:.0f}" if best_seconds else "",
+                f"{rss_mib:.1f}" if rss_mib is not None else "", f"{peak_mib:.1f}" if peak_mib is not None else "",
+            ])
+            sys.stdout.flush()
+            print(f"Benchmarked {benchmark_name}: {item_count} items in {best_seconds:.3f}s", file=sys.stderr)
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+import argparse
+import csv
+import os
+import statistics
+import sys
+import time
+
+# The benchmarks live next to the scripts they measure; make them importable without installing anything.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import reconcile_region
+from endpoint_health import EndpointUnavailableError, SparqlQueryError
+from label_matching import MATCH_MODES, build_label_match_clause
+
+# Used when no --terms-file is given; a mix of names that do and do not exist in TGN
+DEFAULT_TERMS = ["Roma", "Firenze", "Londra", "New York", "Lazio", "Toscana", "Paris", "Perugia", "Not A Real Place Name"]
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Measure the server-side cost of each label match mode (--match-mode) against the configured SPARQL endpoints.")
+    parser.add_argument("--terms-file", help="CSV file to take search terms from (header row is skipped). Defaults to a small built-in list.")
+    parser.add_argument("--terms-col", type=int, default=1, help="1-based column index of the search terms in --terms-file.")
+    parser.add_argument("--max-terms", type=int, default=20, help="Maximum number of distinct terms to benchmark.")
+    parser.add_argument("--context-uri", help="TGN URI used as top region for the contextual TGN template. If omitted, only the global templates are measured.")
+    parser.add_argument("--modes", default=",".join(MATCH_MODES), help="Comma-separated match modes to compare.")
+    parser.add_argument("--repeat", type=int, default=1, help="How many times each query is executed.")
+    parser.add_argument("--skip-wikidata", action='store_true', help="Do not benchmark the Wikidata fallback template.")
+    return parser.parse_args()
+
+def read_terms(args):
+    if not args.terms_file:
+        return DEFAULT_TERMS[:args.max_terms]
+    terms = []
+    with open(args.terms_file, 'r', newline='', encoding='utf-8') as csvfile:
+        reader = csv.reader(csvfile)
+        next(reader)
+        for row in reader:
+            if len(row) >= args.terms_col:
+                term = row[args.terms_col - 1].strip()
+                if term and term not in terms:
+                    terms.append(term)
+            if len(terms) >= args.max_terms:
+                break
+    return terms
+
+def build_benchmark_queries(term, match_mode, context_uri, skip_wikidata):
+    # Returns (template name, query, executor) for every template that should be measured for this term
+    tgn_clause = build_label_match_clause("found_label_uri", term, match_mode)
+    queries = [("tgn_global", reconcile_region.GLOBAL_TGN_SPARQL_QUERY_TEMPLATE.format(label_match_clause=tgn_clause), reconcile_region.execute_sparql_query)]
+    if context_uri:
+        queries.append(("tgn_contextual", reconcile_region.SINGLE_REGION_TGN_SPARQL_QUERY_TEMPLATE.format(label_match_clause=tgn_clause, top_region_uri=context_uri), reconcile_region.execute_sparql_query))
+    if not skip_wikidata:
+        wd_clause = build_label_match_clause("label", term, match_mode)
+        wd_query = reconcile_region.GLOBAL_WIKIDATA_FALLBACK_QUERY_TEMPLATE.format(label_match_clause=wd_clause)
+        queries.append(("wikidata_global", wd_query, lambda query: reconcile_region.execute_generic_sparql_query(query, reconcile_region.WIKIDATA_SPARQL_ENDPOINT_URL)))
+    return queries
+
+def main():
+    args = parse_arguments()
+    modes = [mode.strip() for mode in args.modes.split(",") if mode.strip()]
+    terms = read_terms(args)
+    if not terms:
+        print("Error: No terms to benchmark.", file=sys.stderr)
+        sys.exit(1)
+
+    # (template, mode) -> list of timings and number of queries returning a binding
+    timings = {}
+    hits = {}
+    failures = {}
+    for term in terms:
+        for mode in modes:
+            for template_name, query, executor in build_benchmark_queries(term, mode, args.context_uri, args.skip_wikidata):
+                key = (template_name, mode)
+                for _ in range(args.repeat):
+                    started = time.perf_counter()
+                    try:
+                        response_json = executor(query)
+                    except (SparqlQueryError, EndpointUnavailableError):
+                        response_json = None
+                    elapsed = time.perf_counter() - started
+                    timings.setdefault(key, []).append(elapsed)
+                    if response_json is None:
+                        failures[key] = failures.get(key, 0) + 1
+                    elif response_json.get("results", {}).get("bindings"):
+                        hits[key] = hits.get(key, 0) + 1
+                print(f"Benchmarked {template_name} / {mode} for '{term}': {timings[key][-1]:.3f}s", file=sys.stderr)
+
+    writer = csv.writer(sys.stdout)
+    writer.writerow(["template", "match_mode", "queries", "hits", "failures", "mean_s", "median_s", "max_s", "total_s"])
+    for (template_name, mode), values in sorted(timings.items()):
+        writer.writerow([
+            template_name, mode, len(values), hits.get((template_name, mode), 0), failures.get((template_name, mode), 0),
+            f"{statistics.mean(values):.3f}", f"{statistics.median(values):.3f}", f"{max(values):.3f}", f"{sum(values):.3f}"
+        ])
+
+if __name__ == "__main__":
+    main()
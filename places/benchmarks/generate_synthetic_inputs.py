@@ -0,0 +1,119 @@
+import argparse
+import csv
+import os
+import random
+import sys
+
+# Synthetic inputs in the shape of places/examples/*.csv, for the CPU benchmarks (bench_cpu_paths.py) and for
+# trying the scripts on multi-million-row files without real data:
+#
+#   countries_def.csv   like reconciled_countries_corrected.csv (name col 2, URI col 7)
+#   regions_def.csv     like reconciled_regions.csv (name cols 2,3, URI col 12)
+#   districts_def.csv   like reconciled_districts.csv (name cols 2,3,4, URI col 13)
+#   cities.csv          like cities.csv (country, region, district, town in cols 2-5)
+#
+# Names are built from syllables and the place tree is fixed by the seed, so repeated runs produce the same files.
+
+SYLLABLES = ["ro", "ma", "fi", "ren", "ze", "mi", "la", "no", "ve", "ne", "zia", "to", "ri", "pa", "dova", "ber", "ga", "sie", "na", "lu", "cca", "bo", "lo", "gna", "tre", "vi", "so", "an", "co", "sa"]
+STATE_CODES = ["NY", "CA", "TX", "RM", "FI", "MI", "BY", "NRW"]
+COUNTRY_DEF_HEADER = ["count", "PRVS[@etichetta='Country']", "label_en", "label_it", "label_de", "label_fr", "term", "scope_note"]
+REGION_DEF_HEADER = ["count", "PRVS[@etichetta='Country']", "PRVR[@etichetta='Region / Federal State']", "label", "label_en", "label_it", "label_de", "label_fr", "type", "scope_note", "wikidata_description", "tgn_uri", "wikidata_uri", "number_of_results"]
+DISTRICT_DEF_HEADER = ["count", "PVCS[@etichetta='Country']", "PVCR[@etichetta='Region / Federal State']", "PVCP[@etichetta='District']", "label", "label_en", "label_it", "label_de", "label_fr", "type", "scope_note", "wikidata_description", "tgn_uri", "wikidata_uri", "number_of_results"]
+CITIES_HEADER = ["count", "PRVS[@etichetta='Country']", "PRVR[@etichetta='Region / Federal State']", "PRVP[@etichetta='District']", "PRVC[@etichetta='Town / Municipality']"]
+
+# Column settings of the generated files, as reconcile_region.py expects them
+SYNTHETIC_TOP_REGION_DEFS = [
+    ("countries_def.csv", "2", 7),
+    ("regions_def.csv", "2,3", 12),
+    ("districts_def.csv", "2,3,4", 13),
+]
+SYNTHETIC_RI_TOP_REGION_NAME_COLS = [1, 2, 3] # 0-based, as parse_arguments returns them
+SYNTHETIC_RI_REGION_NAME_COL = 4
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Write synthetic regions input and top-region definition files in the shape of places/examples/*.csv.")
+    parser.add_argument("--output-dir", required=True, help="Directory to write the files to (created if missing).")
+    parser.add_argument("--rows", type=int, default=1000000, help="Number of data rows in cities.csv (default: 1000000).")
+    parser.add_argument("--countries", type=int, default=50, help="Number of countries (default: 50).")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed (default: 1).")
+    return parser.parse_args()
+
+def make_name(rng, used_names, syllable_count):
+    while True:
+        name = "".join(rng.choice(SYLLABLES) for _ in range(syllable_count)).capitalize()
+        if name not in used_names:
+            used_names.add(name)
+            return name
+        syllable_count += 1 # Short names run out quickly; longer ones rarely collide
+
+def build_place_tree(rng, country_count):
+    """Returns a list of (country, [(region, [(district, [town, ...]), ...]), ...]) with distinct names per level."""
+    used_names = set()
+    tree = []
+    for _ in range(country_count):
+        regions = []
+        for _ in range(rng.randint(5, 20)):
+            districts = []
+            for _ in range(rng.randint(3, 10)):
+                towns = [make_name(rng, used_names, rng.randint(2, 4)) for _ in range(rng.randint(5, 40))]
+                districts.append((make_name(rng, used_names, 3), towns))
+            regions.append((make_name(rng, used_names, 3), districts))
+        tree.append((make_name(rng, used_names, 2), regions))
+    return tree
+
+def synthetic_tgn_uri(counter):
+    return f"http://vocab.getty.edu/tgn/{7000000 + counter}"
+
+def write_definition_files(output_dir, tree):
+    counter = 0
+    with open(os.path.join(output_dir, "countries_def.csv"), 'w', newline='', encoding='utf-8') as country_file, \
+         open(os.path.join(output_dir, "regions_def.csv"), 'w', newline='', encoding='utf-8') as region_file, \
+         open(os.path.join(output_dir, "districts_def.csv"), 'w', newline='', encoding='utf-8') as district_file:
+        country_writer, region_writer, district_writer = csv.writer(country_file), csv.writer(region_file), csv.writer(district_file)
+        country_writer.writerow(COUNTRY_DEF_HEADER)
+        region_writer.writerow(REGION_DEF_HEADER)
+        district_writer.writerow(DISTRICT_DEF_HEADER)
+        for country, regions in tree:
+            counter += 1
+            country_writer.writerow(["0", country, country, country, country, country, synthetic_tgn_uri(counter), f"Synthetic country {country}."])
+            for region, districts in regions:
+                counter += 1
+                region_writer.writerow(["0", country, region, region, region, region, region, region, "regions", f"Synthetic region of {country}.", "", synthetic_tgn_uri(counter), "", "1"])
+                for district, _ in districts:
+                    counter += 1
+                    district_writer.writerow(["0", country, region, district, district, "", "", "", "", "provinces", "", "", synthetic_tgn_uri(counter), "", "1"])
+
+def write_cities_file(output_dir, tree, row_count, rng):
+    # Most rows name a known town with full context; some leave out region and district (as "Regno Unito,,,Londra"),
+    # carry a trailing state "(XX)", or name a country that is not in the definition files
+    flattened = [(country, region, district, towns) for country, regions in tree for region, districts in regions for district, towns in districts]
+    with open(os.path.join(output_dir, "cities.csv"), 'w', newline='', encoding='utf-8') as cities_file:
+        writer = csv.writer(cities_file)
+        writer.writerow(CITIES_HEADER)
+        for _ in range(row_count):
+            country, region, district, towns = rng.choice(flattened)
+            town = rng.choice(towns)
+            variant = rng.random()
+            if variant < 0.1:
+                region, district = "", ""
+            elif variant < 0.2:
+                town = f"{town} ({rng.choice(STATE_CODES)})"
+            elif variant < 0.22:
+                country = "Unknown " + country
+            writer.writerow([str(rng.randint(1, 20000)), country, region, district, town])
+
+def generate_synthetic_inputs(output_dir, row_count, country_count=50, seed=1):
+    """Writes the definition files and cities.csv with row_count rows to output_dir."""
+    os.makedirs(output_dir, exist_ok=True)
+    rng = random.Random(seed)
+    tree = build_place_tree(rng, country_count)
+    write_definition_files(output_dir, tree)
+    write_cities_file(output_dir, tree, row_count, rng)
+
+def main():
+    args = parse_arguments()
+    generate_synthetic_inputs(args.output_dir, args.rows, args.countries, args.seed)
+    print(f"Info: Wrote {args.rows} synthetic rows and {len(SYNTHETIC_TOP_REGION_DEFS)} definition files to '{args.output_dir}'.", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+import argparse
+import csv
+import os
+import sys
+
+from context_index import lookup_context_candidates, normalize_context_name_parts
+from gazetteer import Gazetteer, make_gazetteer_key, write_gazetteer
+from reconcile_region import (
+    SCRIPT_MANAGED_DATA_COLUMNS,
+    build_top_region_configs,
+    load_top_region_context_index,
+    strip_trailing_state,
+)
+
+# Columns of reconcile_region.py and reconcile_countries.py output that are stored in the gazetteer
+GAZETTEER_VALUE_COLUMNS = SCRIPT_MANAGED_DATA_COLUMNS + ["wikidata_label", "term"]
+# A row is only taken over if at least one of these is filled in
+GAZETTEER_URI_COLUMNS = ["tgn_uri", "wikidata_uri", "term"]
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Compile reviewed reconciled CSV files into a gazetteer file used by reconcile_region.py and reconcile_countries.py (--gazetteer-file).")
+    parser.add_argument("--output", required=True, help="Path of the gazetteer file to write.")
+    parser.add_argument("--input", required=True, help="Reviewed output of reconcile_region.py or reconcile_countries.py.")
+    parser.add_argument("--name-col", required=True, type=int, help="1-based column index of the reconciled name in the input file.")
+    parser.add_argument("--merge", action='store_true', help="Add the entries to the existing gazetteer file instead of replacing it. Entries from this input replace existing entries with the same key.")
+    parser.add_argument("--remove-trailing-state", action='store_true', help="Remove trailing state indicators like '(XX)' from names, as reconcile_region.py --remove-trailing-state does.")
+    # Same options as reconcile_region.py, used to find the parent context URI of every row
+    parser.add_argument("--top-region-def-file", action='append', default=[], help="Top-region definition file, as for reconcile_region.py. Without definition files, all entries are stored without a context (as needed by reconcile_countries.py).")
+    parser.add_argument("--trd-name-cols", action='append', default=[], type=str, help="Comma-separated 1-based name column indices of the corresponding --top-region-def-file.")
+    parser.add_argument("--trd-uri-col", action='append', default=[], type=int, help="1-based URI column index of the corresponding --top-region-def-file.")
+    parser.add_argument("--ri-top-region-name-col", type=str, help="Column index (1-based) or comma-separated indices of the top-region name(s) in the input file.")
+    parser.add_argument("--context-index-file", help="Context index sidecar file, as for reconcile_region.py.")
+    args = parser.parse_args()
+
+    if not (len(args.top_region_def_file) == len(args.trd_name_cols) == len(args.trd_uri_col)):
+        parser.error("The number of --top-region-def-file, --trd-name-cols, and --trd-uri-col arguments must be the same.")
+    if args.top_region_def_file and not args.ri_top_region_name_col:
+        parser.error("--ri-top-region-name-col is required with --top-region-def-file.")
+    try:
+        args.top_region_configs = build_top_region_configs(args.top_region_def_file, args.trd_name_cols, args.trd_uri_col)
+        args.ri_top_region_name_col = [int(x.strip()) - 1 for x in args.ri_top_region_name_col.split(',')] if args.ri_top_region_name_col else []
+    except ValueError as e:
+        parser.error(str(e))
+    args.name_col -= 1
+    return args
+
+def find_row_context_uri(row, context_index, ri_top_region_name_col_indices):
+    # The most specific context of the row, i.e. the first context reconcile_region.py would search in ("" if none)
+    if context_index is None:
+        return ""
+    parts = [row[idx].strip() if idx < len(row) else "" for idx in ri_top_region_name_col_indices]
+    while parts and not parts[-1]:
+        parts.pop()
+    if not parts:
+        return ""
+    candidates = lookup_context_candidates(context_index, normalize_context_name_parts(parts))
+    return candidates[0]["uri"] if candidates else ""
+
+def read_reviewed_entries(input_filename, name_col_idx, context_index, ri_top_region_name_col_indices, remove_trailing_state_flag):
+    """Returns a map of gazetteer key -> column values for every row of input_filename that carries a URI."""
+    entries = {}
+    with open(input_filename, 'r', newline='', encoding='utf-8') as csvfile:
+        reader = csv.reader(csvfile)
+        header = next(reader)
+        value_col_indices = [(name, header.index(name)) for name in GAZETTEER_VALUE_COLUMNS if name in header]
+        count_col_idx = header.index("number_of_results") if "number_of_results" in header else None
+        if not any(name in header for name in GAZETTEER_URI_COLUMNS):
+            print(f"Error: Input file '{input_filename}' has none of the columns {', '.join(GAZETTEER_URI_COLUMNS)}.", file=sys.stderr)
+            sys.exit(1)
+
+        for i, row in enumerate(reader):
+            if len(row) <= name_col_idx or not row[name_col_idx].strip():
+                continue
+            if count_col_idx is not None and count_col_idx < len(row):
+                count_value = row[count_col_idx].strip()
+                # reconcile_countries.py writes additional matches of a term on continuation lines without a count
+                if not count_value or (count_value.isdigit() and int(count_value) > 1):
+                    print(f"Info: Skipping ambiguous row {i+2} ('{row[name_col_idx]}') in '{input_filename}'.", file=sys.stderr)
+                    continue
+            values = {name: row[idx] if idx < len(row) else "" for name, idx in value_col_indices}
+            if not any(values.get(name, "").strip() for name in GAZETTEER_URI_COLUMNS):
+                continue
+
+            name = row[name_col_idx].strip()
+            if remove_trailing_state_flag:
+                name = strip_trailing_state(name)
+            key = make_gazetteer_key(name, find_row_context_uri(row, context_index, ri_top_region_name_col_indices))
+            if key in entries:
+                if any(entries[key].get(uri_col) != values.get(uri_col) for uri_col in GAZETTEER_URI_COLUMNS):
+                    print(f"Warning: Row {i+2} ('{name}') in '{input_filename}' maps a name and context seen before to different URIs. Keeping the first mapping.", file=sys.stderr)
+                continue
+            entries[key] = values
+    return entries
+
+def main():
+    args = parse_arguments()
+
+    context_index = None
+    if args.top_region_configs:
+        context_index = load_top_region_context_index(args.top_region_configs, args.context_index_file)
+
+    entries = {}
+    if args.merge and os.path.exists(args.output):
+        existing_gazetteer = Gazetteer(args.output)
+        entries.update(existing_gazetteer.entries())
+        existing_gazetteer.close()
+        print(f"Info: Loaded {len(entries)} existing entries from '{args.output}'.", file=sys.stderr)
+
+    try:
+        new_entries = read_reviewed_entries(args.input, args.name_col, context_index, args.ri_top_region_name_col, args.remove_trailing_state)
+    except FileNotFoundError:
+        print(f"Error: Input file '{args.input}' not found.", file=sys.stderr)
+        sys.exit(1)
+    entries.update(new_entries)
+
+    write_gazetteer(args.output, entries)
+    print(f"Info: Wrote {len(entries)} entries ({len(new_entries)} from '{args.input}') to gazetteer '{args.output}'.", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
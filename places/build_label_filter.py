@@ -0,0 +1,83 @@
+import argparse
+import gzip
+import re
+import sys
+
+from label_filter import DEFAULT_FALSE_POSITIVE_RATE, normalize_filter_label, write_label_filter
+
+# Predicates of the labels matched by the TGN queries (getty:term of the skosxl labels) and the Wikidata fallbacks
+TGN_LABEL_PREDICATE = "http://vocab.getty.edu/ontology#term"
+WIKIDATA_LABEL_PREDICATE = "http://www.w3.org/2004/02/skos/core#prefLabel"
+
+INPUT_FORMAT_NTRIPLES = "ntriples"
+INPUT_FORMAT_LINES = "lines"
+
+# Subject, predicate and literal object of an N-Triples/N-Quads line; language tags, datatypes and graphs are ignored
+NTRIPLES_LITERAL_PATTERN = re.compile(r'^\S+\s+<([^>]*)>\s+"((?:[^"\\]|\\.)*)"')
+NTRIPLES_ESCAPE_PATTERN = re.compile(r'\\(?:u([0-9A-Fa-f]{4})|U([0-9A-Fa-f]{8})|(.))')
+NTRIPLES_CHARACTER_ESCAPES = {"t": "\t", "b": "\b", "n": "\n", "r": "\r", "f": "\f", '"': '"', "'": "'", "\\": "\\"}
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Build a label filter file for reconcile_region.py (--tgn-label-filter, --wikidata-label-filter) from label dumps.")
+    parser.add_argument("--output", required=True, help="Path of the label filter file to write.")
+    parser.add_argument("--input", required=True, action='append', help="Dump file with the labels (plain or .gz). Can be specified multiple times.")
+    parser.add_argument("--format", choices=[INPUT_FORMAT_NTRIPLES, INPUT_FORMAT_LINES], default=INPUT_FORMAT_NTRIPLES, help=f"'{INPUT_FORMAT_NTRIPLES}': N-Triples or N-Quads dump, the literal objects of --predicate are taken; '{INPUT_FORMAT_LINES}': one label per line, e.g. a bulk export of a SPARQL query (default: {INPUT_FORMAT_NTRIPLES}).")
+    parser.add_argument("--predicate", action='append', default=[], help=f"With --format {INPUT_FORMAT_NTRIPLES}, predicate URI whose literals are labels. Can be specified multiple times (default: {TGN_LABEL_PREDICATE}; use {WIKIDATA_LABEL_PREDICATE} for a Wikidata dump).")
+    parser.add_argument("--false-positive-rate", type=float, default=DEFAULT_FALSE_POSITIVE_RATE, help=f"Share of absent names that the filter lets through to the queries (default: {DEFAULT_FALSE_POSITIVE_RATE}). Lower rates make the file larger.")
+    args = parser.parse_args()
+    if not 0 < args.false_positive_rate < 1:
+        parser.error("--false-positive-rate must be between 0 and 1.")
+    if args.format == INPUT_FORMAT_LINES and args.predicate:
+        parser.error(f"--predicate only applies to --format {INPUT_FORMAT_NTRIPLES}.")
+    args.predicate = set(args.predicate or [TGN_LABEL_PREDICATE])
+    return args
+
+def unescape_ntriples_literal(literal):
+    def replace_escape(match):
+        if match.group(1) or match.group(2):
+            return chr(int(match.group(1) or match.group(2), 16))
+        return NTRIPLES_CHARACTER_ESCAPES.get(match.group(3), match.group(3))
+    return NTRIPLES_ESCAPE_PATTERN.sub(replace_escape, literal)
+
+def open_dump(dump_path):
+    if dump_path.endswith(".gz"):
+        return gzip.open(dump_path, 'rt', encoding='utf-8', errors='replace')
+    return open(dump_path, 'r', encoding='utf-8', errors='replace')
+
+def read_dump_labels(dump_path, input_format, predicates, normalized_labels):
+    # Adds the normalized labels of dump_path to normalized_labels; returns the number of labels read
+    label_count = 0
+    with open_dump(dump_path) as dump_file:
+        for line in dump_file:
+            if input_format == INPUT_FORMAT_LINES:
+                label = line.rstrip("\r\n")
+            else:
+                match = NTRIPLES_LITERAL_PATTERN.match(line)
+                if match is None or match.group(1) not in predicates:
+                    continue
+                label = unescape_ntriples_literal(match.group(2))
+            normalized_label = normalize_filter_label(label)
+            if normalized_label:
+                normalized_labels.add(normalized_label)
+                label_count += 1
+    return label_count
+
+def main():
+    args = parse_arguments()
+    normalized_labels = set()
+    for dump_path in args.input:
+        try:
+            label_count = read_dump_labels(dump_path, args.format, args.predicate, normalized_labels)
+        except OSError as e:
+            print(f"Error: Could not read dump '{dump_path}': {e}", file=sys.stderr)
+            sys.exit(1)
+        print(f"Info: Read {label_count} labels from '{dump_path}'.", file=sys.stderr)
+    if not normalized_labels:
+        print("Error: No labels found. Check --format and --predicate.", file=sys.stderr)
+        sys.exit(1)
+
+    file_size = write_label_filter(args.output, normalized_labels, args.false_positive_rate)
+    print(f"Info: Wrote label filter '{args.output}' with {len(normalized_labels)} distinct labels ({file_size / 1024 / 1024:.1f} MiB, false positive rate {args.false_positive_rate}).", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
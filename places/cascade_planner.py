@@ -0,0 +1,145 @@
+import json
+import os
+import sys
+import threading
+
+# Hit-rate and cost statistics of the cascade stages of reconcile_region.py, and the opt-in planner that skips
+# stages which rarely pay off (--adaptive-cascade).
+#
+# Statistics are kept per (stage, context specificity): a Wikidata fallback in a district context behaves very
+# differently from the same fallback in a country context. The specificity of the global stages is "global".
+# The expected cost per hit of a stage is its average cost divided by its hit rate; the hit rate is smoothed
+# ((hits + 1) / (attempts + 2)) so that a stage is not written off after a handful of misses. Once a stage has
+# been tried min_attempts times and its expected cost per hit is above max_cost_per_hit seconds, it is skipped,
+# except for every PROBE_INTERVAL-th row, which keeps the statistics current in case the stage starts paying off.
+#
+# Skipping only removes stages; the order of the remaining stages is never changed. A row whose skipped stage
+# would have hit can still be matched by a later, lower-precedence stage, possibly to a different entity, or stay
+# unmatched. Rows left unmatched after a skip are counted.
+
+CASCADE_STATS_FORMAT_VERSION = 1
+GLOBAL_SPECIFICITY = "global"
+DEFAULT_MAX_COST_PER_HIT_SECONDS = 30.0
+DEFAULT_MIN_ATTEMPTS = 20
+PROBE_INTERVAL = 50
+
+def stage_key(stage, specificity):
+    return f"{stage}/{specificity}"
+
+def new_stage_stats():
+    return {"attempts": 0, "hits": 0, "seconds": 0.0, "over_threshold": 0, "skipped": 0}
+
+class CascadePlanner:
+    """Records stage outcomes; if enabled, decides which stages to skip."""
+
+    def __init__(self, enabled=False, max_cost_per_hit=DEFAULT_MAX_COST_PER_HIT_SECONDS, min_attempts=DEFAULT_MIN_ATTEMPTS):
+        self.enabled = enabled
+        self.max_cost_per_hit = max_cost_per_hit
+        self.min_attempts = min_attempts
+        self.stats = {}
+        # Statistics loaded from earlier runs; they count for the decisions but are reported separately
+        self.prior_stats = {}
+        self.lock = threading.Lock()
+
+    def _combined(self, key):
+        current = self.stats.get(key, new_stage_stats())
+        prior = self.prior_stats.get(key, new_stage_stats())
+        return current["attempts"] + prior["attempts"], current["hits"] + prior["hits"], current["seconds"] + prior["seconds"]
+
+    def expected_cost_per_hit(self, stage, specificity):
+        # None until the stage has been tried at least once
+        attempts, hits, seconds = self._combined(stage_key(stage, specificity))
+        if not attempts:
+            return None
+        hit_rate = (hits + 1) / (attempts + 2)
+        return (seconds / attempts) / hit_rate
+
+    def stage_estimate(self, stage, specificity):
+        """(smoothed hit rate, average seconds per attempt) of a stage from the statistics, or None before its first attempt."""
+        attempts, hits, seconds = self._combined(stage_key(stage, specificity))
+        if not attempts:
+            return None
+        return (hits + 1) / (attempts + 2), seconds / attempts
+
+    def predicts_skip(self, stage, specificity):
+        # True if the planner would skip the stage (apart from its probes) with the statistics so far; records nothing
+        if not self.enabled:
+            return False
+        attempts, _, _ = self._combined(stage_key(stage, specificity))
+        expected_cost = self.expected_cost_per_hit(stage, specificity)
+        return attempts >= self.min_attempts and expected_cost is not None and expected_cost > self.max_cost_per_hit
+
+    def should_skip(self, stage, specificity):
+        if not self.enabled:
+            return False
+        with self.lock:
+            return self._should_skip(stage, specificity)
+
+    def _should_skip(self, stage, specificity):
+        key = stage_key(stage, specificity)
+        attempts, _, _ = self._combined(key)
+        if attempts < self.min_attempts:
+            return False
+        expected_cost = self.expected_cost_per_hit(stage, specificity)
+        if expected_cost is None or expected_cost <= self.max_cost_per_hit:
+            return False
+        stage_stats = self.stats.setdefault(key, new_stage_stats())
+        stage_stats["over_threshold"] += 1
+        if stage_stats["over_threshold"] % PROBE_INTERVAL == 0:
+            return False # Probe: run the stage anyway to keep its statistics current
+        stage_stats["skipped"] += 1
+        return True
+
+    def record(self, stage, specificity, hit, seconds):
+        with self.lock:
+            stage_stats = self.stats.setdefault(stage_key(stage, specificity), new_stage_stats())
+            stage_stats["attempts"] += 1
+            stage_stats["hits"] += 1 if hit else 0
+            stage_stats["seconds"] += seconds
+
+    def load(self, stats_path):
+        # Adds the statistics of earlier runs stored in stats_path (if it exists) as priors
+        if not os.path.exists(stats_path):
+            return
+        try:
+            with open(stats_path, 'r', encoding='utf-8') as stats_file:
+                stored_stats = json.load(stats_file)
+            if stored_stats.get("format_version") != CASCADE_STATS_FORMAT_VERSION:
+                print(f"Info: Cascade statistics file '{stats_path}' has an old format. Starting from scratch.", file=sys.stderr)
+                return
+            for key, stage_stats in stored_stats["stages"].items():
+                self.prior_stats[key] = {
+                    "attempts": int(stage_stats["attempts"]), "hits": int(stage_stats["hits"]),
+                    "seconds": float(stage_stats["seconds"]), "over_threshold": 0, "skipped": 0,
+                }
+        except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+            print(f"Warning: Could not read cascade statistics file '{stats_path}': {e}. Starting from scratch.", file=sys.stderr)
+            self.prior_stats = {}
+            return
+        print(f"Info: Loaded cascade statistics for {len(self.prior_stats)} stages from '{stats_path}'.", file=sys.stderr)
+
+    def save(self, stats_path):
+        # Writes the combined statistics of earlier runs and this run
+        stages = {}
+        for key in sorted(set(self.stats) | set(self.prior_stats)):
+            attempts, hits, seconds = self._combined(key)
+            stages[key] = {"attempts": attempts, "hits": hits, "seconds": round(seconds, 3)}
+        try:
+            with open(stats_path, 'w', encoding='utf-8') as stats_file:
+                json.dump({"format_version": CASCADE_STATS_FORMAT_VERSION, "stages": stages}, stats_file, indent=2)
+        except OSError as e:
+            print(f"Warning: Could not write cascade statistics file '{stats_path}': {e}", file=sys.stderr)
+
+    def report_lines(self):
+        # One line per (stage, specificity) seen in this run
+        lines = []
+        for key in sorted(self.stats):
+            stage_stats = self.stats[key]
+            stage, _, specificity = key.rpartition("/")
+            attempts = stage_stats["attempts"]
+            hit_rate = f"{stage_stats['hits'] / attempts:.0%}" if attempts else "-"
+            average_seconds = f"{stage_stats['seconds'] / attempts:.2f}s" if attempts else "-"
+            expected_cost = self.expected_cost_per_hit(stage, specificity)
+            expected_cost_text = f"{expected_cost:.1f}s" if expected_cost is not None else "-"
+            lines.append(f"  {key}: {attempts} attempts, {stage_stats['hits']} hits ({hit_rate}), {average_seconds} per attempt, {expected_cost_text} expected per hit, {stage_stats['skipped']} skipped")
+        return lines
@@ -0,0 +1,105 @@
+import os
+import pickle
+import sys
+
+# Precompiled lookup structure for the top-region definition files of reconcile_region.py.
+#
+# The index is a prefix trie over the normalized (stripped, lower-cased) top-region name tuples of all
+# definition files. A node at depth N holds the contexts of every definition file with N name columns whose
+# key equals the path to that node. Each node also carries the precomputed, ordered candidate list for its
+# path (its own contexts followed by those of its ancestors), so a lookup is a single walk down the trie and
+# returns the same list reconcile_region.py used to build by probing every definition map in turn:
+# most specific definition file first, ties in command-line order.
+#
+# The index can be written to a binary sidecar file and is reused as long as the definition files and their
+# column settings are unchanged.
+
+CONTEXT_INDEX_FORMAT_VERSION = 1
+
+def normalize_context_name_parts(parts):
+    return tuple(part.strip().lower() for part in parts)
+
+def new_trie_node():
+    return {"children": {}, "own_contexts": [], "candidates": []}
+
+def compute_definition_fingerprint(top_region_configs):
+    """Returns a value that changes whenever a definition file or its column configuration changes."""
+    fingerprint = []
+    for config in top_region_configs:
+        file_path = config["file_path"]
+        try:
+            stat_result = os.stat(file_path)
+            file_state = (stat_result.st_size, stat_result.st_mtime_ns)
+        except OSError:
+            file_state = None
+        fingerprint.append((
+            os.path.abspath(file_path),
+            file_state,
+            tuple(config["name_col_indices"]),
+            config["uri_col_idx"],
+        ))
+    return (CONTEXT_INDEX_FORMAT_VERSION, tuple(fingerprint))
+
+def build_context_index(loaded_lookup_configs, top_region_configs):
+    # loaded_lookup_configs must already be sorted by specificity (see parse_arguments in reconcile_region.py)
+    root = new_trie_node()
+    entry_count = 0
+    for lookup_config in loaded_lookup_configs:
+        context_template = {"source_file": lookup_config["file_path"], "specificity": lookup_config["num_name_cols"]}
+        for name_parts, top_region_uri in lookup_config["map_data"].items():
+            node = root
+            for part in name_parts:
+                node = node["children"].setdefault(part, new_trie_node())
+            node["own_contexts"].append(dict(context_template, uri=top_region_uri))
+            entry_count += 1
+
+    # Precompute the ordered candidate list of every node: deeper (more specific) contexts come first
+    pending_nodes = [(child, []) for child in root["children"].values()]
+    while pending_nodes:
+        node, parent_candidates = pending_nodes.pop()
+        node["candidates"] = node["own_contexts"] + parent_candidates
+        for child in node["children"].values():
+            pending_nodes.append((child, node["candidates"]))
+
+    return {
+        "fingerprint": compute_definition_fingerprint(top_region_configs),
+        "root": root,
+        "entry_count": entry_count,
+    }
+
+def lookup_context_candidates(context_index, normalized_key_tuple):
+    """
+    Walks the trie along normalized_key_tuple and returns the ordered list of candidate contexts
+    (dicts with "uri", "source_file" and "specificity"). The returned list is shared and must not be modified.
+    """
+    node = context_index["root"]
+    for part in normalized_key_tuple:
+        child = node["children"].get(part)
+        if child is None:
+            break
+        node = child
+    return node["candidates"]
+
+def save_context_index(context_index, index_path):
+    temp_path = f"{index_path}.tmp"
+    try:
+        with open(temp_path, 'wb') as index_file:
+            pickle.dump(context_index, index_file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, index_path)
+    except OSError as e:
+        print(f"Warning: Could not write context index file '{index_path}': {e}", file=sys.stderr)
+
+def load_context_index(index_path, top_region_configs):
+    """Returns the stored index if it was built from the current definition files, None otherwise."""
+    if not os.path.exists(index_path):
+        return None
+    try:
+        with open(index_path, 'rb') as index_file:
+            context_index = pickle.load(index_file)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ValueError) as e:
+        print(f"Warning: Could not read context index file '{index_path}': {e}. Rebuilding.", file=sys.stderr)
+        return None
+    if not isinstance(context_index, dict) or context_index.get("fingerprint") != compute_definition_fingerprint(top_region_configs):
+        print(f"Info: Context index file '{index_path}' is out of date. Rebuilding.", file=sys.stderr)
+        return None
+    return context_index
@@ -0,0 +1,88 @@
+import threading
+import time
+
+# Per-endpoint circuit breakers for the SPARQL executor in reconcile_region.py.
+#
+# A breaker opens after failure_threshold consecutive failures (timeouts, connection errors, HTTP 429/5xx,
+# undecodable responses) of one endpoint. While it is open, every request to that endpoint is refused immediately
+# with EndpointUnavailableError instead of waiting for the timeout, and the caller defers the row. After the
+# cooldown one trial request is let through (half-open): a success closes the breaker again, a failure re-opens it
+# for another cooldown period. The breakers are shared by all engines of a process, as they describe the endpoint;
+# the threshold and cooldown are passed with each failure (--breaker-failure-threshold, --breaker-cooldown).
+CIRCUIT_BREAKER_FAILURE_THRESHOLD = 5
+CIRCUIT_BREAKER_COOLDOWN_SECONDS = 120
+
+BREAKER_CLOSED = "closed"
+BREAKER_OPEN = "open"
+BREAKER_HALF_OPEN = "half-open"
+
+_circuit_breakers = {}
+_circuit_breakers_lock = threading.Lock()
+
+class EndpointUnavailableError(Exception):
+    """Raised when a request is refused because the endpoint's circuit breaker is open."""
+    def __init__(self, endpoint_url, retry_after_seconds):
+        super().__init__(f"Circuit breaker for {endpoint_url} is open (retry in {retry_after_seconds:.0f}s)")
+        self.endpoint_url = endpoint_url
+        self.retry_after_seconds = retry_after_seconds
+
+class SparqlQueryError(Exception):
+    """Raised when a query was sent but failed (network error, HTTP error, undecodable or malformed response)."""
+    def __init__(self, endpoint_url, query_class, message):
+        super().__init__(f"{query_class or 'query'} to {endpoint_url} failed: {message}")
+        self.endpoint_url = endpoint_url
+        self.query_class = query_class
+        self.message = message
+
+def _get_breaker(endpoint_url):
+    breaker = _circuit_breakers.get(endpoint_url)
+    if breaker is None:
+        breaker = {"state": BREAKER_CLOSED, "consecutive_failures": 0, "opened_at": 0.0, "cooldown_seconds": CIRCUIT_BREAKER_COOLDOWN_SECONDS, "trial_in_flight": False}
+        _circuit_breakers[endpoint_url] = breaker
+    return breaker
+
+def check_circuit_breaker(endpoint_url):
+    """Raises EndpointUnavailableError if requests to endpoint_url must not be sent right now."""
+    with _circuit_breakers_lock:
+        breaker = _get_breaker(endpoint_url)
+        if breaker["state"] == BREAKER_CLOSED:
+            return
+        remaining = breaker["opened_at"] + breaker["cooldown_seconds"] - time.monotonic()
+        if breaker["state"] == BREAKER_OPEN and remaining <= 0:
+            breaker["state"] = BREAKER_HALF_OPEN
+            breaker["trial_in_flight"] = False
+        if breaker["state"] == BREAKER_HALF_OPEN and not breaker["trial_in_flight"]:
+            # Let exactly one trial request through
+            breaker["trial_in_flight"] = True
+            return
+        raise EndpointUnavailableError(endpoint_url, max(remaining, 0.0))
+
+def record_endpoint_success(endpoint_url):
+    with _circuit_breakers_lock:
+        breaker = _get_breaker(endpoint_url)
+        breaker["state"] = BREAKER_CLOSED
+        breaker["consecutive_failures"] = 0
+        breaker["trial_in_flight"] = False
+
+def record_endpoint_failure(endpoint_url, failure_threshold=CIRCUIT_BREAKER_FAILURE_THRESHOLD, cooldown_seconds=CIRCUIT_BREAKER_COOLDOWN_SECONDS):
+    """Counts a failed request. Returns True if this failure opened (or re-opened) the breaker for cooldown_seconds."""
+    with _circuit_breakers_lock:
+        breaker = _get_breaker(endpoint_url)
+        breaker["consecutive_failures"] += 1
+        if breaker["state"] == BREAKER_HALF_OPEN or (breaker["state"] == BREAKER_CLOSED and breaker["consecutive_failures"] >= failure_threshold):
+            breaker["state"] = BREAKER_OPEN
+            breaker["opened_at"] = time.monotonic()
+            breaker["cooldown_seconds"] = cooldown_seconds
+            breaker["trial_in_flight"] = False
+            return True
+        return False
+
+def seconds_until_endpoints_available():
+    # Time until the earliest open breaker allows a trial request again (0 if none is open)
+    with _circuit_breakers_lock:
+        now = time.monotonic()
+        waits = [
+            breaker["opened_at"] + breaker["cooldown_seconds"] - now
+            for breaker in _circuit_breakers.values() if breaker["state"] == BREAKER_OPEN
+        ]
+    return max(min(waits), 0.0) if waits else 0.0
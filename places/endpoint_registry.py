@@ -0,0 +1,110 @@
+import math
+import threading
+import time
+from collections import deque
+
+# Replicas of the logical SPARQL endpoints of reconcile_region.py (--tgn-endpoint, --wikidata-endpoint).
+#
+# A logical endpoint is named by its default URL (SPARQL_ENDPOINT_URL, WIKIDATA_SPARQL_ENDPOINT_URL) and served by
+# one or more replica URLs (the replicas of an engine, see CascadeSettings.endpoint_replicas); without replicas it
+# is its own only replica. The executor tries the replicas in replica_order(): replicas without recent failures
+# first, then the fastest by smoothed latency. The statistics are kept per URL and shared by all engines.
+# Failures and latencies older than REPLICA_PROBE_SECONDS are forgotten for the order, so that a replica that
+# failed or was slow once is measured again. Circuit breakers and adaptive concurrency limits are kept per
+# replica URL, so a failing mirror is skipped while the others keep serving.
+#
+# With --hedge-requests, a request that is still running after the p95 latency of its logical endpoint and query
+# class is duplicated on the next replica (see hedge_delay), and the first answer wins. This adds about 5% more
+# requests and cuts the tail latency of a slow replica. Hedging starts once HEDGE_MIN_SAMPLES latencies are known.
+# The losing request gives its adaptive concurrency slot back as soon as the first answer arrives, but requests
+# cannot cancel it: its HTTP request keeps a connection (and the replica keeps working) until it is answered or
+# reaches the query class timeout. Its outcome still counts for the replica statistics and circuit breaker.
+
+LATENCY_WINDOW = 200
+LATENCY_SMOOTHING = 0.2
+HEDGE_PERCENTILE = 95
+HEDGE_MIN_SAMPLES = 20
+MIN_HEDGE_DELAY_SECONDS = 0.05
+REPLICA_PROBE_SECONDS = 30
+
+_replica_stats = {}
+_latency_windows = {}
+_hedge_counts = {"hedged": 0, "hedge_wins": 0, "failovers": 0}
+_registry_lock = threading.Lock()
+
+def _get_stats(replica_url):
+    stats = _replica_stats.get(replica_url)
+    if stats is None:
+        stats = {"smoothed_latency": None, "consecutive_failures": 0, "requests": 0, "failures": 0, "last_success_at": 0.0, "last_failure_at": 0.0}
+        _replica_stats[replica_url] = stats
+    return stats
+
+def _replica_rank(replica_url, now):
+    # Recent consecutive failures first, then the smoothed latency; both count as 0 once they are stale
+    stats = _get_stats(replica_url)
+    recent_failures = stats["consecutive_failures"] if now - stats["last_failure_at"] < REPLICA_PROBE_SECONDS else 0
+    recent_latency = stats["smoothed_latency"] if stats["smoothed_latency"] is not None and now - stats["last_success_at"] < REPLICA_PROBE_SECONDS else 0.0
+    return (recent_failures, recent_latency)
+
+def replica_order(replica_urls):
+    # The replica URLs of a logical endpoint, healthiest and fastest first; ties keep the given order
+    now = time.monotonic()
+    with _registry_lock:
+        return sorted(replica_urls, key=lambda replica_url: _replica_rank(replica_url, now))
+
+def record_replica_success(endpoint_url, replica_url, query_class, latency_seconds):
+    with _registry_lock:
+        stats = _get_stats(replica_url)
+        stats["requests"] += 1
+        stats["consecutive_failures"] = 0
+        stats["last_success_at"] = time.monotonic()
+        stats["smoothed_latency"] = latency_seconds if stats["smoothed_latency"] is None else (1 - LATENCY_SMOOTHING) * stats["smoothed_latency"] + LATENCY_SMOOTHING * latency_seconds
+        window = _latency_windows.get((endpoint_url, query_class))
+        if window is None:
+            window = deque(maxlen=LATENCY_WINDOW)
+            _latency_windows[(endpoint_url, query_class)] = window
+        window.append(latency_seconds)
+
+def record_replica_failure(replica_url):
+    with _registry_lock:
+        stats = _get_stats(replica_url)
+        stats["requests"] += 1
+        stats["failures"] += 1
+        stats["consecutive_failures"] += 1
+        stats["last_failure_at"] = time.monotonic()
+
+def record_failover():
+    with _registry_lock:
+        _hedge_counts["failovers"] += 1
+
+def record_hedge(won):
+    # A hedged duplicate was sent; won means it answered first
+    with _registry_lock:
+        _hedge_counts["hedged"] += 1
+        if won:
+            _hedge_counts["hedge_wins"] += 1
+
+def hedge_delay(endpoint_url, query_class):
+    """Seconds after which a request to the logical endpoint endpoint_url is hedged, or None if too few latencies are known."""
+    with _registry_lock:
+        window = _latency_windows.get((endpoint_url, query_class))
+        if window is None or len(window) < HEDGE_MIN_SAMPLES:
+            return None
+        latencies = sorted(window)
+    percentile_idx = min(math.ceil(len(latencies) * HEDGE_PERCENTILE / 100) - 1, len(latencies) - 1)
+    return max(latencies[percentile_idx], MIN_HEDGE_DELAY_SECONDS)
+
+def replica_report_lines(replica_urls_by_endpoint):
+    # One line per replica of an endpoint with more than one replica (logical endpoint URL -> replica URLs), plus the failover and hedging counts
+    with _registry_lock:
+        replicated = {endpoint_url: list(replica_urls) for endpoint_url, replica_urls in replica_urls_by_endpoint.items() if len(replica_urls) > 1}
+        lines = []
+        for endpoint_url, replica_urls in replicated.items():
+            lines.append(f"  {endpoint_url}:")
+            for replica_url in replica_urls:
+                stats = _get_stats(replica_url)
+                latency_text = f"{stats['smoothed_latency']:.2f}s" if stats["smoothed_latency"] is not None else "-"
+                lines.append(f"    {replica_url}: {stats['requests']} requests, {stats['failures']} failed, smoothed latency {latency_text}")
+        if replicated:
+            lines.append(f"  {_hedge_counts['failovers']} failovers, {_hedge_counts['hedged']} hedged requests ({_hedge_counts['hedge_wins']} answered first by the hedge)")
+    return lines
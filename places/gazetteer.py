@@ -0,0 +1,97 @@
+import json
+import mmap
+import os
+import struct
+
+# Read-only gazetteer of reviewed matches, consulted by reconcile_region.py and reconcile_countries.py before any
+# network stage. Built from reconciled CSV files by build_gazetteer.py.
+#
+# Entries are keyed by (normalized name, parent context URI); the context URI is "" for names reconciled
+# without a context (e.g. countries). The file is a sorted table that is memory-mapped, so several processes
+# share the same pages and a lookup is a binary search over the index without loading the file:
+#
+#   header   magic (8 bytes), entry count (uint64)
+#   index    entry count records of (key offset, key length, value offset, value length), sorted by key bytes
+#   data     UTF-8 keys (name + KEY_SEPARATOR + context URI) and JSON values (column name -> value)
+
+GAZETTEER_MAGIC = b"RCGAZ001"
+HEADER_STRUCT = struct.Struct("<8sQ")
+INDEX_RECORD_STRUCT = struct.Struct("<QIQI")
+KEY_SEPARATOR = "\x1f"
+
+def normalize_gazetteer_name(name):
+    # Same case-insensitive comparison as the "^name$" label match of the SPARQL templates
+    return name.strip().casefold()
+
+def make_gazetteer_key(name, context_uri=""):
+    return f"{normalize_gazetteer_name(name)}{KEY_SEPARATOR}{context_uri or ''}".encode("utf-8")
+
+def split_gazetteer_key(key):
+    name, _, context_uri = key.decode("utf-8").partition(KEY_SEPARATOR)
+    return name, context_uri
+
+def write_gazetteer(gazetteer_path, entries):
+    """Writes entries (key bytes from make_gazetteer_key -> dict of column values) as a gazetteer file."""
+    sorted_keys = sorted(entries)
+    index_size = HEADER_STRUCT.size + INDEX_RECORD_STRUCT.size * len(sorted_keys)
+    index_parts = [HEADER_STRUCT.pack(GAZETTEER_MAGIC, len(sorted_keys))]
+    data_parts = []
+    data_offset = index_size
+    for key in sorted_keys:
+        value = json.dumps(entries[key], ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        index_parts.append(INDEX_RECORD_STRUCT.pack(data_offset, len(key), data_offset + len(key), len(value)))
+        data_parts.append(key)
+        data_parts.append(value)
+        data_offset += len(key) + len(value)
+
+    temp_path = f"{gazetteer_path}.tmp"
+    with open(temp_path, 'wb') as gazetteer_file:
+        gazetteer_file.write(b"".join(index_parts))
+        gazetteer_file.write(b"".join(data_parts))
+    os.replace(temp_path, gazetteer_path)
+
+class Gazetteer:
+    """Memory-mapped, read-only view of a gazetteer file. Raises OSError or ValueError if it cannot be opened."""
+
+    def __init__(self, gazetteer_path):
+        self.path = gazetteer_path
+        with open(gazetteer_path, 'rb') as gazetteer_file:
+            self.data = mmap.mmap(gazetteer_file.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.data) < HEADER_STRUCT.size:
+            raise ValueError(f"'{gazetteer_path}' is too short to be a gazetteer file")
+        magic, self.entry_count = HEADER_STRUCT.unpack_from(self.data, 0)
+        if magic != GAZETTEER_MAGIC:
+            raise ValueError(f"'{gazetteer_path}' is not a gazetteer file (or was written by an incompatible version)")
+
+    def _record(self, position):
+        return INDEX_RECORD_STRUCT.unpack_from(self.data, HEADER_STRUCT.size + position * INDEX_RECORD_STRUCT.size)
+
+    def _key_at(self, position):
+        key_offset, key_length, _, _ = self._record(position)
+        return self.data[key_offset:key_offset + key_length]
+
+    def _value_at(self, position):
+        _, _, value_offset, value_length = self._record(position)
+        return json.loads(self.data[value_offset:value_offset + value_length].decode("utf-8"))
+
+    def lookup(self, name, context_uri=""):
+        """Returns the stored column values for (name, context_uri), or None."""
+        key = make_gazetteer_key(name, context_uri)
+        low, high = 0, self.entry_count
+        while low < high:
+            middle = (low + high) // 2
+            if self._key_at(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.entry_count and self._key_at(low) == key:
+            return self._value_at(low)
+        return None
+
+    def entries(self):
+        # Yields (key bytes, values) in key order
+        for position in range(self.entry_count):
+            yield self._key_at(position), self._value_at(position)
+
+    def close(self):
+        self.data.close()
@@ -0,0 +1,91 @@
+import hashlib
+import math
+import mmap
+import os
+import struct
+
+from label_matching import MATCH_MODE_REGEX
+
+# Bloom filter of all case-folded labels of a vocabulary (TGN getty:term, Wikidata skos:prefLabel), used by
+# reconcile_region.py (--tgn-label-filter, --wikidata-label-filter) to skip the stages of names that no label of
+# the vocabulary can match. Built offline from a dump with build_label_filter.py.
+#
+# A Bloom filter has no false negatives: a name reported absent has no equal label (case-insensitively), so its
+# queries could not have matched. A name reported present may still be absent (false positive rate chosen at build
+# time, 1% by default) and is queried as usual. The file is memory-mapped, so loading it takes no time:
+#
+#   header   magic (8 bytes), bit count (uint64), label count (uint64), hash count (uint32)
+#   bits     bit count bits, little-endian within each byte
+
+LABEL_FILTER_MAGIC = b"RCBLM001"
+HEADER_STRUCT = struct.Struct("<8sQQI")
+DEFAULT_FALSE_POSITIVE_RATE = 0.01
+# Characters that give "^term$" a meaning other than an exact match in the regex match mode
+REGEX_METACHARACTERS = frozenset(".^$*+?{}[]\\|()")
+
+def normalize_filter_label(label):
+    # Case folding equates at least the labels that REGEX(..., "i"), LCASE and the client-side verification equate
+    return label.strip().casefold()
+
+def label_bit_positions(normalized_label, bit_count, hash_count):
+    # Double hashing: hash_count positions from the two halves of one 128-bit digest
+    digest = hashlib.blake2b(normalized_label.encode("utf-8"), digest_size=16).digest()
+    first_hash = int.from_bytes(digest[:8], "little")
+    second_hash = int.from_bytes(digest[8:], "little") | 1
+    return [(first_hash + hash_idx * second_hash) % bit_count for hash_idx in range(hash_count)]
+
+def filter_dimensions(label_count, false_positive_rate):
+    # (bit count, hash count) of the smallest Bloom filter with false_positive_rate for label_count labels
+    label_count = max(label_count, 1)
+    bit_count = max(int(math.ceil(-label_count * math.log(false_positive_rate) / (math.log(2) ** 2))), 8)
+    hash_count = max(int(round(bit_count / label_count * math.log(2))), 1)
+    return bit_count, hash_count
+
+def write_label_filter(label_filter_path, normalized_labels, false_positive_rate=DEFAULT_FALSE_POSITIVE_RATE):
+    """Writes a label filter of normalized_labels (a set of normalize_filter_label() values). Returns its size in bytes."""
+    bit_count, hash_count = filter_dimensions(len(normalized_labels), false_positive_rate)
+    bits = bytearray((bit_count + 7) // 8)
+    for normalized_label in normalized_labels:
+        for bit_position in label_bit_positions(normalized_label, bit_count, hash_count):
+            bits[bit_position >> 3] |= 1 << (bit_position & 7)
+
+    temp_path = f"{label_filter_path}.tmp"
+    with open(temp_path, 'wb') as label_filter_file:
+        label_filter_file.write(HEADER_STRUCT.pack(LABEL_FILTER_MAGIC, bit_count, len(normalized_labels), hash_count))
+        label_filter_file.write(bits)
+    os.replace(temp_path, label_filter_path)
+    return HEADER_STRUCT.size + len(bits)
+
+class LabelFilter:
+    """Memory-mapped, read-only view of a label filter file. Raises OSError or ValueError if it cannot be opened."""
+
+    def __init__(self, label_filter_path):
+        self.path = label_filter_path
+        with open(label_filter_path, 'rb') as label_filter_file:
+            self.data = mmap.mmap(label_filter_file.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.data) < HEADER_STRUCT.size:
+            raise ValueError(f"'{label_filter_path}' is too short to be a label filter file")
+        magic, self.bit_count, self.label_count, self.hash_count = HEADER_STRUCT.unpack_from(self.data, 0)
+        if magic != LABEL_FILTER_MAGIC:
+            raise ValueError(f"'{label_filter_path}' is not a label filter file (or was written by an incompatible version)")
+        if self.bit_count == 0 or len(self.data) < HEADER_STRUCT.size + (self.bit_count + 7) // 8:
+            raise ValueError(f"'{label_filter_path}' is truncated")
+
+    def may_contain(self, label):
+        """False if no label of the filter equals label case-insensitively; True if one probably does."""
+        for bit_position in label_bit_positions(normalize_filter_label(label), self.bit_count, self.hash_count):
+            if not self.data[HEADER_STRUCT.size + (bit_position >> 3)] & (1 << (bit_position & 7)):
+                return False
+        return True
+
+    def excludes(self, term, match_mode):
+        """
+        True if the label match of term (build_label_match_clause with match_mode) cannot find any label of the filter.
+        In the regex mode, terms with regex metacharacters are never excluded, as they do not only match themselves.
+        """
+        if match_mode == MATCH_MODE_REGEX and any(character in REGEX_METACHARACTERS for character in term):
+            return False
+        return not self.may_contain(term)
+
+    def close(self):
+        self.data.close()
@@ -0,0 +1,92 @@
+import re
+
+# Label matching strategies used by the SPARQL templates in reconcile_region.py and reconcile_countries.py.
+# Each template contains a {label_match_clause} placeholder which is filled by build_label_match_clause().
+#
+#   regex        FILTER(REGEX(?label, "^term$", "i")) - the original behaviour, scans every label.
+#   variants     VALUES over a set of case variants (and language tags) generated on the client.
+#                Exact literal lookups can be answered from the engine's object index.
+#   lcase        FILTER(LCASE(STR(?label)) = "term") - no regex engine, but still a scan on most stores.
+#   qlever-text  QLever text index (ql:contains-word / ql:contains-entity) narrows the candidates,
+#                an LCASE equality filter is applied to the survivors and the match is verified client-side.
+MATCH_MODE_REGEX = "regex"
+MATCH_MODE_VARIANTS = "variants"
+MATCH_MODE_LCASE = "lcase"
+MATCH_MODE_QLEVER_TEXT = "qlever-text"
+MATCH_MODES = [MATCH_MODE_REGEX, MATCH_MODE_VARIANTS, MATCH_MODE_LCASE, MATCH_MODE_QLEVER_TEXT]
+DEFAULT_MATCH_MODE = MATCH_MODE_REGEX
+
+# Match modes whose server-side result is only a candidate set and must be checked with label_matches_exactly()
+CLIENT_VERIFIED_MATCH_MODES = {MATCH_MODE_QLEVER_TEXT}
+
+# Language tags combined with every case variant in "variants" mode.
+# getty:term and skos:prefLabel literals may carry a language tag, and an exact literal only matches
+# if the tag is identical. "" stands for a plain (untagged) literal.
+EXACT_MATCH_LANGUAGE_TAGS = ["", "en", "it", "de", "fr", "es", "nl", "pt", "la"]
+
+def escape_sparql_string(text):
+    # Escape a Python string for use inside a double-quoted SPARQL literal
+    return text.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n').replace('\r', '\\r')
+
+def generate_case_variants(term):
+    """Returns the distinct case variants of term that are tried in "variants" mode, original spelling first."""
+    stripped = term.strip()
+    lowered = stripped.lower()
+    candidates = [
+        stripped,
+        lowered,
+        stripped.upper(),
+        lowered.capitalize(),
+        lowered.title(),
+        # Title case that only touches the first letter of each space-separated word ("Stati Uniti d'America" stays intact)
+        " ".join(word[:1].upper() + word[1:] for word in stripped.split(" ")),
+        " ".join(word[:1].upper() + word[1:] for word in lowered.split(" ")),
+    ]
+    variants = []
+    for candidate in candidates:
+        if candidate and candidate not in variants:
+            variants.append(candidate)
+    return variants
+
+def extract_text_index_words(term):
+    # QLever tokenizes text records on non-word characters and lower-cases them
+    return re.findall(r"\w+", term.lower())
+
+def build_label_match_clause(label_var, term, match_mode=DEFAULT_MATCH_MODE, language_tags=None):
+    """
+    Returns the SPARQL fragment that restricts ?label_var to labels equal (case-insensitively) to term.
+    label_var is the variable name without the leading '?'.
+    """
+    if match_mode == MATCH_MODE_REGEX:
+        return f'FILTER(REGEX(?{label_var}, "^{escape_sparql_string(term)}$", "i")) .'
+
+    if match_mode == MATCH_MODE_VARIANTS:
+        tags = EXACT_MATCH_LANGUAGE_TAGS if language_tags is None else language_tags
+        literals = []
+        for variant in generate_case_variants(term):
+            escaped_variant = escape_sparql_string(variant)
+            for tag in tags:
+                literals.append(f'"{escaped_variant}"@{tag}' if tag else f'"{escaped_variant}"')
+        return f"VALUES ?{label_var} {{ {' '.join(literals)} }}"
+
+    lcase_filter = f'FILTER(LCASE(STR(?{label_var})) = "{escape_sparql_string(term.strip().lower())}") .'
+
+    if match_mode == MATCH_MODE_LCASE:
+        return lcase_filter
+
+    if match_mode == MATCH_MODE_QLEVER_TEXT:
+        words = extract_text_index_words(term)
+        if not words:
+            # Nothing the text index could look up (e.g. only punctuation), use the plain equality filter
+            return lcase_filter
+        return (
+            f'?{label_var}_text_record ql:contains-word "{escape_sparql_string(" ".join(words))}" .\n'
+            f'        ?{label_var}_text_record ql:contains-entity ?{label_var} .\n'
+            f'        {lcase_filter}'
+        )
+
+    raise ValueError(f"Unknown label match mode '{match_mode}'. Expected one of: {', '.join(MATCH_MODES)}")
+
+def label_matches_exactly(candidate_label, term):
+    # Client-side check of the "^term$" case-insensitive semantics for candidate sets returned by the text index
+    return candidate_label.strip().casefold() == term.strip().casefold()
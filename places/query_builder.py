@@ -0,0 +1,259 @@
+import re
+
+# Builds the TGN query templates of reconcile_region.py and reconcile_countries.py from one description: a candidate
+# part per query kind (label match, context distance, place type rank) and one detail fragment per output column.
+# The result is a str.format() template with the same placeholders as the hand-written templates
+# ({label_match_clause}, {top_region_uri}, {tgn_uri_direct}), so the doubled braces below are intentional.
+#
+# All label_<code> columns come from a single OPTIONAL over pref and alt labels, restricted to the requested
+# languages with VALUES, instead of a pref and an alt OPTIONAL per language. The solutions per entity then grow
+# with the number of labels in those languages, not with their product, and another language adds one VALUES entry.
+# A language's preferred label wins over its alternative labels; among several, the smallest term is taken.
+# Only the requested columns are fetched (--fields), and the federated Wikidata lookup is only added if a
+# Wikidata column is requested and a SERVICE endpoint is given (none with --deferred-wikidata).
+
+DEFAULT_LABEL_LANGUAGES = ("en", "it", "de", "fr")
+# Getty language URIs end in a lowercase code, e.g. en, it, zh-latn-pinyin
+LANGUAGE_CODE_PATTERN = re.compile(r"^[a-z]{2,3}(?:-[a-z0-9]+)*$")
+LANGUAGE_URI_PREFIX = "http://vocab.getty.edu/language/"
+
+QUERY_KIND_CONTEXTUAL = "contextual" # Ranked candidates up to 5 broaderPreferred levels below {top_region_uri}
+QUERY_KIND_GLOBAL = "global" # Ranked candidates anywhere in TGN
+QUERY_KIND_DETAILS = "details" # The entity {tgn_uri_direct} (or the entity replacing it)
+QUERY_KIND_COUNTRY = "country" # Sovereign states; one result per matching entity
+
+WIKIDATA_COLUMNS = ("wikidata_uri", "wikidata_description", "wikidata_label")
+
+QUERY_PREFIXES = """
+PREFIX skosxl: <http://www.w3.org/2008/05/skos-xl#>
+PREFIX getty: <http://vocab.getty.edu/ontology#>
+PREFIX dcterms: <http://purl.org/dc/terms/>
+PREFIX dc: <http://purl.org/dc/elements/1.1/>
+PREFIX ql: <http://qlever.cs.uni-freiburg.de/builtin-functions/>
+PREFIX rdf: <http://www.w3.org/1999/02/22-rdf-syntax-ns#>
+PREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#>
+PREFIX gvp: <http://vocab.getty.edu/ontology#>
+PREFIX wdt: <http://www.wikidata.org/prop/direct/>
+PREFIX schema: <http://schema.org/>
+"""
+
+LABEL_MATCH_FRAGMENT = """
+        # Label matching
+        ?tgn_uri skosxl:prefLabel|skosxl:altLabel ?entity .
+        ?entity getty:term ?found_label_uri .
+        {label_match_clause}
+"""
+
+# Deepest getty:broaderPreferred level below the context searched by the contextual queries
+MAX_CONTEXT_DISTANCE = 5
+
+def context_distance_fragment(distance_variable):
+    # ?tgn_uri must be within MAX_CONTEXT_DISTANCE levels of top_region_uri using getty:broaderPreferred; binds the
+    # number of levels to ?distance_variable (one solution per level at which ?tgn_uri is found)
+    branches = [
+        "        {{ ?tgn_uri " + "/".join(["getty:broaderPreferred"] * distance) + " <{top_region_uri}> . BIND(" + str(distance) + " AS ?" + distance_variable + ") }}\n"
+        for distance in range(1, MAX_CONTEXT_DISTANCE + 1)
+    ]
+    return "\n" + "        UNION\n".join(branches)
+
+# Distance of the ranked contextual queries (distance_rank)
+CONTEXT_DISTANCE_FRAGMENT = context_distance_fragment("distance_rank_val")
+
+# Binds ?type_rank_val. Rank 1: preferred place type is a political division (or narrower), 2: preferred place type
+# is an inhabited place (or narrower), 3: non-preferred place type is an inhabited place (or narrower), 4: anything
+# else. tgn_ranking.py applies the same rules locally.
+CONTEXTUAL_TYPE_RANK_FRAGMENT = """
+        OPTIONAL {{
+            ?tgn_uri (getty:placeTypePreferred)/(getty:broaderPreferred*) <http://vocab.getty.edu/aat/300236157> .
+            BIND(1 AS ?type_pref_match)
+        }}
+        OPTIONAL {{
+            ?tgn_uri (getty:placeTypePreferred)/(getty:broaderPreferred*) <http://vocab.getty.edu/aat/300008347> .
+            BIND(2 AS ?type_pref_match)
+        }}
+        OPTIONAL {{
+            ?tgn_uri (getty:placeTypeNonPreferred)/(getty:broaderPreferred*) <http://vocab.getty.edu/aat/300008347> .
+            BIND(3 AS ?type_nonpref_match)
+        }}
+        BIND(COALESCE(?type_pref_match, ?type_nonpref_match, 4) AS ?type_rank_val)
+"""
+
+# Rank 1: preferred place type is an inhabited place (or narrower), 2: non-preferred place type is one, 3: anything else
+GLOBAL_TYPE_RANK_FRAGMENT = """
+        OPTIONAL {{
+            ?tgn_uri (getty:placeTypePreferred)/(getty:broaderPreferred*) <http://vocab.getty.edu/aat/300008347> .
+            BIND(1 AS ?type_pref_match)
+        }}
+        OPTIONAL {{
+            ?tgn_uri (getty:placeTypeNonPreferred)/(getty:broaderPreferred*) <http://vocab.getty.edu/aat/300008347> .
+            BIND(2 AS ?type_nonpref_match)
+        }}
+        BIND(COALESCE(?type_pref_match, ?type_nonpref_match, 3) AS ?type_rank_val)
+"""
+
+SOVEREIGN_STATE_FRAGMENT = """
+    ?tgn_uri getty:placeTypePreferred/getty:broaderPreferred* <http://vocab.getty.edu/aat/300232420> . # Sovereign State
+"""
+
+# Pref and alt labels of the requested languages; ?ranked_label starts with "0" for pref and "1" for alt labels
+LABELS_FRAGMENT = """
+    # Labels (Pref or Alt) in the requested languages
+    OPTIONAL {{
+      VALUES ?label_property {{ skosxl:prefLabel skosxl:altLabel }}
+      VALUES ?label_language {{ LANGUAGE_URIS }}
+      ?tgn_uri ?label_property ?label_entity .
+      ?label_entity dcterms:language ?label_language .
+      ?label_entity getty:term ?label_term .
+      BIND(CONCAT(IF(?label_property = skosxl:prefLabel, "0", "1"), STR(?label_term)) AS ?ranked_label)
+    }}
+"""
+# The smallest ranked label of a language without its rank; "~" sorts after every ranked label and leaves ""
+LABEL_PROJECTION = '(SUBSTR(MIN(IF(BOUND(?ranked_label) && ?label_language = <LANGUAGE_URI>, ?ranked_label, "~")), 2) AS ?COLUMN_NAME)'
+
+# Output column -> (fragment, projection) of the other TGN columns
+DETAIL_FRAGMENTS = {
+    "type": ("""
+    # Getty Place Type (Preferred GVP Term)
+    OPTIONAL {{
+      ?tgn_uri getty:placeTypePreferred ?placeTypeEntity .
+      ?placeTypeEntity getty:prefLabelGVP ?prefGVPLabelEntity .
+      ?prefGVPLabelEntity getty:term ?type_term .
+    }}
+""", "(SAMPLE(?type_term) AS ?type)"),
+    "scope_note": ("""
+    # Scope Note
+    OPTIONAL {{
+      ?tgn_uri <http://www.w3.org/2004/02/skos/core#scopeNote>/rdf:value ?scope_note_x .
+    }}
+""", "(SAMPLE(?scope_note_x) AS ?scope_note)"),
+    "label": ("""
+    # GVP Label (prefLabelGVP/term)
+    OPTIONAL {{
+      ?tgn_uri gvp:prefLabelGVP ?gvpLabelEntity .
+      ?gvpLabelEntity gvp:term ?label_gvp_term .
+    }}
+""", "(SAMPLE(?label_gvp_term) AS ?label)"),
+}
+
+# Wikidata column -> (OPTIONAL inside the SERVICE block or None, BIND after it, projection)
+WIKIDATA_FRAGMENTS = {
+    "wikidata_uri": (None, 'BIND(COALESCE(?wd_uri, "") AS ?wikidata_uri_coalesced)', "(SAMPLE(?wikidata_uri_coalesced) AS ?wikidata_uri)"),
+    "wikidata_label": ("""
+        OPTIONAL {{
+          ?wd_uri rdfs:label ?wd_label .
+          FILTER (lang(?wd_label) = "en") .
+        }}""", 'BIND(COALESCE(?wd_label, "") AS ?wikidata_label_coalesced)', "(SAMPLE(?wikidata_label_coalesced) AS ?wikidata_label)"),
+    "wikidata_description": ("""
+        OPTIONAL {{
+          ?wd_uri schema:description ?wd_desc .
+          FILTER (lang(?wd_desc) = "en") .
+        }}""", 'BIND(COALESCE(?wd_desc, "") AS ?wikidata_description_coalesced)', "(SAMPLE(?wikidata_description_coalesced) AS ?wikidata_description)"),
+}
+
+def parse_label_languages(language_list):
+    """Parses a comma-separated list of Getty language codes (--languages). Raises ValueError for an invalid code."""
+    languages = list(dict.fromkeys(code.strip().lower() for code in language_list.split(',') if code.strip()))
+    if not languages:
+        raise ValueError("--languages must name at least one language code.")
+    invalid_codes = [code for code in languages if not LANGUAGE_CODE_PATTERN.match(code)]
+    if invalid_codes:
+        raise ValueError(f"Invalid language code(s) in --languages: {', '.join(invalid_codes)}.")
+    return languages
+
+def label_columns(languages):
+    return [f"label_{code}" for code in languages]
+
+def label_languages_of_columns(columns):
+    # Language codes of the label_<code> columns, in column order
+    return [column_name[len("label_"):] for column_name in columns if column_name.startswith("label_") and LANGUAGE_CODE_PATTERN.match(column_name[len("label_"):])]
+
+def build_wikidata_fragment(wikidata_columns, wikidata_service_url, identifier_in_optional):
+    # The federated lookup of the entity with the TGN ID of ?tgn_uri. The ranked queries require dc:identifier
+    # outside of it, the other kinds look it up inside the OPTIONAL.
+    inner_optionals = "".join(WIKIDATA_FRAGMENTS[column_name][0] for column_name in wikidata_columns if WIKIDATA_FRAGMENTS[column_name][0])
+    identifier_pattern = "\n      ?tgn_uri dc:identifier ?tgn_id_str ." if identifier_in_optional else ""
+    binds = "\n".join("    " + WIKIDATA_FRAGMENTS[column_name][1] for column_name in wikidata_columns)
+    return (
+        "\n    # Wikidata Service Call\n"
+        "    OPTIONAL {{" + identifier_pattern + "\n"
+        "      SERVICE <" + wikidata_service_url + "> {{\n"
+        "        ?wd_uri wdt:P1667 ?tgn_id_str ." + inner_optionals + "\n"
+        "      }}\n"
+        "    }}\n"
+        + binds + "\n"
+    )
+
+def build_tgn_query_template(query_kind, columns, wikidata_service_url=None, candidate_limit=1):
+    """
+    Returns the str.format() template of a TGN query of query_kind (QUERY_KIND_*) that fetches the output columns in
+    columns: "label" (GVP label), "label_<language code>", "type", "scope_note" and, if wikidata_service_url (the
+    federated Wikidata endpoint) is given, "wikidata_uri", "wikidata_description" and "wikidata_label" (country
+    queries only). Other columns (tgn_uri, term) are the result keys and always returned by the search kinds.
+    The contextual and global queries return the candidate_limit best candidates; with more than one, each comes
+    with its ?type_rank (and, contextual only, ?distance_rank). Returns None for a QUERY_KIND_DETAILS query without
+    any column to fetch.
+    """
+    detail_fragments = []
+    projections = []
+    languages = label_languages_of_columns(columns)
+    if languages:
+        language_uris = " ".join(f"<{LANGUAGE_URI_PREFIX}{code}>" for code in languages)
+        detail_fragments.append(LABELS_FRAGMENT.replace("LANGUAGE_URIS", language_uris))
+        projections.extend(LABEL_PROJECTION.replace("LANGUAGE_URI", LANGUAGE_URI_PREFIX + code).replace("COLUMN_NAME", f"label_{code}") for code in languages)
+    for column_name, (fragment, projection) in DETAIL_FRAGMENTS.items():
+        if column_name in columns:
+            detail_fragments.append(fragment)
+            projections.append(projection)
+    wikidata_columns = [column_name for column_name in WIKIDATA_FRAGMENTS if column_name in columns and (column_name != "wikidata_label" or query_kind == QUERY_KIND_COUNTRY)]
+    if wikidata_service_url and wikidata_columns:
+        detail_fragments.append(build_wikidata_fragment(wikidata_columns, wikidata_service_url, identifier_in_optional=query_kind in (QUERY_KIND_DETAILS, QUERY_KIND_COUNTRY)))
+        projections.extend(WIKIDATA_FRAGMENTS[column_name][2] for column_name in wikidata_columns)
+    details = "".join(detail_fragments)
+
+    if query_kind == QUERY_KIND_DETAILS:
+        if not projections:
+            return None
+        return (
+            QUERY_PREFIXES + "\nSELECT\n    " + "\n    ".join(projections) + "\nWHERE {{\n"
+            "    BIND(<{tgn_uri_direct}> AS ?tgn_uri_from_wiki) .\n"
+            "    OPTIONAL {{\n"
+            "      ?tgn_uri_from_wiki dcterms:isReplacedBy ?tgn_uri_replacement .\n"
+            "    }}\n"
+            "    BIND(COALESCE(?tgn_uri_replacement, ?tgn_uri_from_wiki) AS ?tgn_uri) .\n"
+            + details + "}}\nLIMIT 1\n"
+        )
+    if query_kind == QUERY_KIND_COUNTRY:
+        query_template = (
+            QUERY_PREFIXES + "\nSELECT ?tgn_uri " + " ".join(projections + ["(SAMPLE(STR(?found_label_uri)) AS ?matched_label)"]) + " WHERE {{"
+            + LABEL_MATCH_FRAGMENT + SOVEREIGN_STATE_FRAGMENT + details + "}}\nGROUP BY ?tgn_uri\n"
+        )
+        # The countries output calls the entity URI "term"
+        return query_template.replace("?tgn_uri", "?term")
+
+    if query_kind == QUERY_KIND_CONTEXTUAL:
+        rank_aggregates = "(MIN(?distance_rank_val) AS ?min_distance_rank) (MIN(?type_rank_val) AS ?final_type_rank)"
+        candidate_fragments = LABEL_MATCH_FRAGMENT + CONTEXT_DISTANCE_FRAGMENT + CONTEXTUAL_TYPE_RANK_FRAGMENT
+        order_by = "ORDER BY ASC(SAMPLE(?final_type_rank)) ASC(SAMPLE(?min_distance_rank)) # Primary sort by type, secondary by distance"
+        rank_projections = ["(SAMPLE(?final_type_rank) AS ?type_rank)", "(SAMPLE(?min_distance_rank) AS ?distance_rank)"]
+    elif query_kind == QUERY_KIND_GLOBAL:
+        rank_aggregates = "(MIN(?type_rank_val) AS ?final_type_rank)"
+        candidate_fragments = LABEL_MATCH_FRAGMENT + GLOBAL_TYPE_RANK_FRAGMENT
+        order_by = "ORDER BY ASC(SAMPLE(?final_type_rank)) # Only sort by type for global search"
+        rank_projections = ["(SAMPLE(?final_type_rank) AS ?type_rank)"]
+    else:
+        raise ValueError(f"Unknown query kind '{query_kind}'.")
+    if candidate_limit > 1:
+        # --top-k: the ranks are returned with each candidate
+        projections = projections + rank_projections
+    return (
+        QUERY_PREFIXES + "\nSELECT ?tgn_uri " + " ".join(projections + ["(SAMPLE(?matched_label_inner) AS ?matched_label)"]) + " WHERE {{\n"
+        "  # Subquery to find candidate entities and calculate their priority rank\n"
+        "  {{\n"
+        "    SELECT ?tgn_uri " + rank_aggregates + " (SAMPLE(STR(?found_label_uri)) AS ?matched_label_inner)\n"
+        "    WHERE {{" + candidate_fragments + "    }} GROUP BY ?tgn_uri\n"
+        "  }}\n"
+        "\n"
+        "  # Fetch details for the ranked ?tgn_uri(s); the TGN ID is required, as it is used for the Wikidata lookup\n"
+        "    ?tgn_uri dc:identifier ?tgn_id_str .\n"
+        + details + "}}\nGROUP BY ?tgn_uri\n" + order_by + f"\nLIMIT {candidate_limit}\n"
+    )
@@ -4,114 +4,59 @@ import json
 import requests
 import sys
 from collections import defaultdict
+from gazetteer import Gazetteer
+
+from label_matching import (
+    CLIENT_VERIFIED_MATCH_MODES,
+    DEFAULT_MATCH_MODE,
+    MATCH_MODES,
+    build_label_match_clause,
+    label_matches_exactly,
+)
+from query_builder import DEFAULT_LABEL_LANGUAGES, QUERY_KIND_COUNTRY, build_tgn_query_template, label_columns, parse_label_languages
 
 SPARQL_ENDPOINT_URL = "https://dev.artresearch.net/sparql?repository=3rd-party"
 SPARQL_USERNAME = ""
 SPARQL_PASSWORD = ""
 
-# SPARQL query for TGN
-SPARQL_QUERY_TEMPLATE = """
-PREFIX ql: <http://qlever.cs.uni-freiburg.de/builtin-functions/>
-PREFIX skosxl: <http://www.w3.org/2008/05/skos-xl#>
-PREFIX getty: <http://vocab.getty.edu/ontology#>
-PREFIX dcterms: <http://purl.org/dc/terms/>
-PREFIX rdf: <http://www.w3.org/1999/02/22-rdf-syntax-ns#>
-PREFIX dc: <http://purl.org/dc/elements/1.1/>
-PREFIX wdt: <http://www.wikidata.org/prop/direct/>
-PREFIX schema: <http://schema.org/>
-PREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#>
-
-SELECT ?term (SAMPLE(?wikidata_label_coalesced) AS ?wikidata_label) (SAMPLE(?label_en_coalesced) AS ?label_en) (SAMPLE(?label_it_coalesced) AS ?label_it) (SAMPLE(?label_de_coalesced) AS ?label_de) (SAMPLE(?label_fr_coalesced) AS ?label_fr) (SAMPLE(?scope_note_x) AS ?scope_note) (SAMPLE(?wikidata_description_coalesced) AS ?wikidata_description) (SAMPLE(?wikidata_uri_coalesced) AS ?wikidata_uri) {{
-  # values_clause and ?i removed for direct search term injection
-
-    ?term skosxl:prefLabel|skosxl:altLabel ?entity .
-    ?term getty:placeTypePreferred/getty:broaderPreferred* <http://vocab.getty.edu/aat/300232420> . # Sovereign State
-    ?entity getty:term ?found_label_uri .
-    FILTER(REGEX(?found_label_uri, "^{search_word_direct}$", "i")) .
-
-    # English Label (Pref or Alt)
-    OPTIONAL {{
-      ?term skosxl:prefLabel ?enPrefLabelEntity .
-      ?enPrefLabelEntity dcterms:language <http://vocab.getty.edu/language/en> .
-      ?enPrefLabelEntity getty:term ?pref_label_en .
-    }}
-    OPTIONAL {{
-      ?term skosxl:altLabel ?enAltLabelEntity .
-      ?enAltLabelEntity dcterms:language <http://vocab.getty.edu/language/en> .
-      ?enAltLabelEntity getty:term ?alt_label_en .
-    }}
-    BIND(COALESCE(?pref_label_en, ?alt_label_en) AS ?label_en_coalesced) .
+# Wikidata endpoint of the federated lookup in the TGN query
+WIKIDATA_SERVICE_URL = "https://qlever.cs.uni-freiburg.de/api/wikidata"
 
-    # Italian Label (Pref or Alt)
-    OPTIONAL {{
-      ?term skosxl:prefLabel ?itPrefLabelEntity .
-      ?itPrefLabelEntity dcterms:language <http://vocab.getty.edu/language/it> .
-      ?itPrefLabelEntity getty:term ?pref_label_it .
-    }}
-    OPTIONAL {{
-      ?term skosxl:altLabel ?itAltLabelEntity .
-      ?itAltLabelEntity dcterms:language <http://vocab.getty.edu/language/it> .
-      ?itAltLabelEntity getty:term ?alt_label_it .
-    }}
-    BIND(COALESCE(?pref_label_it, ?alt_label_it) AS ?label_it_coalesced) .
-
-    # German Label (Pref or Alt)
-    OPTIONAL {{
-      ?term skosxl:prefLabel ?dePrefLabelEntity .
-      ?dePrefLabelEntity dcterms:language <http://vocab.getty.edu/language/de> .
-      ?dePrefLabelEntity getty:term ?pref_label_de .
-    }}
-    OPTIONAL {{
-      ?term skosxl:altLabel ?deAltLabelEntity .
-      ?deAltLabelEntity dcterms:language <http://vocab.getty.edu/language/de> .
-      ?deAltLabelEntity getty:term ?alt_label_de .
-    }}
-    BIND(COALESCE(?pref_label_de, ?alt_label_de) AS ?label_de_coalesced) .
-
-    # French Label (Pref or Alt)
-    OPTIONAL {{
-      ?term skosxl:prefLabel ?frPrefLabelEntity .
-      ?frPrefLabelEntity dcterms:language <http://vocab.getty.edu/language/fr> .
-      ?frPrefLabelEntity getty:term ?pref_label_fr .
-    }}
-    OPTIONAL {{
-      ?term skosxl:altLabel ?frAltLabelEntity .
-      ?frAltLabelEntity dcterms:language <http://vocab.getty.edu/language/fr> .
-      ?frAltLabelEntity getty:term ?alt_label_fr .
-    }}
-    BIND(COALESCE(?pref_label_fr, ?alt_label_fr) AS ?label_fr_coalesced) .
-    
-    # Scope Note
-    OPTIONAL {{
-      ?term <http://www.w3.org/2004/02/skos/core#scopeNote>/rdf:value ?scope_note_x .
-    }}
+# Output columns of a match, after the input columns and number_of_results
+COUNTRY_RESULT_COLUMNS = [
+    "wikidata_label", "label_en", "label_it", "label_de", "label_fr",
+    "scope_note", "wikidata_description",
+    "term", "wikidata_uri"
+]
 
-    # Wikidata Integration
-    OPTIONAL {{
-      ?term dc:identifier ?tgn_id_str .
-      SERVICE <https://qlever.cs.uni-freiburg.de/api/wikidata> {{
-        ?wd_uri_raw wdt:P1667 ?tgn_id_str . # P1667 is TGN ID
-        OPTIONAL {{
-          ?wd_uri_raw rdfs:label ?wd_label_raw .
-          FILTER (lang(?wd_label_raw) = "en") .
-        }}
-        OPTIONAL {{
-          ?wd_uri_raw schema:description ?wd_desc_raw .
-          FILTER (lang(?wd_desc_raw) = "en") .
-        }}
-      }}
-    }}
-    BIND(COALESCE(?wd_uri_raw, "") AS ?wikidata_uri_coalesced)
-    BIND(COALESCE(?wd_label_raw, "") AS ?wikidata_label_coalesced)
-    BIND(COALESCE(?wd_desc_raw, "") AS ?wikidata_description_coalesced)
-}} GROUP BY ?term
-"""
+def country_result_columns(languages):
+    # COUNTRY_RESULT_COLUMNS with a label column per --languages code
+    return ["wikidata_label"] + label_columns(languages) + ["scope_note", "wikidata_description", "term", "wikidata_uri"]
 
 def parse_arguments():
     parser = argparse.ArgumentParser(description="Reconcile country names from a CSV column against the TGN SPARQL endpoint.")
     parser.add_argument("csv_filename", help="Path to the input CSV file.")
     parser.add_argument("column_number", type=int, help="1-indexed column number containing text to reconcile.")
-    return parser.parse_args()
+    parser.add_argument("--match-mode", choices=MATCH_MODES, default=DEFAULT_MATCH_MODE, help=f"Label matching strategy used in the SPARQL query (default: {DEFAULT_MATCH_MODE}).")
+    parser.add_argument("--gazetteer-file", help="Gazetteer of reviewed matches built with build_gazetteer.py. Terms found in it are not queried.")
+    parser.add_argument("--languages", default=",".join(DEFAULT_LABEL_LANGUAGES), help=f"Comma-separated Getty language codes of the label_<code> columns (default: {','.join(DEFAULT_LABEL_LANGUAGES)}). The preferred label of a language wins over its alternative labels.")
+    parser.add_argument("--fields", help=f"Comma-separated output columns to fetch and write after number_of_results (default: all). The query then skips the label, scope note and Wikidata lookups of the other columns. Columns: {','.join(COUNTRY_RESULT_COLUMNS)} (with a label_<code> column per --languages code).")
+    args = parser.parse_args()
+    try:
+        args.languages = parse_label_languages(args.languages)
+    except ValueError as e:
+        parser.error(str(e))
+    result_columns = country_result_columns(args.languages)
+    if args.fields is None:
+        args.fields = result_columns
+    else:
+        args.fields = list(dict.fromkeys(field.strip() for field in args.fields.split(',') if field.strip()))
+        unknown_fields = [field for field in args.fields if field not in result_columns]
+        if unknown_fields:
+            parser.error(f"Unknown column(s) in --fields: {', '.join(unknown_fields)}. Expected some of: {','.join(result_columns)}.")
+        if not args.fields:
+            parser.error("--fields must name at least one column.")
+    return args
 
 def read_csv_data(filename, column_idx):
     """Reads CSV data and extracts values from the specified column."""
@@ -137,15 +82,16 @@ def read_csv_data(filename, column_idx):
 
 # build_sparql_values_clause is removed as queries are now made one by one.
 
-def execute_sparql_query(query):
-    """Executes the SPARQL query and returns the JSON response."""
+def execute_sparql_query(query, http_session=None):
+    """Executes the SPARQL query (through http_session if given, plain requests.post otherwise) and returns the JSON response."""
     headers = {
         "Accept": "application/sparql-results+json",
         "Content-Type": "application/x-www-form-urlencoded"
     }
     auth = (SPARQL_USERNAME, SPARQL_PASSWORD.replace("&", "&")) # Use actual '&' for auth
     try:
-        response = requests.post(SPARQL_ENDPOINT_URL, data={"query": query}, headers=headers, auth=auth, timeout=300)
+        http_post = http_session.post if http_session is not None else requests.post
+        response = http_post(SPARQL_ENDPOINT_URL, data={"query": query}, headers=headers, auth=auth, timeout=300)
         response.raise_for_status()
         return response.json()
     except requests.exceptions.RequestException as e:
@@ -161,16 +107,62 @@ def execute_sparql_query(query):
 
 # process_results is removed; its logic is integrated into the main loop.
 
-def write_output_csv(original_header, original_data_rows, processed_sparql_results):
-    """Writes the final CSV to stdout."""
+def query_country_term(text, match_mode, log_context="query", fields=COUNTRY_RESULT_COLUMNS, query_templates=None, http_session=None):
+    """
+    Queries TGN for one country term. Returns the list of matches (dicts with the COUNTRY_RESULT_COLUMNS and fields
+    keys), or None if the query failed or returned malformed data. log_context is shown in brackets in the messages.
+    Only the columns in fields are fetched; the others are empty. query_templates caches the query template of each
+    tuple of fields across calls; the request goes through http_session if given.
+    """
+    if query_templates is None:
+        query_templates = {}
+    fields_key = tuple(fields)
+    if fields_key not in query_templates:
+        query_templates[fields_key] = build_tgn_query_template(QUERY_KIND_COUNTRY, fields_key, WIKIDATA_SERVICE_URL)
+    # The label filter (regex, case variants, lcase or QLever text index) is generated for the selected match mode.
+    # build_label_match_clause takes care of escaping the term for the SPARQL string literal.
+    query = query_templates[fields_key].format(label_match_clause=build_label_match_clause("found_label_uri", text, match_mode))
+    # print(f"DEBUG: Query for '{text}':\n{query}", file=sys.stderr) # Uncomment for debugging
+    sparql_response_json = execute_sparql_query(query, http_session)
+
+    if not (sparql_response_json and "results" in sparql_response_json and "bindings" in sparql_response_json["results"]):
+        # execute_sparql_query already prints errors for network/request issues.
+        # This handles cases where the response might be non-JSON or missing expected structure.
+        print(f"Warning: Query failed or returned malformed/empty data for term: '{text}' ({log_context})", file=sys.stderr)
+        return None
+
+    result_items = []
+    bindings = sparql_response_json["results"]["bindings"]
+    if not bindings:
+        print(f"Info: No match found for term: '{text}' ({log_context})", file=sys.stderr)
+    for binding in bindings:
+        if match_mode in CLIENT_VERIFIED_MATCH_MODES and not label_matches_exactly(binding.get("matched_label", {}).get("value", ""), text):
+            print(f"Info: Discarding candidate for term '{text}' whose label is not an exact match. Binding: {binding}", file=sys.stderr)
+            continue
+        try:
+            result_item = {col_name: binding.get(col_name, {}).get("value", "") for col_name in dict.fromkeys(COUNTRY_RESULT_COLUMNS + list(fields))}
+            # Ensure term is present, as it's key
+            if not result_item["term"]:
+                print(f"Warning: Query for '{text}' ({log_context}) succeeded but ?term is missing in result. Binding: {binding}", file=sys.stderr)
+            # Allow appending even if term is missing; write_output_csv will handle empty strings.
+            result_items.append(result_item)
+        except (KeyError, ValueError) as e:
+            print(f"Warning: Could not process a SPARQL binding for term '{text}' ({log_context}): {binding}. Error: {e}", file=sys.stderr)
+            continue
+    return result_items
+
+def country_result_from_gazetteer(gazetteer_values):
+    # Reviewed gazetteer entry -> match dict; entries built from reconcile_region.py output carry the URI in "tgn_uri"
+    result_item = {col_name: gazetteer_values.get(col_name, "") for col_name in COUNTRY_RESULT_COLUMNS}
+    if not result_item["term"]:
+        result_item["term"] = gazetteer_values.get("tgn_uri", "")
+    return result_item
+
+def write_output_csv(original_header, original_data_rows, processed_sparql_results, fields=COUNTRY_RESULT_COLUMNS):
+    """Writes the final CSV to stdout, with number_of_results and the columns in fields after the input columns."""
     writer = csv.writer(sys.stdout)
     
-    new_header = original_header + [
-        "number_of_results", 
-        "wikidata_label", "label_en", "label_it", "label_de", "label_fr", 
-        "scope_note", "wikidata_description", 
-        "term", "wikidata_uri"
-    ]
+    new_header = original_header + ["number_of_results"] + list(fields)
     writer.writerow(new_header)
 
     for i, original_row_data in enumerate(original_data_rows):
@@ -178,24 +170,12 @@ def write_output_csv(original_header, original_data_rows, processed_sparql_resul
         num_results = len(sparql_matches)
 
         if num_results == 0:
-            # num_results, wikidata_label, label_en, label_it, label_de, label_fr, scope_note, wikidata_description, term, wikidata_uri
-            writer.writerow(original_row_data + [0, "", "", "", "", "", "", "", "", ""]) 
+            writer.writerow(original_row_data + [0] + [""] * len(fields))
         else:
             # If multiple matches for one input, write each on a new row but only list num_results once for the first.
             for match_idx, match in enumerate(sparql_matches):
                 current_num_results = num_results if match_idx == 0 else "" # Show count only for the first line of a multi-match
-                writer.writerow(original_row_data + [
-                    current_num_results,
-                    match.get("wikidata_label", ""),
-                    match.get("label_en", ""),
-                    match.get("label_it", ""),
-                    match.get("label_de", ""),
-                    match.get("label_fr", ""),
-                    match.get("scope_note", ""),
-                    match.get("wikidata_description", ""),
-                    match.get("term", ""), 
-                    match.get("wikidata_uri", "")
-                ])
+                writer.writerow(original_row_data + [current_num_results] + [match.get(col_name, "") for col_name in fields])
 
 def main():
     args = parse_arguments()
@@ -209,77 +189,45 @@ def main():
     
     if not texts_with_indices_for_sparql:
         print("No text found in the specified column to query.", file=sys.stderr)
-        writer = csv.writer(sys.stdout)
-        new_header = original_header + [
-            "number_of_results", 
-            "wikidata_label", "label_en", "label_it", "label_de", "label_fr", 
-            "scope_note", "wikidata_description", 
-            "term", "wikidata_uri"
-        ]
-        writer.writerow(new_header)
-        for row_data in original_data_rows:
-            # num_results, wikidata_label, label_en, label_it, label_de, label_fr, scope_note, wikidata_description, term, wikidata_uri
-            writer.writerow(row_data + [0, "", "", "", "", "", "", "", "", ""]) 
+        write_output_csv(original_header, original_data_rows, {}, args.fields)
         sys.exit(0)
 
     processed_sparql_data = defaultdict(list)
+    # Query templates for args.fields, built by the first query
+    query_templates = {}
+
+    if args.gazetteer_file:
+        # Reviewed matches are taken over without querying the endpoint
+        try:
+            gazetteer = Gazetteer(args.gazetteer_file)
+        except (OSError, ValueError) as e:
+            print(f"Error: Could not open gazetteer file '{args.gazetteer_file}': {e}", file=sys.stderr)
+            sys.exit(1)
+        remaining_texts = []
+        for text, original_row_idx in texts_with_indices_for_sparql:
+            gazetteer_values = gazetteer.lookup(text)
+            if gazetteer_values is None:
+                remaining_texts.append((text, original_row_idx))
+                continue
+            processed_sparql_data[original_row_idx].append(country_result_from_gazetteer(gazetteer_values))
+        print(f"Info: Resolved {len(texts_with_indices_for_sparql) - len(remaining_texts)} terms from gazetteer '{args.gazetteer_file}'.", file=sys.stderr)
+        texts_with_indices_for_sparql = remaining_texts
+
     total_queries_to_make = len(texts_with_indices_for_sparql)
     
     if total_queries_to_make > 0:
         print(f"Starting SPARQL queries for {total_queries_to_make} country terms...", file=sys.stderr)
 
     for idx, (text, original_row_idx) in enumerate(texts_with_indices_for_sparql):
-        # Escape backslashes and double quotes for SPARQL string literal
-        # Also escape single quotes if they are part of the text, as the search term will be enclosed in double quotes in the query.
-        # However, ql:contains-word typically handles this well. The primary concern is breaking the SPARQL query structure.
-        # For `ql:contains-word "search_term"`, only double quotes within search_term need escaping.
-        escaped_text = text.replace('\\', '\\\\').replace('"', '\\"')
-        
-        # The search term is directly injected into the query.
-        query = SPARQL_QUERY_TEMPLATE.format(search_word_direct=escaped_text)
-
-        # print(f"DEBUG: Query {idx+1}/{total_queries_to_make} for '{text}':\n{query}", file=sys.stderr) # Uncomment for debugging
         print(f"Executing query {idx+1}/{total_queries_to_make} for term: '{text}' (original row index: {original_row_idx})", file=sys.stderr)
-        
-        sparql_response_json = execute_sparql_query(query)
-        
-        if sparql_response_json and "results" in sparql_response_json and "bindings" in sparql_response_json["results"]:
-            bindings = sparql_response_json["results"]["bindings"]
-            if not bindings:
-                print(f"Info: No match found for term: '{text}' (original row index: {original_row_idx})", file=sys.stderr)
-            
-            for binding in bindings:
-                try:
-                    # original_row_idx is known from the Python loop context.
-                    # No ?i is expected in the binding anymore.
-                    result_item = {
-                        "wikidata_label": binding.get("wikidata_label", {}).get("value", ""),
-                        "label_en": binding.get("label_en", {}).get("value", ""),
-                        "label_it": binding.get("label_it", {}).get("value", ""),
-                        "label_de": binding.get("label_de", {}).get("value", ""),
-                        "label_fr": binding.get("label_fr", {}).get("value", ""),
-                        "scope_note": binding.get("scope_note", {}).get("value", ""),
-                        "wikidata_description": binding.get("wikidata_description", {}).get("value", ""),
-                        "term": binding.get("term", {}).get("value", ""),
-                        "wikidata_uri": binding.get("wikidata_uri", {}).get("value", "")
-                    }
-                    # Ensure term is present, as it's key
-                    if not result_item["term"]:
-                        print(f"Warning: Query for '{text}' (original row index: {original_row_idx}) succeeded but ?term is missing in result. Binding: {binding}", file=sys.stderr)
-                    # Allow appending even if term is missing; write_output_csv will handle empty strings.
-                    processed_sparql_data[original_row_idx].append(result_item)
-                except (KeyError, ValueError) as e:
-                    print(f"Warning: Could not process a SPARQL binding for term '{text}' (original row index: {original_row_idx}): {binding}. Error: {e}", file=sys.stderr)
-                    continue
-        else:
-            # execute_sparql_query already prints errors for network/request issues.
-            # This handles cases where the response might be non-JSON or missing expected structure.
-            print(f"Warning: Query failed or returned malformed/empty data for term: '{text}' (original row index: {original_row_idx})", file=sys.stderr)
+        result_items = query_country_term(text, args.match_mode, f"original row index: {original_row_idx}", args.fields, query_templates)
+        if result_items is not None:
+            processed_sparql_data[original_row_idx].extend(result_items)
 
     if total_queries_to_make > 0:
         print(f"Finished SPARQL queries for {total_queries_to_make} country terms.", file=sys.stderr)
     
-    write_output_csv(original_header, original_data_rows, processed_sparql_data)
+    write_output_csv(original_header, original_data_rows, processed_sparql_data, args.fields)
 
 if __name__ == "__main__":
     main()
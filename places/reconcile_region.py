@@ -1,10 +1,69 @@
 import argparse
 import csv
 import json
+import os
+import queue
 import re # Added for regex operations
 import requests
 import sys
+import threading
+import time
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+
+from context_index import (
+    build_context_index,
+    load_context_index,
+    lookup_context_candidates,
+    normalize_context_name_parts,
+    save_context_index,
+)
+import endpoint_health
+from endpoint_health import (
+    EndpointUnavailableError,
+    SparqlQueryError,
+    check_circuit_breaker,
+    record_endpoint_failure,
+    record_endpoint_success,
+    seconds_until_endpoints_available,
+)
+from adaptive_concurrency import ConcurrencySlot, concurrency_report_lines, get_concurrency_limiter
+from endpoint_registry import (
+    hedge_delay,
+    record_failover,
+    record_hedge,
+    record_replica_failure,
+    record_replica_success,
+    replica_order,
+    replica_report_lines,
+)
+from cascade_planner import GLOBAL_SPECIFICITY, CascadePlanner, DEFAULT_MAX_COST_PER_HIT_SECONDS, DEFAULT_MIN_ATTEMPTS
+from gazetteer import Gazetteer
+from label_filter import LabelFilter
+from query_builder import (
+    CONTEXT_DISTANCE_FRAGMENT,
+    CONTEXTUAL_TYPE_RANK_FRAGMENT,
+    DEFAULT_LABEL_LANGUAGES,
+    QUERY_KIND_CONTEXTUAL,
+    QUERY_KIND_DETAILS,
+    QUERY_KIND_GLOBAL,
+    WIKIDATA_COLUMNS,
+    build_tgn_query_template,
+    context_distance_fragment,
+    label_columns,
+    parse_label_languages,
+)
+from result_store import ENTITY_FIELDS, ResultStore
+from tracing import enable_tracing, trace_span, write_trace_file
+from tgn_ranking import build_place_type_ancestor_table, new_lean_candidate, rank_lean_candidates_with_ranks
+from label_matching import (
+    CLIENT_VERIFIED_MATCH_MODES,
+    DEFAULT_MATCH_MODE,
+    MATCH_MODES,
+    build_label_match_clause,
+    label_matches_exactly,
+)
 
 # TGN SPARQL Endpoint and Credentials
 SPARQL_ENDPOINT_URL = "https://dev.artresearch.net/sparql?repository=3rd-party"
@@ -14,166 +73,83 @@ SPARQL_PASSWORD = ""
 # Wikidata SPARQL Endpoint
 WIKIDATA_SPARQL_ENDPOINT_URL = "https://qlever.cs.uni-freiburg.de/api/wikidata"
 
-# SPARQL query for TGN regions, based on reconcile_region.py logic
-SINGLE_REGION_TGN_SPARQL_QUERY_TEMPLATE = """
-PREFIX skosxl: <http://www.w3.org/2008/05/skos-xl#>
-PREFIX getty: <http://vocab.getty.edu/ontology#>
-PREFIX dcterms: <http://purl.org/dc/terms/>
-PREFIX dc: <http://purl.org/dc/elements/1.1/>
-PREFIX ql: <http://qlever.cs.uni-freiburg.de/builtin-functions/>
-PREFIX rdf: <http://www.w3.org/1999/02/22-rdf-syntax-ns#>
-PREFIX gvp: <http://vocab.getty.edu/ontology#>
-PREFIX wdt: <http://www.wikidata.org/prop/direct/>
-PREFIX schema: <http://schema.org/>
-
-SELECT ?tgn_uri (SAMPLE(?label_en_coalesced) AS ?label_en) (SAMPLE(?label_it_coalesced) AS ?label_it) (SAMPLE(?label_de_coalesced) AS ?label_de) (SAMPLE(?label_fr_coalesced) AS ?label_fr) (SAMPLE(?type_term) AS ?type) (SAMPLE(?scope_note_x) AS ?scope_note) (SAMPLE(?label_gvp_term) AS ?label) (SAMPLE(?wikidata_uri_coalesced) AS ?wikidata_uri) (SAMPLE(?wikidata_description_coalesced) AS ?wikidata_description) WHERE {{
-  # Subquery to find candidate entities and calculate their priority rank
-  {{
-    SELECT ?tgn_uri (MIN(?distance_rank_val) AS ?min_distance_rank) (MIN(?type_rank_val) AS ?final_type_rank)
-    WHERE {{
-        # Label matching
-        ?tgn_uri skosxl:prefLabel|skosxl:altLabel ?entity .
-        ?entity getty:term ?found_label_uri .
-        FILTER(REGEX(?found_label_uri, "^{search_term_direct}$", "i")) .
-
-        # Path length constraints relative to the top_region_uri (distance_rank)
-        # ?tgn_uri must be within N levels of top_region_uri using getty:broaderPreferred
-        {{ ?tgn_uri getty:broaderPreferred <{top_region_uri}> . BIND(1 AS ?distance_rank_val) }}
-        UNION
-        {{ ?tgn_uri getty:broaderPreferred/getty:broaderPreferred <{top_region_uri}> . BIND(2 AS ?distance_rank_val) }}
-        UNION
-        {{ ?tgn_uri getty:broaderPreferred/getty:broaderPreferred/getty:broaderPreferred <{top_region_uri}> . BIND(3 AS ?distance_rank_val) }}
-        UNION
-        {{ ?tgn_uri getty:broaderPreferred/getty:broaderPreferred/getty:broaderPreferred/getty:broaderPreferred <{top_region_uri}> . BIND(4 AS ?distance_rank_val) }}
-        UNION
-        {{ ?tgn_uri getty:broaderPreferred/getty:broaderPreferred/getty:broaderPreferred/getty:broaderPreferred/getty:broaderPreferred <{top_region_uri}> . BIND(5 AS ?distance_rank_val) }}
-
-        # Place Type Ranking for places
-        # Rank 1: Preferred place type is a political divison (or narrower)
-        # Rank 2: Preferred place type is an inhabited place (or narrower)
-        # Rank 3: Non-Preferred place type is inhabited place (or narrower)
-        # Rank 4: Other or not specified as inhabited place
-        OPTIONAL {{
-            ?tgn_uri (getty:placeTypePreferred)/(getty:broaderPreferred*) <http://vocab.getty.edu/aat/300236157> .
-            BIND(1 AS ?type_pref_match)
-        }}
-        OPTIONAL {{
-            ?tgn_uri (getty:placeTypePreferred)/(getty:broaderPreferred*) <http://vocab.getty.edu/aat/300008347> .
-            BIND(2 AS ?type_pref_match)
-        }}
-        OPTIONAL {{
-            # TODO, need to prioritize inhabitet places for cities (comment retained from original)
-            ?tgn_uri (getty:placeTypeNonPreferred)/(getty:broaderPreferred*) <http://vocab.getty.edu/aat/300008347> .
-            BIND(3 AS ?type_nonpref_match)
-        }}
-        #FILTER(BOUND(?type_pref_match) || BOUND(?type_nonpref_match)) . # Removed to allow rank 3 for non-matches
-        BIND(COALESCE(?type_pref_match, ?type_nonpref_match, 4) AS ?type_rank_val) # Assign 3 if no specific type match
-
-    }} GROUP BY ?tgn_uri
-  }}
-
-  # Fetch details for the ranked ?tgn_uri(s) from the TGN graph
-    # English Label (Pref or Alt)
-    OPTIONAL {{
-      ?tgn_uri skosxl:prefLabel ?enPrefLabelEntity .
-      ?enPrefLabelEntity dcterms:language <http://vocab.getty.edu/language/en> .
-      ?enPrefLabelEntity getty:term ?pref_label_en .
-    }}
-    OPTIONAL {{
-      ?tgn_uri skosxl:altLabel ?enAltLabelEntity .
-      ?enAltLabelEntity dcterms:language <http://vocab.getty.edu/language/en> .
-      ?enAltLabelEntity getty:term ?alt_label_en .
-    }}
-    BIND(COALESCE(?pref_label_en, ?alt_label_en) AS ?label_en_coalesced) .
-
-    # Italian Label (Pref or Alt)
-    OPTIONAL {{
-      ?tgn_uri skosxl:prefLabel ?itPrefLabelEntity .
-      ?itPrefLabelEntity dcterms:language <http://vocab.getty.edu/language/it> .
-      ?itPrefLabelEntity getty:term ?pref_label_it .
-    }}
-    OPTIONAL {{
-      ?tgn_uri skosxl:altLabel ?itAltLabelEntity .
-      ?itAltLabelEntity dcterms:language <http://vocab.getty.edu/language/it> .
-      ?itAltLabelEntity getty:term ?alt_label_it .
-    }}
-    BIND(COALESCE(?pref_label_it, ?alt_label_it) AS ?label_it_coalesced) .
-
-    # German Label (Pref or Alt)
-    OPTIONAL {{
-      ?tgn_uri skosxl:prefLabel ?dePrefLabelEntity .
-      ?dePrefLabelEntity dcterms:language <http://vocab.getty.edu/language/de> .
-      ?dePrefLabelEntity getty:term ?pref_label_de .
-    }}
-    OPTIONAL {{
-      ?tgn_uri skosxl:altLabel ?deAltLabelEntity .
-      ?deAltLabelEntity dcterms:language <http://vocab.getty.edu/language/de> .
-      ?deAltLabelEntity getty:term ?alt_label_de .
-    }}
-    BIND(COALESCE(?pref_label_de, ?alt_label_de) AS ?label_de_coalesced) .
-
-    # French Label (Pref or Alt)
-    OPTIONAL {{
-      ?tgn_uri skosxl:prefLabel ?frPrefLabelEntity .
-      ?frPrefLabelEntity dcterms:language <http://vocab.getty.edu/language/fr> .
-      ?frPrefLabelEntity getty:term ?pref_label_fr .
-    }}
-    OPTIONAL {{
-      ?tgn_uri skosxl:altLabel ?frAltLabelEntity .
-      ?frAltLabelEntity dcterms:language <http://vocab.getty.edu/language/fr> .
-      ?frAltLabelEntity getty:term ?alt_label_fr .
-    }}
-    BIND(COALESCE(?pref_label_fr, ?alt_label_fr) AS ?label_fr_coalesced) .
-
-    # Getty Place Type (Preferred GVP Term)
-    OPTIONAL {{
-      ?tgn_uri getty:placeTypePreferred ?placeTypeEntity .
-      ?placeTypeEntity getty:prefLabelGVP ?prefGVPLabelEntity .
-      ?prefGVPLabelEntity getty:term ?type_term .
-    }}
-    
-    OPTIONAL {{
-      ?tgn_uri <http://www.w3.org/2004/02/skos/core#scopeNote>/rdf:value ?scope_note_x .
-    }}
-
-    # GVP Label (prefLabelGVP/term)
-    OPTIONAL {{
-      ?tgn_uri gvp:prefLabelGVP ?gvpLabelEntity .
-      ?gvpLabelEntity gvp:term ?label_gvp_term .
-      # Assuming gvp:prefLabelGVP does not have explicit language tags in the same way skosxl:prefLabel does.
-      # If language filtering is needed for gvp:term, it would require a different structure or assumptions.
-    }}
-
-    # Get TGN ID for Wikidata lookup
-    ?tgn_uri dc:identifier ?tgn_id_str .
-    OPTIONAL {{
-    # Wikidata Service Call
-      SERVICE <https://qlever.cs.uni-freiburg.de/api/wikidata> {{
-        ?wd_uri wdt:P1667 ?tgn_id_str .
-        OPTIONAL {{
-          ?wd_uri schema:description ?wd_desc .
-          FILTER (lang(?wd_desc) = "en") .
-        }}
-      }}
-   }}
-    BIND(COALESCE(?wd_uri, "") AS ?wikidata_uri_coalesced)
-    BIND(COALESCE(?wd_desc, "") AS ?wikidata_description_coalesced)
-}}
-GROUP BY ?tgn_uri # Grouping by ?tgn_uri here is for the outer query's aggregation of labels, etc.
-ORDER BY ASC(SAMPLE(?final_type_rank)) ASC(SAMPLE(?min_distance_rank)) # Primary sort by type, secondary by distance
-LIMIT 1
-"""
+# Request timeouts (seconds) per query class. Lookups by URI are cheap and should fail fast,
+# global label searches and bulk prefetches are the most expensive queries.
+QUERY_CLASS_TGN_CONTEXTUAL = "tgn-contextual"
+QUERY_CLASS_TGN_GLOBAL = "tgn-global"
+QUERY_CLASS_TGN_FETCH_BY_URI = "tgn-fetch-by-uri"
+QUERY_CLASS_WIKIDATA_CONTEXTUAL = "wikidata-contextual"
+QUERY_CLASS_WIKIDATA_GLOBAL = "wikidata-global"
+QUERY_CLASS_PREFETCH = "prefetch"
+QUERY_CLASS_WIKIDATA_ENRICHMENT = "wikidata-enrichment"
+QUERY_CLASS_TIMEOUTS = {
+    QUERY_CLASS_TGN_FETCH_BY_URI: 30,
+    QUERY_CLASS_TGN_CONTEXTUAL: 60,
+    QUERY_CLASS_WIKIDATA_CONTEXTUAL: 60,
+    QUERY_CLASS_TGN_GLOBAL: 300,
+    QUERY_CLASS_WIKIDATA_GLOBAL: 300,
+    QUERY_CLASS_PREFETCH: 600,
+    QUERY_CLASS_WIKIDATA_ENRICHMENT: 300,
+}
+DEFAULT_QUERY_TIMEOUT = 300
+
+# Columns written by write_output_csv (followed by number_of_results), one per field of a stored entity.
+# The columns of a run depend on --languages and --fields, see CascadeSettings.
+SCRIPT_MANAGED_DATA_COLUMNS = list(ENTITY_FIELDS)
+
+# Stage recorded with each match in the result store
+MATCH_STAGE_GAZETTEER = "gazetteer"
+MATCH_STAGE_TGN_CONTEXTUAL = "tgn-contextual"
+MATCH_STAGE_TGN_PREFETCHED = "tgn-prefetched"
+MATCH_STAGE_WIKIDATA_TGN_ID = "wikidata-tgn-id"
+MATCH_STAGE_WIKIDATA_ONLY = "wikidata-only"
+MATCH_STAGE_TGN_GLOBAL = "tgn-global"
+MATCH_STAGE_WIKIDATA_GLOBAL_TGN_ID = "wikidata-global-tgn-id"
+# Stages whose TGN queries carry the Wikidata SERVICE call; with --deferred-wikidata their matches are enriched afterwards
+MATCH_STAGES_WITH_TGN_WIKIDATA_LOOKUP = (MATCH_STAGE_TGN_CONTEXTUAL, MATCH_STAGE_TGN_PREFETCHED, MATCH_STAGE_TGN_GLOBAL)
+# Vocabulary whose labels a cascade stage matches; a stage is skipped if the label filter of its vocabulary excludes the name
+LABEL_FILTER_TGN = "tgn"
+LABEL_FILTER_WIKIDATA = "wikidata"
+LABEL_FILTER_OF_STAGE = {
+    MATCH_STAGE_TGN_CONTEXTUAL: LABEL_FILTER_TGN,
+    MATCH_STAGE_TGN_GLOBAL: LABEL_FILTER_TGN,
+    MATCH_STAGE_WIKIDATA_TGN_ID: LABEL_FILTER_WIKIDATA,
+    MATCH_STAGE_WIKIDATA_ONLY: LABEL_FILTER_WIKIDATA,
+    MATCH_STAGE_WIKIDATA_GLOBAL_TGN_ID: LABEL_FILTER_WIKIDATA,
+}
+# Network stages of each context and the global stages, in the order row_cascade_levels runs them (for --plan)
+CONTEXTUAL_CASCADE_STAGES = (MATCH_STAGE_TGN_CONTEXTUAL, MATCH_STAGE_WIKIDATA_TGN_ID, MATCH_STAGE_WIKIDATA_ONLY)
+GLOBAL_CASCADE_STAGES = (MATCH_STAGE_TGN_GLOBAL, MATCH_STAGE_WIKIDATA_GLOBAL_TGN_ID)
+# --plan: seconds per query of a stage without recorded statistics (--cascade-stats-file), and per context prefetch
+DEFAULT_PLAN_SECONDS_PER_QUERY = 1.0
+DEFAULT_PLAN_SECONDS_PER_PREFETCH = 30.0
+
+# Outcome of one row. "errored" means a query of the cascade failed before a match was found, so the row's
+# result is unknown (a later stage could otherwise return a lower-precedence match). Errored rows are retried
+# at the end of the run and written to the dead-letter file if they still fail.
+ROW_OUTCOME_MATCHED = "matched"
+ROW_OUTCOME_UNMATCHED = "unmatched"
+ROW_OUTCOME_ERRORED = "errored"
+# Stage recorded for rows that were still deferred by an open circuit breaker when the run ended
+DEAD_LETTER_STAGE_ENDPOINT_UNAVAILABLE = "endpoint-unavailable"
+# Seconds between two progress reports (and rewrites of the partial output) with --priority-col or --progress-output
+DEFAULT_PROGRESS_INTERVAL_SECONDS = 60
+
+# SPARQL query for TGN regions, based on reconcile_region.py logic. The TGN templates are generated by
+# query_builder.py; these are the ones for the default columns, the cascade uses tgn_query_template.
+SINGLE_REGION_TGN_SPARQL_QUERY_TEMPLATE = build_tgn_query_template(QUERY_KIND_CONTEXTUAL, SCRIPT_MANAGED_DATA_COLUMNS, WIKIDATA_SPARQL_ENDPOINT_URL)
 
 # SPARQL query for Wikidata fallback
 WIKIDATA_FALLBACK_QUERY_TEMPLATE = """
 PREFIX skos: <http://www.w3.org/2004/02/skos/core#>
+PREFIX ql: <http://qlever.cs.uni-freiburg.de/builtin-functions/>
 PREFIX wdt: <http://www.wikidata.org/prop/direct/>
 PREFIX schema: <http://schema.org/>
 
-SELECT DISTINCT ?wikidata_uri ?tgn_id ?wd_desc WHERE {{
+SELECT DISTINCT ?wikidata_uri ?tgn_id ?wd_desc ?label WHERE {{
   ?wikidata_uri wdt:P1667 ?tgn_id . # ?tgn_id here is the string ID, not the URI
   ?wikidata_uri skos:prefLabel ?label .
-  FILTER(regex(?label, "^{search_label}$", "i")) .
+  {label_match_clause}
   
   {{ ?wikidata_uri wdt:P131 ?top_region_entity . BIND(1 AS ?rank) }}
   UNION
@@ -191,111 +167,16 @@ ORDER BY ASC(?rank)
 LIMIT 1
 """
 
-# SPARQL query to fetch TGN details by a specific TGN URI (used in fallback)
-TGN_FETCH_BY_URI_QUERY_TEMPLATE = """
-PREFIX skosxl: <http://www.w3.org/2008/05/skos-xl#>
-PREFIX getty: <http://vocab.getty.edu/ontology#>
-PREFIX dcterms: <http://purl.org/dc/terms/>
-PREFIX dc: <http://purl.org/dc/elements/1.1/>
-PREFIX rdf: <http://www.w3.org/1999/02/22-rdf-syntax-ns#>
-PREFIX gvp: <http://vocab.getty.edu/ontology#>
-
-SELECT 
-    (SAMPLE(?label_en_coalesced) AS ?label_en) 
-    (SAMPLE(?label_it_coalesced) AS ?label_it) 
-    (SAMPLE(?label_de_coalesced) AS ?label_de) 
-    (SAMPLE(?label_fr_coalesced) AS ?label_fr) 
-    (SAMPLE(?type_term) AS ?type) 
-    (SAMPLE(?scope_note_x) AS ?scope_note) 
-    (SAMPLE(?label_gvp_term) AS ?label)
-WHERE {{
-    BIND(<{tgn_uri_direct}> AS ?tgn_uri_from_wiki) .
-    OPTIONAL {{
-      ?tgn_uri_from_wiki dcterms:isReplacedBy ?tgn_uri_replacement .
-    }}
-    BIND(COALESCE(?tgn_uri_replacement, ?tgn_uri_from_wiki) AS ?tgn_uri) .
-
-    # English Label (Pref or Alt)
-    OPTIONAL {{
-      ?tgn_uri skosxl:prefLabel ?enPrefLabelEntity .
-      ?enPrefLabelEntity dcterms:language <http://vocab.getty.edu/language/en> .
-      ?enPrefLabelEntity getty:term ?pref_label_en .
-    }}
-    OPTIONAL {{
-      ?tgn_uri skosxl:altLabel ?enAltLabelEntity .
-      ?enAltLabelEntity dcterms:language <http://vocab.getty.edu/language/en> .
-      ?enAltLabelEntity getty:term ?alt_label_en .
-    }}
-    BIND(COALESCE(?pref_label_en, ?alt_label_en) AS ?label_en_coalesced) .
-
-    # Italian Label (Pref or Alt)
-    OPTIONAL {{
-      ?tgn_uri skosxl:prefLabel ?itPrefLabelEntity .
-      ?itPrefLabelEntity dcterms:language <http://vocab.getty.edu/language/it> .
-      ?itPrefLabelEntity getty:term ?pref_label_it .
-    }}
-    OPTIONAL {{
-      ?tgn_uri skosxl:altLabel ?itAltLabelEntity .
-      ?itAltLabelEntity dcterms:language <http://vocab.getty.edu/language/it> .
-      ?itAltLabelEntity getty:term ?alt_label_it .
-    }}
-    BIND(COALESCE(?pref_label_it, ?alt_label_it) AS ?label_it_coalesced) .
-
-    # German Label (Pref or Alt)
-    OPTIONAL {{
-      ?tgn_uri skosxl:prefLabel ?dePrefLabelEntity .
-      ?dePrefLabelEntity dcterms:language <http://vocab.getty.edu/language/de> .
-      ?dePrefLabelEntity getty:term ?pref_label_de .
-    }}
-    OPTIONAL {{
-      ?tgn_uri skosxl:altLabel ?deAltLabelEntity .
-      ?deAltLabelEntity dcterms:language <http://vocab.getty.edu/language/de> .
-      ?deAltLabelEntity getty:term ?alt_label_de .
-    }}
-    BIND(COALESCE(?pref_label_de, ?alt_label_de) AS ?label_de_coalesced) .
-
-    # French Label (Pref or Alt)
-    OPTIONAL {{
-      ?tgn_uri skosxl:prefLabel ?frPrefLabelEntity .
-      ?frPrefLabelEntity dcterms:language <http://vocab.getty.edu/language/fr> .
-      ?frPrefLabelEntity getty:term ?pref_label_fr .
-    }}
-    OPTIONAL {{
-      ?tgn_uri skosxl:altLabel ?frAltLabelEntity .
-      ?frAltLabelEntity dcterms:language <http://vocab.getty.edu/language/fr> .
-      ?frAltLabelEntity getty:term ?alt_label_fr .
-    }}
-    BIND(COALESCE(?pref_label_fr, ?alt_label_fr) AS ?label_fr_coalesced) .
-
-    # Getty Place Type (Preferred GVP Term)
-    OPTIONAL {{
-      ?tgn_uri getty:placeTypePreferred ?placeTypeEntity .
-      ?placeTypeEntity getty:prefLabelGVP ?prefGVPLabelEntity .
-      ?prefGVPLabelEntity getty:term ?type_term .
-    }}
-    
-    OPTIONAL {{
-      ?tgn_uri <http://www.w3.org/2004/02/skos/core#scopeNote>/rdf:value ?scope_note_x .
-    }}
-
-    # GVP Label (prefLabelGVP/term)
-    OPTIONAL {{
-      ?tgn_uri gvp:prefLabelGVP ?gvpLabelEntity .
-      ?gvpLabelEntity gvp:term ?label_gvp_term .
-    }}
-}}
-LIMIT 1 
-"""
-
 # SPARQL query for Wikidata second fallback (no TGN ID required for the found Wikidata entity)
 WIKIDATA_SECOND_FALLBACK_QUERY_TEMPLATE = """
 PREFIX skos: <http://www.w3.org/2004/02/skos/core#>
+PREFIX ql: <http://qlever.cs.uni-freiburg.de/builtin-functions/>
 PREFIX wdt: <http://www.wikidata.org/prop/direct/>
 PREFIX schema: <http://schema.org/>
 
 SELECT DISTINCT ?wikidata_uri ?label ?wd_desc WHERE {{
   ?wikidata_uri skos:prefLabel ?label .
-  FILTER(regex(?label, "^{search_label}$", "i")) .
+  {label_match_clause}
   
   {{ ?wikidata_uri wdt:P131 ?top_region_entity . BIND(1 AS ?rank) }}
   UNION
@@ -316,142 +197,203 @@ LIMIT 1
 """
 
 # SPARQL query for TGN regions - GLOBAL (no top_region_uri constraint)
-GLOBAL_TGN_SPARQL_QUERY_TEMPLATE = """
-PREFIX skosxl: <http://www.w3.org/2008/05/skos-xl#>
-PREFIX getty: <http://vocab.getty.edu/ontology#>
-PREFIX dcterms: <http://purl.org/dc/terms/>
-PREFIX dc: <http://purl.org/dc/elements/1.1/>
+GLOBAL_TGN_SPARQL_QUERY_TEMPLATE = build_tgn_query_template(QUERY_KIND_GLOBAL, SCRIPT_MANAGED_DATA_COLUMNS, WIKIDATA_SPARQL_ENDPOINT_URL)
+
+# SPARQL query for Wikidata fallback - GLOBAL
+GLOBAL_WIKIDATA_FALLBACK_QUERY_TEMPLATE = """
+PREFIX skos: <http://www.w3.org/2004/02/skos/core#>
 PREFIX ql: <http://qlever.cs.uni-freiburg.de/builtin-functions/>
-PREFIX rdf: <http://www.w3.org/1999/02/22-rdf-syntax-ns#>
-PREFIX gvp: <http://vocab.getty.edu/ontology#>
 PREFIX wdt: <http://www.wikidata.org/prop/direct/>
 PREFIX schema: <http://schema.org/>
 
-SELECT ?tgn_uri (SAMPLE(?label_en_coalesced) AS ?label_en) (SAMPLE(?label_it_coalesced) AS ?label_it) (SAMPLE(?label_de_coalesced) AS ?label_de) (SAMPLE(?label_fr_coalesced) AS ?label_fr) (SAMPLE(?type_term) AS ?type) (SAMPLE(?scope_note_x) AS ?scope_note) (SAMPLE(?label_gvp_term) AS ?label) (SAMPLE(?wikidata_uri_coalesced) AS ?wikidata_uri) (SAMPLE(?wikidata_description_coalesced) AS ?wikidata_description) WHERE {{
-  # Subquery to find candidate entities and calculate their priority rank
-  {{
-    SELECT ?tgn_uri (MIN(?type_rank_val) AS ?final_type_rank)
-    WHERE {{
-        # Label matching
-        ?tgn_uri skosxl:prefLabel|skosxl:altLabel ?entity .
-        ?entity getty:term ?found_label_uri .
-        FILTER(REGEX(?found_label_uri, "^{search_term_direct}$", "i")) .
-
-        # Place Type Ranking for inhabited places (<http://vocab.getty.edu/aat/300008347>)
-        OPTIONAL {{
-            ?tgn_uri (getty:placeTypePreferred)/(getty:broaderPreferred*) <http://vocab.getty.edu/aat/300008347> .
-            BIND(1 AS ?type_pref_match)
-        }}
-        OPTIONAL {{
-            ?tgn_uri (getty:placeTypeNonPreferred)/(getty:broaderPreferred*) <http://vocab.getty.edu/aat/300008347> .
-            BIND(2 AS ?type_nonpref_match)
-        }}
-        # FILTER(BOUND(?type_pref_match) || BOUND(?type_nonpref_match)) . # Removed to allow rank 3 for non-matches
-        BIND(COALESCE(?type_pref_match, ?type_nonpref_match, 3) AS ?type_rank_val) # Assign 3 if no specific type match
-
-    }} GROUP BY ?tgn_uri
+SELECT DISTINCT ?wikidata_uri ?tgn_id ?wd_desc ?label WHERE {{
+  ?wikidata_uri wdt:P1667 ?tgn_id . # ?tgn_id here is the string ID, not the URI
+  ?wikidata_uri skos:prefLabel ?label .
+  {label_match_clause}
+  
+  OPTIONAL {{
+    ?wikidata_uri schema:description ?wd_desc .
+    FILTER (lang(?wd_desc) = "en") .
   }}
+}}
+LIMIT 1 
+"""
 
-  # Fetch details for the ranked ?tgn_uri(s) from the TGN graph
-    OPTIONAL {{
-      ?tgn_uri skosxl:prefLabel ?enPrefLabelEntity .
-      ?enPrefLabelEntity dcterms:language <http://vocab.getty.edu/language/en> .
-      ?enPrefLabelEntity getty:term ?pref_label_en .
-    }}
-    OPTIONAL {{
-      ?tgn_uri skosxl:altLabel ?enAltLabelEntity .
-      ?enAltLabelEntity dcterms:language <http://vocab.getty.edu/language/en> .
-      ?enAltLabelEntity getty:term ?alt_label_en .
-    }}
-    BIND(COALESCE(?pref_label_en, ?alt_label_en) AS ?label_en_coalesced) .
-
-    OPTIONAL {{
-      ?tgn_uri skosxl:prefLabel ?itPrefLabelEntity .
-      ?itPrefLabelEntity dcterms:language <http://vocab.getty.edu/language/it> .
-      ?itPrefLabelEntity getty:term ?pref_label_it .
-    }}
-    OPTIONAL {{
-      ?tgn_uri skosxl:altLabel ?itAltLabelEntity .
-      ?itAltLabelEntity dcterms:language <http://vocab.getty.edu/language/it> .
-      ?itAltLabelEntity getty:term ?alt_label_it .
-    }}
-    BIND(COALESCE(?pref_label_it, ?alt_label_it) AS ?label_it_coalesced) .
-
-    OPTIONAL {{
-      ?tgn_uri skosxl:prefLabel ?dePrefLabelEntity .
-      ?dePrefLabelEntity dcterms:language <http://vocab.getty.edu/language/de> .
-      ?dePrefLabelEntity getty:term ?pref_label_de .
-    }}
-    OPTIONAL {{
-      ?tgn_uri skosxl:altLabel ?deAltLabelEntity .
-      ?deAltLabelEntity dcterms:language <http://vocab.getty.edu/language/de> .
-      ?deAltLabelEntity getty:term ?alt_label_de .
-    }}
-    BIND(COALESCE(?pref_label_de, ?alt_label_de) AS ?label_de_coalesced) .
-
-    OPTIONAL {{
-      ?tgn_uri skosxl:prefLabel ?frPrefLabelEntity .
-      ?frPrefLabelEntity dcterms:language <http://vocab.getty.edu/language/fr> .
-      ?frPrefLabelEntity getty:term ?pref_label_fr .
-    }}
-    OPTIONAL {{
-      ?tgn_uri skosxl:altLabel ?frAltLabelEntity .
-      ?frAltLabelEntity dcterms:language <http://vocab.getty.edu/language/fr> .
-      ?frAltLabelEntity getty:term ?alt_label_fr .
-    }}
-    BIND(COALESCE(?pref_label_fr, ?alt_label_fr) AS ?label_fr_coalesced) .
-
-    OPTIONAL {{
-      ?tgn_uri getty:placeTypePreferred ?placeTypeEntity .
-      ?placeTypeEntity getty:prefLabelGVP ?prefGVPLabelEntity .
-      ?prefGVPLabelEntity getty:term ?type_term .
-    }}
-    
-    OPTIONAL {{
-      ?tgn_uri <http://www.w3.org/2004/02/skos/core#scopeNote>/rdf:value ?scope_note_x .
-    }}
+# SPARQL query to download every descendant of a top region (up to 5 broaderPreferred levels) with all of its labels,
+# its distance to the top region and its place type rank. Used by --prefetch-contexts to resolve all rows sharing a
+# context locally instead of sending one SINGLE_REGION_TGN_SPARQL_QUERY_TEMPLATE query per row.
+# The distance and type ranks come from the same query_builder.py fragments as SINGLE_REGION_TGN_SPARQL_QUERY_TEMPLATE.
+TGN_CONTEXT_DESCENDANTS_QUERY_TEMPLATE = """
+PREFIX skosxl: <http://www.w3.org/2008/05/skos-xl#>
+PREFIX getty: <http://vocab.getty.edu/ontology#>
 
-    OPTIONAL {{
-      ?tgn_uri gvp:prefLabelGVP ?gvpLabelEntity .
-      ?gvpLabelEntity gvp:term ?label_gvp_term .
-    }}
+SELECT ?tgn_uri ?found_label (MIN(?distance_rank_val) AS ?distance_rank) (MIN(?type_rank_val) AS ?type_rank) WHERE {{""" + CONTEXT_DISTANCE_FRAGMENT + """
+    ?tgn_uri skosxl:prefLabel|skosxl:altLabel ?entity .
+    ?entity getty:term ?found_label .
+""" + CONTEXTUAL_TYPE_RANK_FRAGMENT + """}}
+GROUP BY ?tgn_uri ?found_label
+"""
 
-    ?tgn_uri dc:identifier ?tgn_id_str .
-    OPTIONAL {{
-      SERVICE <https://qlever.cs.uni-freiburg.de/api/wikidata> {{
-        ?wd_uri wdt:P1667 ?tgn_id_str .
-        OPTIONAL {{
-          ?wd_uri schema:description ?wd_desc .
-          FILTER (lang(?wd_desc) = "en") .
-        }}
-      }}
-   }}
-    BIND(COALESCE(?wd_uri, "") AS ?wikidata_uri_coalesced)
-    BIND(COALESCE(?wd_desc, "") AS ?wikidata_description_coalesced)
+# SPARQL query to download every Wikidata entity located (wdt:P131, up to 4 hops) in the entity whose TGN ID is
+# {parent_tgn_id}, with its labels, TGN ID, description and hop count. Used by --prefetch-wikidata to answer both
+# contextual Wikidata fallbacks (WIKIDATA_FALLBACK_QUERY_TEMPLATE and WIKIDATA_SECOND_FALLBACK_QUERY_TEMPLATE) locally.
+WIKIDATA_P131_DESCENDANTS_QUERY_TEMPLATE = """
+PREFIX skos: <http://www.w3.org/2004/02/skos/core#>
+PREFIX wdt: <http://www.wikidata.org/prop/direct/>
+PREFIX schema: <http://schema.org/>
+
+SELECT ?wikidata_uri ?label (SAMPLE(?tgn_id_raw) AS ?tgn_id) (SAMPLE(?wd_desc_raw) AS ?wd_desc) (MIN(?rank_val) AS ?rank) WHERE {{
+  {{ ?wikidata_uri wdt:P131 ?top_region_entity . BIND(1 AS ?rank_val) }}
+  UNION
+  {{ ?wikidata_uri wdt:P131/wdt:P131 ?top_region_entity . BIND(2 AS ?rank_val) }}
+  UNION
+  {{ ?wikidata_uri wdt:P131/wdt:P131/wdt:P131 ?top_region_entity . BIND(3 AS ?rank_val) }}
+  UNION
+  {{ ?wikidata_uri wdt:P131/wdt:P131/wdt:P131/wdt:P131 ?top_region_entity . BIND(4 AS ?rank_val) }}
+
+  ?top_region_entity wdt:P1667 "{parent_tgn_id}" .
+  ?wikidata_uri skos:prefLabel ?label_raw .
+  BIND(STR(?label_raw) AS ?label)
+  OPTIONAL {{
+    ?wikidata_uri wdt:P1667 ?tgn_id_raw .
+  }}
+  OPTIONAL {{
+    ?wikidata_uri schema:description ?wd_desc_raw .
+    FILTER (lang(?wd_desc_raw) = "en") .
+  }}
 }}
-GROUP BY ?tgn_uri
-ORDER BY ASC(SAMPLE(?final_type_rank)) # Only sort by type for global search
-LIMIT 1
+GROUP BY ?wikidata_uri ?label
 """
 
-# SPARQL query for Wikidata fallback - GLOBAL
-GLOBAL_WIKIDATA_FALLBACK_QUERY_TEMPLATE = """
-PREFIX skos: <http://www.w3.org/2004/02/skos/core#>
+# Maximum wdt:P131 hops accepted by the first (TGN ID required) and second (Wikidata only) contextual fallbacks
+WIKIDATA_FALLBACK_MAX_RANK = 3
+WIKIDATA_SECOND_FALLBACK_MAX_RANK = 4
+
+def data_columns_for_languages(languages):
+    # SCRIPT_MANAGED_DATA_COLUMNS with a label column per --languages code
+    return ["label"] + label_columns(languages) + ["type", "scope_note", "wikidata_description", "tgn_uri", "wikidata_uri"]
+
+class CascadeSettings:
+    """
+    The settings of one engine that the cascade and the SPARQL executor read: the label languages (--languages), the
+    data columns they give and the output columns (--fields, all by default), --top-k, the query timeouts, the replicas
+    of each logical endpoint, hedging, the circuit breaker and concurrency limits, and the requests.Session used
+    (plain requests.post if None). Passed down the cascade in reconciliation_state["settings"], so that engines with
+    different settings can run in one process. The circuit breakers, concurrency limiters and replica statistics
+    describe the endpoints and stay shared (endpoint_health.py, adaptive_concurrency.py, endpoint_registry.py).
+    """
+
+    def __init__(self, languages=DEFAULT_LABEL_LANGUAGES, fields=None, top_k=None, query_timeouts=None, replica_urls=None, hedge_requests=False,
+                 breaker_failure_threshold=endpoint_health.CIRCUIT_BREAKER_FAILURE_THRESHOLD, breaker_cooldown=endpoint_health.CIRCUIT_BREAKER_COOLDOWN_SECONDS,
+                 max_concurrency=1, http_session=None):
+        self.label_languages = list(languages)
+        self.data_columns = data_columns_for_languages(self.label_languages)
+        # The TGN queries only fetch the output columns, see tgn_query_template
+        self.output_data_columns = [col_name for col_name in dict.fromkeys(fields) if col_name in self.data_columns] if fields is not None else list(self.data_columns)
+        # Number of ranked candidates kept per matched row (None: only the match); the ranked TGN queries then return top_k rows
+        self.top_k = top_k
+        self.query_timeouts = dict(QUERY_CLASS_TIMEOUTS, **(query_timeouts or {}))
+        # Logical endpoint URL -> replica URLs in order of preference
+        self.replica_urls = {endpoint_url: list(dict.fromkeys(urls)) for endpoint_url, urls in (replica_urls or {}).items() if urls}
+        self.hedge_requests = hedge_requests
+        self.breaker_failure_threshold = breaker_failure_threshold
+        self.breaker_cooldown = breaker_cooldown
+        self.max_concurrency = max(int(max_concurrency), 1)
+        self.http_session = http_session
+        self.tgn_query_templates = {}
+
+    def tgn_query_template(self, query_kind, with_wikidata=True):
+        # The TGN query of query_kind (QUERY_KIND_*) for output_data_columns, or None for a details fetch with nothing to
+        # fetch. Without with_wikidata (--deferred-wikidata) the query has no federated Wikidata SERVICE call; the Wikidata
+        # columns then come back empty and are filled in by enrich_matches_with_wikidata.
+        template_key = (query_kind, with_wikidata)
+        if template_key not in self.tgn_query_templates:
+            self.tgn_query_templates[template_key] = build_tgn_query_template(query_kind, self.output_data_columns, WIKIDATA_SPARQL_ENDPOINT_URL if with_wikidata else None, candidate_limit=self.top_k or 1)
+        return self.tgn_query_templates[template_key]
+
+    def label_values(self, binding):
+        # The label_<code> values of the --languages codes in a TGN query binding
+        return {f"label_{code}": get_sparql_binding_value(binding, f"label_{code}") for code in self.label_languages}
+
+    def query_timeout(self, query_class):
+        return self.query_timeouts.get(query_class, DEFAULT_QUERY_TIMEOUT)
+
+    def endpoint_replicas(self, endpoint_url):
+        # The replica URLs serving the logical endpoint endpoint_url (endpoint_url itself without --tgn-endpoint/--wikidata-endpoint)
+        return self.replica_urls.get(endpoint_url) or [endpoint_url]
+
+# Settings of the functions called outside an engine (e.g. by the benchmarks): default columns, no session
+DEFAULT_CASCADE_SETTINGS = CascadeSettings()
+
+# Wikidata entities (and English descriptions) of a batch of TGN IDs, for --deferred-wikidata
+WIKIDATA_BY_TGN_IDS_QUERY_TEMPLATE = """
 PREFIX wdt: <http://www.wikidata.org/prop/direct/>
 PREFIX schema: <http://schema.org/>
 
-SELECT DISTINCT ?wikidata_uri ?tgn_id ?wd_desc WHERE {{
-  ?wikidata_uri wdt:P1667 ?tgn_id . # ?tgn_id here is the string ID, not the URI
-  ?wikidata_uri skos:prefLabel ?label .
-  FILTER(regex(?label, "^{search_label}$", "i")) .
-  
+SELECT ?tgn_id ?wd_uri ?wd_desc WHERE {{
+  VALUES ?tgn_id {{ {tgn_id_values} }}
+  ?wd_uri wdt:P1667 ?tgn_id .
   OPTIONAL {{
-    ?wikidata_uri schema:description ?wd_desc .
+    ?wd_uri schema:description ?wd_desc .
     FILTER (lang(?wd_desc) = "en") .
   }}
 }}
-LIMIT 1 
 """
+DEFAULT_WIKIDATA_BATCH_SIZE = 500
+
+# Lean candidate queries (--lean-candidates): only the matching entities with their place types and depth below the
+# context are returned; ranking happens in tgn_ranking.py and the details of the winner are fetched with
+# CascadeSettings.tgn_query_template(QUERY_KIND_DETAILS). dc:identifier is required as in the ranked templates.
+LEAN_TGN_CONTEXTUAL_CANDIDATES_QUERY_TEMPLATE = """
+PREFIX skosxl: <http://www.w3.org/2008/05/skos-xl#>
+PREFIX getty: <http://vocab.getty.edu/ontology#>
+PREFIX dc: <http://purl.org/dc/elements/1.1/>
+PREFIX ql: <http://qlever.cs.uni-freiburg.de/builtin-functions/>
+
+SELECT DISTINCT ?tgn_uri ?pref_type ?nonpref_type ?depth (STR(?found_label_uri) AS ?matched_label) WHERE {{
+    ?tgn_uri skosxl:prefLabel|skosxl:altLabel ?entity .
+    ?entity getty:term ?found_label_uri .
+    {label_match_clause}
+""" + context_distance_fragment("depth") + """
+
+    ?tgn_uri dc:identifier ?tgn_id_str .
+    OPTIONAL {{ ?tgn_uri getty:placeTypePreferred ?pref_type . }}
+    OPTIONAL {{ ?tgn_uri getty:placeTypeNonPreferred ?nonpref_type . }}
+}}
+"""
+
+LEAN_TGN_GLOBAL_CANDIDATES_QUERY_TEMPLATE = """
+PREFIX skosxl: <http://www.w3.org/2008/05/skos-xl#>
+PREFIX getty: <http://vocab.getty.edu/ontology#>
+PREFIX dc: <http://purl.org/dc/elements/1.1/>
+PREFIX ql: <http://qlever.cs.uni-freiburg.de/builtin-functions/>
+
+SELECT DISTINCT ?tgn_uri ?pref_type ?nonpref_type (STR(?found_label_uri) AS ?matched_label) WHERE {{
+    ?tgn_uri skosxl:prefLabel|skosxl:altLabel ?entity .
+    ?entity getty:term ?found_label_uri .
+    {label_match_clause}
+
+    ?tgn_uri dc:identifier ?tgn_id_str .
+    OPTIONAL {{ ?tgn_uri getty:placeTypePreferred ?pref_type . }}
+    OPTIONAL {{ ?tgn_uri getty:placeTypeNonPreferred ?nonpref_type . }}
+}}
+"""
+
+# Every place type used in TGN with all its getty:broaderPreferred ancestors (including itself).
+# Fetched once and cached in --place-type-table-file; used by tgn_ranking.py instead of broaderPreferred* paths.
+PLACE_TYPE_ANCESTORS_QUERY = """
+PREFIX getty: <http://vocab.getty.edu/ontology#>
+
+SELECT DISTINCT ?type ?ancestor WHERE {
+    {
+        SELECT DISTINCT ?type WHERE {
+            ?place getty:placeTypePreferred|getty:placeTypeNonPreferred ?type .
+        }
+    }
+    ?type getty:broaderPreferred* ?ancestor .
+}
+"""
+PLACE_TYPE_TABLE_FORMAT_VERSION = 1
 
 def get_sparql_binding_value(binding, key, default=""):
     # Helper to safely extract a value from a SPARQL JSON binding result.
@@ -464,36 +406,146 @@ def get_sparql_binding_value(binding, key, default=""):
         return item.get("value", default)
     return default
 
-def parse_arguments():
-    parser = argparse.ArgumentParser(description="Reconcile region names from a CSV file against the TGN SPARQL endpoint, using top-region URIs from one or more CSV definition files.")
-    parser.add_argument("--regions-input-file", required=True, help="Path to the input CSV file with regions to reconcile.")
-    
+def binding_passes_label_verification(binding, search_term, match_mode, label_key="matched_label"):
+    # Match modes backed by the text index only return candidates; re-check the "^term$" case-insensitive semantics here.
+    if match_mode not in CLIENT_VERIFIED_MATCH_MODES:
+        return True
+    matched_label = get_sparql_binding_value(binding, label_key)
+    return bool(matched_label) and label_matches_exactly(matched_label, search_term)
+
+def add_cascade_arguments(parser):
+    """Adds the options of the reconciliation cascade (definition files, caches, endpoints, planner), shared with reconciliation_service.py."""
     parser.add_argument("--top-region-def-file", required=True, action='append', help="Path to a CSV file defining top-regions and their TGN URIs. Can be specified multiple times for different definition files.")
     parser.add_argument("--trd-name-cols", required=True, action='append', type=str, help="Comma-separated 1-based indices for the top-region name(s) in the corresponding --top-region-def-file. Must be specified for each --top-region-def-file.")
     parser.add_argument("--trd-uri-col", required=True, action='append', type=int, help="1-based column index for the top-region TGN URI in the corresponding --top-region-def-file. Must be specified for each --top-region-def-file.")
-    
-    parser.add_argument("--ri-top-region-name-col", required=True, type=str, help="Column index (1-based) or comma-separated indices for the top-region name(s) in the regions input file (used for lookup).")
-    parser.add_argument("--ri-region-name-col", required=True, type=int, help="Column index (1-based) for the region name (term to reconcile) in the regions input file.")
     parser.add_argument("--remove-trailing-state", action='store_true', help="Remove trailing state indicators like '(XX)' from region names before querying.")
-    
-    args = parser.parse_args()
-
+    parser.add_argument("--context-index-file", help="Path of a binary sidecar file caching the compiled top-region context index. It is rebuilt automatically when a definition file or its column settings change.")
+    parser.add_argument("--prefetch-contexts", action='store_true', help="Download all descendants (up to 5 levels) of each top-region context once and resolve the contextual TGN search locally. Labels are compared case-insensitively, as in the 'lcase' match mode.")
+    parser.add_argument("--prefetch-wikidata", action='store_true', help="Download all Wikidata entities up to 4 P131 hops below each context once and answer the contextual Wikidata fallbacks locally.")
+    parser.add_argument("--prefetch-min-rows", type=int, default=2, help="With --prefetch-contexts or --prefetch-wikidata, only prefetch contexts that are used by at least this many input rows; rarer contexts are queried per row (default: 2).")
+    parser.add_argument("--query-timeout", action='append', default=[], metavar="CLASS=SECONDS", help=f"Override the request timeout of one query class. Can be specified multiple times. Classes: {', '.join(sorted(QUERY_CLASS_TIMEOUTS))}.")
+    parser.add_argument("--breaker-failure-threshold", type=int, default=endpoint_health.CIRCUIT_BREAKER_FAILURE_THRESHOLD, help=f"Consecutive failures after which an endpoint's circuit breaker opens (default: {endpoint_health.CIRCUIT_BREAKER_FAILURE_THRESHOLD}).")
+    parser.add_argument("--breaker-cooldown", type=float, default=endpoint_health.CIRCUIT_BREAKER_COOLDOWN_SECONDS, help=f"Seconds an open circuit breaker waits before letting a trial request through (default: {endpoint_health.CIRCUIT_BREAKER_COOLDOWN_SECONDS}).")
+    parser.add_argument("--gazetteer-file", help="Gazetteer of reviewed matches built with build_gazetteer.py. Rows found in it (by name and context) are resolved without querying any endpoint.")
+    parser.add_argument("--tgn-label-filter", help="Label filter of all TGN labels built with build_label_filter.py. The TGN stages are skipped for names that no TGN label matches.")
+    parser.add_argument("--wikidata-label-filter", help="Label filter of the Wikidata skos:prefLabel values built with build_label_filter.py. The Wikidata fallbacks are skipped for names that no Wikidata label matches.")
+    parser.add_argument("--lean-candidates", action='store_true', help="Query only the matching TGN entities with their place types and depth, rank them in the script (tgn_ranking.py) and fetch the details of the winner. Cheaper for the server than the ranked TGN queries.")
+    parser.add_argument("--place-type-table-file", help="With --lean-candidates, JSON file caching the place type -> ancestors table. It is downloaded once if the file does not exist.")
+    parser.add_argument("--adaptive-cascade", action='store_true', help="Skip cascade stages whose expected cost per hit (average time divided by hit rate, per stage and context specificity) is above --max-cost-per-hit. Skipped stages are reported. A row that a skipped stage would have matched may instead get the match of a later, lower-precedence stage (e.g. a global or Wikidata-only match) or stay unmatched.")
+    parser.add_argument("--max-cost-per-hit", type=float, default=DEFAULT_MAX_COST_PER_HIT_SECONDS, help=f"With --adaptive-cascade, expected seconds per hit above which a stage is skipped (default: {DEFAULT_MAX_COST_PER_HIT_SECONDS:.0f}).")
+    parser.add_argument("--planner-min-attempts", type=int, default=DEFAULT_MIN_ATTEMPTS, help=f"With --adaptive-cascade, attempts of a stage (including loaded statistics) before it can be skipped (default: {DEFAULT_MIN_ATTEMPTS}).")
+    parser.add_argument("--cascade-stats-file", help="JSON file with the stage statistics of earlier runs. They are used by --adaptive-cascade from the start of the run, and the file is updated at the end.")
+    parser.add_argument("--workers", type=int, default=1, help="Number of rows reconciled in parallel (default: 1). Requests per endpoint are limited adaptively up to this number: the limit grows while responses are healthy and is halved on timeouts, HTTP 429/5xx and latency spikes.")
+    parser.add_argument("--match-mode", choices=MATCH_MODES, default=DEFAULT_MATCH_MODE, help=f"Label matching strategy used in the SPARQL queries (default: {DEFAULT_MATCH_MODE}). 'variants' and 'qlever-text' can use an index instead of scanning every label.")
+    parser.add_argument("--tgn-endpoint", action='append', default=[], metavar="URL", help=f"SPARQL endpoint serving TGN (default: {SPARQL_ENDPOINT_URL}). Can be specified multiple times for replicas (e.g. a mirror); requests go to the healthiest, fastest replica and fail over to the others.")
+    parser.add_argument("--wikidata-endpoint", action='append', default=[], metavar="URL", help=f"SPARQL endpoint serving Wikidata for the fallbacks, prefetches and enrichment (default: {WIKIDATA_SPARQL_ENDPOINT_URL}). Can be specified multiple times for replicas. The federated lookup inside the TGN queries always uses the default.")
+    parser.add_argument("--hedge-requests", action='store_true', help="For endpoints with several replicas, send a duplicate of a request that is still running after the p95 latency of its query class to a second replica, and take the first answer.")
+
+def validate_cascade_arguments(parser, args):
+    # Checks the options added by add_cascade_arguments and derives top_region_configs and query_timeouts
     if not (len(args.top_region_def_file) == len(args.trd_name_cols) == len(args.trd_uri_col)):
         parser.error("The number of --top-region-def-file, --trd-name-cols, and --trd-uri-col arguments must be the same.")
 
-    args.top_region_configs = []
-    for i in range(len(args.top_region_def_file)):
+    try:
+        args.top_region_configs = build_top_region_configs(args.top_region_def_file, args.trd_name_cols, args.trd_uri_col)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.workers < 1:
+        parser.error("--workers must be at least 1.")
+    if args.planner_min_attempts < 1:
+        parser.error("--planner-min-attempts must be at least 1.")
+    if args.hedge_requests and len(set(args.tgn_endpoint)) < 2 and len(set(args.wikidata_endpoint)) < 2:
+        print("Warning: --hedge-requests has no effect without several --tgn-endpoint or --wikidata-endpoint replicas.", file=sys.stderr)
+
+    args.query_timeouts = {}
+    for timeout_setting in args.query_timeout:
+        query_class, _, seconds = timeout_setting.partition("=")
+        query_class = query_class.strip()
+        if query_class not in QUERY_CLASS_TIMEOUTS:
+            parser.error(f"Unknown query class '{query_class}' in --query-timeout. Expected one of: {', '.join(sorted(QUERY_CLASS_TIMEOUTS))}.")
         try:
-            name_cols = [int(x.strip()) - 1 for x in args.trd_name_cols[i].split(',')]
+            args.query_timeouts[query_class] = float(seconds)
         except ValueError:
-            parser.error(f"Column indices for --trd-name-cols '{args.trd_name_cols[i]}' must be integers or comma-separated integers.")
-        
-        args.top_region_configs.append({
-            "file_path": args.top_region_def_file[i],
-            "name_col_indices": name_cols,
-            "uri_col_idx": args.trd_uri_col[i] - 1,
-            "num_name_cols": len(name_cols)
-        })
+            parser.error(f"--query-timeout '{timeout_setting}' must have the form CLASS=SECONDS.")
+
+def new_cascade_settings(args, http_session=None):
+    # The CascadeSettings of the engine options (add_engine_arguments, validated)
+    return CascadeSettings(
+        languages=args.languages, fields=args.fields, top_k=args.top_k, query_timeouts=args.query_timeouts,
+        replica_urls={SPARQL_ENDPOINT_URL: args.tgn_endpoint, WIKIDATA_SPARQL_ENDPOINT_URL: args.wikidata_endpoint}, hedge_requests=args.hedge_requests,
+        breaker_failure_threshold=args.breaker_failure_threshold, breaker_cooldown=args.breaker_cooldown, max_concurrency=args.workers, http_session=http_session,
+    )
+
+def add_engine_arguments(parser):
+    """Adds the options of a ReconciliationEngine: the cascade options plus the retry, Wikidata, column and scheduling options of a run."""
+    add_cascade_arguments(parser)
+    parser.add_argument("--deferred-retry-rounds", type=int, default=3, help="How many times rows deferred because of an open circuit breaker are retried at the end of the run (default: 3).")
+    parser.add_argument("--error-retry-delay", type=float, default=2.0, help="Pause in seconds between rows in the final retry pass over errored rows (default: 2). Use 0 to skip the pause, a negative value to skip the retry pass.")
+    parser.add_argument("--deferred-wikidata", action='store_true', help="Run the TGN queries without the federated Wikidata SERVICE call and look up the Wikidata entities of all matched TGN IDs afterwards, in batches against the Wikidata endpoint. The output is the same.")
+    parser.add_argument("--wikidata-batch-size", type=int, default=DEFAULT_WIKIDATA_BATCH_SIZE, help=f"With --deferred-wikidata, number of TGN IDs looked up per Wikidata query (default: {DEFAULT_WIKIDATA_BATCH_SIZE}).")
+    parser.add_argument("--languages", default=",".join(DEFAULT_LABEL_LANGUAGES), help=f"Comma-separated Getty language codes of the label_<code> columns (default: {','.join(DEFAULT_LABEL_LANGUAGES)}). The TGN queries fetch all of them with one label pattern; the preferred label of a language wins over its alternative labels.")
+    parser.add_argument("--fields", help=f"Comma-separated output columns to fetch and write (default: all). The TGN queries then skip the label, type, scope note and Wikidata lookups of the other columns, e.g. --fields tgn_uri,wikidata_uri for a link-only run. Columns: {','.join(SCRIPT_MANAGED_DATA_COLUMNS)} (with a label_<code> column per --languages code).")
+    parser.add_argument("--breadth-first", action='store_true', help="Run the cascade stage by stage instead of row by row: every pending row runs its next stage in one wave, rows needing the same lookup share one query, and the lookups of a wave run in --workers threads. Every row gets the same match as row by row. The final retry pass still runs row by row.")
+    parser.add_argument("--top-k", type=int, metavar="K", help="Also keep the K best candidates of every queried row and write them, with their type rank, distance rank and stage, to --top-k-file. The ranked TGN queries return them in the same query; the output CSV keeps the best candidate.")
+
+def validate_engine_arguments(parser, args):
+    # Checks the options added by add_engine_arguments; --languages and --fields become lists of codes and columns
+    validate_cascade_arguments(parser, args)
+    if args.wikidata_batch_size < 1:
+        parser.error("--wikidata-batch-size must be at least 1.")
+    if args.top_k is not None and args.top_k < 1:
+        parser.error("--top-k must be at least 1.")
+
+    try:
+        args.languages = parse_label_languages(args.languages)
+    except ValueError as e:
+        parser.error(str(e))
+    language_data_columns = data_columns_for_languages(args.languages)
+    if args.fields is None:
+        args.fields = language_data_columns
+    else:
+        args.fields = list(dict.fromkeys(field.strip() for field in args.fields.split(',') if field.strip()))
+        unknown_fields = [field for field in args.fields if field not in language_data_columns]
+        if unknown_fields:
+            parser.error(f"Unknown column(s) in --fields: {', '.join(unknown_fields)}. Expected some of: {','.join(language_data_columns)}.")
+        if not args.fields:
+            parser.error("--fields must name at least one column.")
+    if args.deferred_wikidata and not any(field in WIKIDATA_COLUMNS for field in args.fields):
+        print("Info: --fields has no Wikidata column, so the TGN queries skip the Wikidata lookup and --deferred-wikidata has no effect.", file=sys.stderr)
+        args.deferred_wikidata = False
+
+def engine_arguments(argv):
+    """
+    Settings of a ReconciliationEngine from argv, a list of the engine options as on the command line, e.g.
+    ["--top-region-def-file", "countries.csv", "--trd-name-cols", "2", "--trd-uri-col", "7", "--workers", "4"].
+    Invalid options exit with a usage message, like on the command line.
+    """
+    parser = argparse.ArgumentParser(prog="ReconciliationEngine", description="Settings of a reconciliation engine (reconcile_region.py).")
+    add_engine_arguments(parser)
+    args = parser.parse_args(list(argv))
+    validate_engine_arguments(parser, args)
+    return args
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Reconcile region names from a CSV file against the TGN SPARQL endpoint, using top-region URIs from one or more CSV definition files.")
+    parser.add_argument("--regions-input-file", required=True, help="Path to the input CSV file with regions to reconcile.")
+    parser.add_argument("--ri-top-region-name-col", required=True, type=str, help="Column index (1-based) or comma-separated indices for the top-region name(s) in the regions input file (used for lookup).")
+    parser.add_argument("--ri-region-name-col", required=True, type=int, help="Column index (1-based) for the region name (term to reconcile) in the regions input file.")
+    add_engine_arguments(parser)
+    parser.add_argument("--dead-letter-file", help="JSONL file receiving the rows whose lookups still failed after the final retry pass, with the failing stage and error (default: <regions input file>.dead_letters.jsonl).")
+    parser.add_argument("--retry-dead-letters", metavar="DEAD_LETTER_FILE", help="Only reprocess the rows listed in this dead-letter file and write just those rows to the output.")
+    parser.add_argument("--previous-output", help="Output file of an earlier run. Rows are joined on the --ri-top-region-name-col and --ri-region-name-col columns, and their previous results (including hand corrections) are kept. Only new rows and rows whose key columns changed are queried.")
+    parser.add_argument("--requery-unmatched", action='store_true', help="With --previous-output, also query rows that had no result in the previous output (number_of_results 0 and no URI filled in).")
+    parser.add_argument("--priority-col", type=int, help="Column index (1-based) with the weight of each row, e.g. the leading count column of the example inputs. Rows are reconciled by descending weight instead of file order, the results so far are written to --progress-output, and the weighted coverage is reported every --progress-interval seconds. The output keeps the input order.")
+    parser.add_argument("--progress-output", help="CSV file rewritten every --progress-interval seconds with the results so far, in the output format (default with --priority-col: <regions input file>.partial.csv).")
+    parser.add_argument("--progress-interval", type=float, default=DEFAULT_PROGRESS_INTERVAL_SECONDS, help=f"Seconds between two progress reports and rewrites of --progress-output (default: {DEFAULT_PROGRESS_INTERVAL_SECONDS}).")
+    parser.add_argument("--top-k-file", help="JSONL file receiving the --top-k candidates, one line per queried row (default: <regions input file>.candidates.jsonl).")
+    parser.add_argument("--plan", action='store_true', help="Dry run: read the input and definition files, resolve the contexts, gazetteer and label filter hits, and report the distinct lookups, the queries per stage (worst case and expected from the hit rates in --cascade-stats-file), the rows without a context and the projected wall time at --workers. Sends no queries and writes no output.")
+    parser.add_argument("--trace-file", help="Write a span per row, context attempt, cascade stage, SPARQL request and parse/store step to this file, as Chrome trace-event JSON (open it in ui.perfetto.dev or chrome://tracing).")
+    
+    args = parser.parse_args()
+    validate_engine_arguments(parser, args)
 
     try:
         args.ri_top_region_name_col = [int(x.strip()) - 1 for x in args.ri_top_region_name_col.split(',')]
@@ -501,12 +553,40 @@ def parse_arguments():
         parser.error("Column indices for --ri-top-region-name-col must be integers or comma-separated integers.")
     
     args.ri_region_name_col -= 1
+    if args.priority_col is not None:
+        if args.priority_col < 1:
+            parser.error("--priority-col must be at least 1.")
+        args.priority_col -= 1
+    if args.progress_interval <= 0:
+        parser.error("--progress-interval must be positive.")
+    if args.top_k_file and args.top_k is None:
+        parser.error("--top-k-file requires --top-k.")
 
-    # Sort top_region_configs by num_name_cols in descending order (most specific first)
-    args.top_region_configs.sort(key=lambda x: x["num_name_cols"], reverse=True)
-    
     return args
 
+def build_top_region_configs(top_region_def_files, trd_name_cols, trd_uri_cols):
+    """
+    Combines the --top-region-def-file, --trd-name-cols and --trd-uri-col values into definition configs, sorted by
+    specificity (most name columns first). Raises ValueError for malformed column lists.
+    """
+    top_region_configs = []
+    for i in range(len(top_region_def_files)):
+        try:
+            name_cols = [int(x.strip()) - 1 for x in trd_name_cols[i].split(',')]
+        except ValueError:
+            raise ValueError(f"Column indices for --trd-name-cols '{trd_name_cols[i]}' must be integers or comma-separated integers.")
+        
+        top_region_configs.append({
+            "file_path": top_region_def_files[i],
+            "name_col_indices": name_cols,
+            "uri_col_idx": trd_uri_cols[i] - 1,
+            "num_name_cols": len(name_cols)
+        })
+
+    # Sort top_region_configs by num_name_cols in descending order (most specific first)
+    top_region_configs.sort(key=lambda x: x["num_name_cols"], reverse=True)
+    return top_region_configs
+
 def read_top_region_definitions(top_region_configs):
     loaded_lookup_configs = []
     for config in top_region_configs:
@@ -525,7 +605,7 @@ def read_top_region_definitions(top_region_configs):
                 for i, row in enumerate(reader):
                     if len(row) > max_req_idx:
                         try:
-                            top_region_name_parts = tuple(row[idx].strip().lower() for idx in name_col_indices)
+                            top_region_name_parts = normalize_context_name_parts(row[idx] for idx in name_col_indices)
                         except IndexError:
                             print(f"Warning: Row {i+2} in top-region definition file '{filename}' is too short for all name columns. Skipping.", file=sys.stderr)
                             continue
@@ -559,10 +639,39 @@ def read_top_region_definitions(top_region_configs):
         })
     return loaded_lookup_configs
 
-def read_regions_for_reconciliation(regions_filename, loaded_lookup_configs, ri_top_region_name_col_indices, region_name_col_idx, remove_trailing_state_flag): # Added remove_trailing_state_flag
+def load_top_region_context_index(top_region_configs, context_index_file=None):
+    """
+    Returns the context index for the given definition files. When context_index_file is set, a sidecar built from
+    unchanged definition files is reused, otherwise the files are parsed and the sidecar is (re)written.
+    """
+    if context_index_file:
+        context_index = load_context_index(context_index_file, top_region_configs)
+        if context_index is not None:
+            print(f"Info: Reusing context index '{context_index_file}' ({context_index['entry_count']} top-region entries).", file=sys.stderr)
+            return context_index
+
+    loaded_lookup_configs = read_top_region_definitions(top_region_configs)
+    context_index = build_context_index(loaded_lookup_configs, top_region_configs)
+    if context_index_file:
+        save_context_index(context_index, context_index_file)
+        print(f"Info: Wrote context index '{context_index_file}' ({context_index['entry_count']} top-region entries).", file=sys.stderr)
+    return context_index
+
+def strip_trailing_state(region_name):
+    # Check for " (anything)" or "(anything)" at the end of the string
+    # The regex looks for optional whitespace, then '(', any characters (non-greedy), ')', then end of string.
+    match = re.search(r"\s*\((.*?)\)$", region_name)
+    if match:
+        # Remove the matched part (e.g., " (State)") and then strip any surrounding whitespace from the result
+        return region_name[:match.start()].strip()
+    return region_name
+
+def read_regions_for_reconciliation(regions_filename, context_index, ri_top_region_name_col_indices, region_name_col_idx, remove_trailing_state_flag): # Added remove_trailing_state_flag
     original_regions_header = []
     original_regions_data_rows = []
     sparql_values_to_query = []
+    # Input files repeat the same top-region names on many rows; resolve every distinct combination only once
+    context_candidates_by_raw_parts = {}
 
     required_indices_input = ri_top_region_name_col_indices + [region_name_col_idx]
     max_req_idx_input = max(required_indices_input) if required_indices_input else -1
@@ -589,43 +698,26 @@ def read_regions_for_reconciliation(regions_filename, loaded_lookup_configs, ri_
                 region_name_for_query = original_region_name_from_file # This will be potentially modified
 
                 if remove_trailing_state_flag:
-                    # Check for " (anything)" or "(anything)" at the end of the string
-                    # The regex looks for optional whitespace, then '(', any characters (non-greedy), ')', then end of string.
-                    match = re.search(r"\s*\((.*?)\)$", region_name_for_query)
-                    if match:
-                        # Remove the matched part (e.g., " (State)") and then strip any surrounding whitespace from the result
-                        region_name_for_query = region_name_for_query[:match.start()].strip()
+                    region_name_for_query = strip_trailing_state(region_name_for_query)
                 
                 # Clean trailing empty strings from the input top region parts
                 cleaned_top_region_parts = list(raw_top_region_parts)
                 while cleaned_top_region_parts and not cleaned_top_region_parts[-1]:
                     cleaned_top_region_parts.pop()
                 
-                final_input_key_tuple = tuple(part.lower() for part in cleaned_top_region_parts)
+                raw_parts_key = tuple(cleaned_top_region_parts)
                 
                 potential_top_region_contexts = []
-                if not final_input_key_tuple: # All parts were empty or no parts to begin with
+                if not raw_parts_key: # All parts were empty or no parts to begin with
                     name_str_input = ", ".join(f'"{p}"' for p in raw_top_region_parts) # Show original for clarity
                     print(f"Warning: All top-region name parts are empty for input '{name_str_input}' on data row {i+1} (file row {i+2}). Cannot find any top-region URIs.", file=sys.stderr)
                 else:
-                    for lookup_config in loaded_lookup_configs: # loaded_lookup_configs is already sorted by specificity
-                        current_map_data = lookup_config["map_data"]
-                        expected_num_cols = lookup_config["num_name_cols"]
-                        
-                        candidate_key = None
-                        # Try to form a key for the current lookup_config
-                        if len(final_input_key_tuple) >= expected_num_cols:
-                            candidate_key = final_input_key_tuple[:expected_num_cols]
-                        
-                        if candidate_key:
-                            top_region_uri = current_map_data.get(candidate_key)
-                            if top_region_uri:
-                                potential_top_region_contexts.append({
-                                    "uri": top_region_uri,
-                                    "source_file": lookup_config["file_path"],
-                                    "specificity": expected_num_cols 
-                                })
-                                # print(f"DEBUG: Found potential context for row {i+2}: URI <{top_region_uri}> from '{lookup_config['file_path']}' (specificity {expected_num_cols}) using key {candidate_key}", file=sys.stderr)
+                    # One walk down the context trie returns the candidates of every definition file, most specific first.
+                    # The returned lists are shared between rows and are only read afterwards.
+                    potential_top_region_contexts = context_candidates_by_raw_parts.get(raw_parts_key)
+                    if potential_top_region_contexts is None:
+                        potential_top_region_contexts = lookup_context_candidates(context_index, normalize_context_name_parts(raw_parts_key))
+                        context_candidates_by_raw_parts[raw_parts_key] = potential_top_region_contexts
                 
                 if region_name_for_query:
                     if potential_top_region_contexts:
@@ -634,7 +726,7 @@ def read_regions_for_reconciliation(regions_filename, loaded_lookup_configs, ri_
                         # No contexts found, but we still need to process this row for global search later
                         sparql_values_to_query.append((region_name_for_query, [], i)) 
                         name_str_input = ", ".join(f'"{p}"' for p in raw_top_region_parts)
-                        cleaned_name_str_input = ", ".join(f'"{p}"' for p in final_input_key_tuple)
+                        cleaned_name_str_input = ", ".join(f'"{p}"' for p in normalize_context_name_parts(raw_parts_key))
                         print(f"Info: No top-region contexts found for input (original: '{name_str_input}', cleaned: '{cleaned_name_str_input}') on data row {i+1} (file row {i+2}). Will attempt global search only.", file=sys.stderr)
                 else:
                     # Log using original_region_name_from_file if region_name_for_query became empty
@@ -649,6 +741,77 @@ def read_regions_for_reconciliation(regions_filename, loaded_lookup_configs, ri_
         
     return original_regions_header, original_regions_data_rows, sparql_values_to_query
 
+def read_previous_output(previous_output_filename, key_column_names, output_data_columns):
+    """
+    Reads a file written by an earlier run (the output of this script, possibly edited by hand).
+    Returns a map of key tuple (the stripped values of key_column_names) -> list of rows in file order,
+    each row being a dict of the script-managed columns (output_data_columns) and number_of_results.
+    """
+    previous_rows_by_key = defaultdict(list)
+    try:
+        with open(previous_output_filename, 'r', newline='', encoding='utf-8') as csvfile:
+            reader = csv.reader(csvfile)
+            previous_header = next(reader)
+            previous_header_idx_map = {}
+            for idx, name in enumerate(previous_header):
+                previous_header_idx_map.setdefault(name, idx)
+            missing_columns = [name for name in key_column_names + output_data_columns + ["number_of_results"] if name not in previous_header_idx_map]
+            if missing_columns:
+                print(f"Error: Previous output file '{previous_output_filename}' lacks the column(s): {', '.join(missing_columns)}.", file=sys.stderr)
+                sys.exit(1)
+            key_col_indices = [previous_header_idx_map[name] for name in key_column_names]
+            value_col_indices = [(name, previous_header_idx_map[name]) for name in output_data_columns + ["number_of_results"]]
+            for row in reader:
+                if not row:
+                    continue
+                key = tuple(row[idx].strip() if idx < len(row) else "" for idx in key_col_indices)
+                previous_rows_by_key[key].append({name: row[idx] if idx < len(row) else "" for name, idx in value_col_indices})
+    except FileNotFoundError:
+        print(f"Error: Previous output file '{previous_output_filename}' not found.", file=sys.stderr)
+        sys.exit(1)
+    except StopIteration:
+        print(f"Warning: Previous output file '{previous_output_filename}' is empty. All rows will be queried.", file=sys.stderr)
+    return previous_rows_by_key
+
+def previous_row_has_match(previous_row):
+    # A row counts as matched if it reports results or if a URI was filled in by hand
+    try:
+        if int(previous_row["number_of_results"] or 0) > 0:
+            return True
+    except ValueError:
+        pass
+    return bool(previous_row.get("tgn_uri", "").strip() or previous_row.get("wikidata_uri", "").strip())
+
+def carry_forward_previous_results(original_data_rows, sparql_values_to_query, previous_rows_by_key, key_col_indices, requery_unmatched=False, forced_row_indices=None):
+    """
+    Splits the rows to reconcile into rows whose previous result is reused and rows that must be queried again.
+    Rows are joined on their key columns; the n-th input row with a key takes over the n-th previous row with that key
+    (or the last one if the previous file had fewer). New rows and rows whose key columns changed have no previous row
+    and are queried. Previous rows without a match are reused too unless requery_unmatched is set.
+    Rows in forced_row_indices are always queried.
+    Returns (items_to_query, carried_forward_rows), carried_forward_rows mapping row index -> previous values.
+    """
+    forced_row_indices = forced_row_indices or set()
+    items_to_query = []
+    carried_forward_rows = {}
+    key_occurrences = defaultdict(int)
+    for row_idx, row in enumerate(original_data_rows):
+        key = tuple(row[idx].strip() if idx < len(row) else "" for idx in key_col_indices)
+        occurrence = key_occurrences[key]
+        key_occurrences[key] += 1
+        previous_rows = previous_rows_by_key.get(key)
+        if not previous_rows or row_idx in forced_row_indices:
+            continue
+        previous_row = previous_rows[min(occurrence, len(previous_rows) - 1)]
+        if requery_unmatched and not previous_row_has_match(previous_row):
+            continue
+        carried_forward_rows[row_idx] = previous_row
+
+    for item in sparql_values_to_query:
+        if item[2] not in carried_forward_rows:
+            items_to_query.append(item)
+    return items_to_query, carried_forward_rows
+
 def extract_tgn_id_from_uri(tgn_uri):
     if not tgn_uri:
         return None
@@ -661,41 +824,559 @@ def extract_tgn_id_from_uri(tgn_uri):
     # For now, strict parsing of common TGN URI patterns.
     return None
 
-def execute_generic_sparql_query(query, endpoint_url, auth_details=None, accept_header="application/sparql-results+json", timeout=300):
+def new_http_session(pool_size):
+    """A requests.Session for the SPARQL requests that keeps up to pool_size connections per endpoint alive."""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=max(int(pool_size), 1))
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+def is_endpoint_health_failure(error):
+    # Failures that say something about the endpoint's health (as opposed to e.g. a 400 for a malformed query)
+    if isinstance(error, (requests.exceptions.Timeout, requests.exceptions.ConnectionError, json.JSONDecodeError)):
+        return True
+    response = getattr(error, 'response', None)
+    return response is not None and (response.status_code == 429 or response.status_code >= 500)
+
+def note_endpoint_failure(endpoint_url, settings):
+    if record_endpoint_failure(endpoint_url, settings.breaker_failure_threshold, settings.breaker_cooldown):
+        print(f"Warning: Circuit breaker for {endpoint_url} opened after repeated failures. Rows that need this endpoint will be deferred for {settings.breaker_cooldown}s.", file=sys.stderr)
+
+def execute_generic_sparql_query(query, endpoint_url, auth_details=None, accept_header="application/sparql-results+json", timeout=None, query_class=None, settings=DEFAULT_CASCADE_SETTINGS):
+    """
+    Executes a SPARQL query on a replica of the logical endpoint endpoint_url (see endpoint_registry.py) and returns
+    the JSON response (which always has results.bindings). Replicas are tried healthiest and fastest first; a
+    timeout, connection error, HTTP 429/5xx or malformed response fails over to the next replica, and with
+    --hedge-requests a slow request is duplicated on the next replica after the endpoint's p95 latency.
+    The timeout defaults to the one of query_class in settings (see QUERY_CLASS_TIMEOUTS), and the replicas, hedging,
+    breaker and concurrency limits and the HTTP session are those of settings (CascadeSettings).
+    Raises EndpointUnavailableError without sending anything if the circuit breakers of all replicas are open,
+    and SparqlQueryError if the request failed, so that a failed lookup is never mistaken for an empty result.
+    """
+    if timeout is None:
+        timeout = settings.query_timeout(query_class)
+
     headers = {
         "Accept": accept_header,
         "Content-Type": "application/x-www-form-urlencoded"
     }
     auth = auth_details # Can be None for public endpoints like Wikidata
 
+    # Replicas with a free request slot first
+    candidate_replicas = sorted(replica_order(settings.endpoint_replicas(endpoint_url)), key=lambda replica_url: get_concurrency_limiter(replica_url, settings.max_concurrency).is_saturated())
+    unavailable_errors = []
+    def next_available_replica():
+        # Pops the next replica whose circuit breaker lets a request through, or returns None
+        while candidate_replicas:
+            replica_url = candidate_replicas.pop(0)
+            try:
+                check_circuit_breaker(replica_url)
+                return replica_url
+            except EndpointUnavailableError as e:
+                unavailable_errors.append(e)
+        return None
+
+    first_replica = next_available_replica()
+    if first_replica is None:
+        raise min(unavailable_errors, key=lambda e: e.retry_after_seconds)
+    hedge_after_seconds = hedge_delay(endpoint_url, query_class) if settings.hedge_requests and candidate_replicas else None
+    if hedge_after_seconds is None:
+        replica_url = first_replica
+        while True:
+            try:
+                return query_replica(query, endpoint_url, replica_url, headers, auth, timeout, query_class, settings)
+            except SparqlQueryError as e:
+                next_replica = next_available_replica() if is_failover_error(e) else None
+                if next_replica is None:
+                    raise
+                print(f"Info: Failing over from {replica_url} to {next_replica} ({query_class or 'query'}).", file=sys.stderr)
+                record_failover()
+                replica_url = next_replica
+
+    # Hedged: the replicas answer on their own threads, the first successful answer wins. Once the call returns or
+    # raises, the requests still running give their concurrency slots back (their HTTP requests run on until they
+    # are answered or time out, but the answers are dropped).
+    answers = queue.Queue()
+    concurrency_slots = []
+    def ask_replica(replica_url, is_hedge):
+        concurrency_slot = ConcurrencySlot(get_concurrency_limiter(replica_url, settings.max_concurrency))
+        concurrency_slots.append(concurrency_slot)
+        def run_request():
+            try:
+                answers.put((replica_url, is_hedge, query_replica(query, endpoint_url, replica_url, headers, auth, timeout, query_class, settings, concurrency_slot), None))
+            except SparqlQueryError as e:
+                answers.put((replica_url, is_hedge, None, e))
+        threading.Thread(target=run_request, daemon=True).start()
     try:
-        # print(f"DEBUG: Executing Generic SPARQL Query to {endpoint_url}:\n{query}", file=sys.stderr) # Uncomment for debugging
-        response = requests.post(endpoint_url, data={"query": query}, headers=headers, auth=auth, timeout=timeout)
-        response.raise_for_status()
-        return response.json()
-    except requests.exceptions.RequestException as e:
-        print(f"Error executing SPARQL query to {endpoint_url}: {e}", file=sys.stderr)
-        if hasattr(e, 'response') and e.response is not None:
-            print(f"Response status code: {e.response.status_code}", file=sys.stderr)
-            print(f"Response text: {e.response.text}", file=sys.stderr)
+        ask_replica(first_replica, False)
+        requests_in_flight = 1
+        hedge_sent = False
+        hedge_launched = False
+        last_error = None
+        while requests_in_flight:
+            try:
+                replica_url, is_hedge, response_json, error = answers.get(timeout=None if hedge_sent else hedge_after_seconds)
+            except queue.Empty:
+                hedge_sent = True
+                hedge_replica = next_available_replica()
+                if hedge_replica is not None:
+                    ask_replica(hedge_replica, True)
+                    requests_in_flight += 1
+                    hedge_launched = True
+                continue
+            requests_in_flight -= 1
+            if error is None:
+                if hedge_launched:
+                    record_hedge(won=is_hedge)
+                return response_json
+            if not is_failover_error(error):
+                raise error
+            last_error = error
+            next_replica = next_available_replica() if not requests_in_flight else None
+            if next_replica is not None:
+                print(f"Info: Failing over from {replica_url} to {next_replica} ({query_class or 'query'}).", file=sys.stderr)
+                record_failover()
+                ask_replica(next_replica, False)
+                requests_in_flight += 1
+        raise last_error
+    finally:
+        for concurrency_slot in concurrency_slots:
+            concurrency_slot.abandon()
+
+def is_failover_error(error):
+    # A failed request that another replica may answer: a health failure, or a malformed response (no __cause__)
+    return error.__cause__ is None or is_endpoint_health_failure(error.__cause__)
+
+def query_replica(query, endpoint_url, replica_url, headers, auth, timeout, query_class, settings, concurrency_slot=None):
+    # One request to replica_url (whose circuit breaker was checked) within its adaptive concurrency limit. A hedged
+    # request passes its concurrency_slot, which the caller abandons once the answer is no longer needed; it is then
+    # not sent at all if it was still waiting for the slot.
+    if concurrency_slot is None:
+        concurrency_slot = ConcurrencySlot(get_concurrency_limiter(replica_url, settings.max_concurrency))
+    if not concurrency_slot.acquire():
         return None
-    except json.JSONDecodeError as e:
-        print(f"Error decoding SPARQL JSON response from {endpoint_url}: {e}", file=sys.stderr)
-        if 'response' in locals() and hasattr(response, 'text'):
-             print(f"Response content: {response.text}", file=sys.stderr)
+    request_start_time = time.monotonic()
+    overloaded = False
+    try:
+        response_json = send_sparql_request(query, replica_url, headers, auth, timeout, query_class, settings)
+    except SparqlQueryError as e:
+        overloaded = is_endpoint_health_failure(e.__cause__) if e.__cause__ is not None else False
+        record_replica_failure(replica_url)
+        raise
+    finally:
+        concurrency_slot.release(time.monotonic() - request_start_time, overloaded)
+    record_endpoint_success(replica_url)
+    record_replica_success(endpoint_url, replica_url, query_class, time.monotonic() - request_start_time)
+    return response_json
+
+def send_sparql_request(query, endpoint_url, headers, auth, timeout, query_class, settings):
+    # One request of execute_generic_sparql_query; records endpoint failures and raises SparqlQueryError
+    with trace_span(f"query {query_class or 'sparql'}", "sparql", endpoint=endpoint_url, query_class=query_class, query_bytes=len(query)) as span_args:
+        try:
+            # print(f"DEBUG: Executing Generic SPARQL Query to {endpoint_url}:\n{query}", file=sys.stderr) # Uncomment for debugging
+            http_post = settings.http_session.post if settings.http_session is not None else requests.post
+            response = http_post(endpoint_url, data={"query": query}, headers=headers, auth=auth, timeout=timeout)
+            response.raise_for_status()
+            span_args["status"] = response.status_code
+            span_args["response_bytes"] = len(response.content)
+            with trace_span("parse json", "parse"):
+                response_json = response.json()
+        except requests.exceptions.RequestException as e:
+            print(f"Error executing SPARQL query to {endpoint_url}: {e}", file=sys.stderr)
+            if hasattr(e, 'response') and e.response is not None:
+                print(f"Response status code: {e.response.status_code}", file=sys.stderr)
+                print(f"Response text: {e.response.text}", file=sys.stderr)
+            if is_endpoint_health_failure(e):
+                note_endpoint_failure(endpoint_url, settings)
+            else:
+                record_endpoint_success(endpoint_url)
+            raise SparqlQueryError(endpoint_url, query_class, str(e)) from e
+        except json.JSONDecodeError as e:
+            print(f"Error decoding SPARQL JSON response from {endpoint_url}: {e}", file=sys.stderr)
+            if 'response' in locals() and hasattr(response, 'text'):
+                 print(f"Response content: {response.text}", file=sys.stderr)
+            note_endpoint_failure(endpoint_url, settings)
+            raise SparqlQueryError(endpoint_url, query_class, f"undecodable JSON response: {e}") from e
+        if not (isinstance(response_json, dict) and isinstance(response_json.get("results"), dict) and "bindings" in response_json["results"]):
+            print(f"Error: SPARQL response from {endpoint_url} has no results.bindings.", file=sys.stderr)
+            note_endpoint_failure(endpoint_url, settings)
+            raise SparqlQueryError(endpoint_url, query_class, "malformed response without results.bindings")
+        span_args["result_count"] = len(response_json["results"]["bindings"])
+    return response_json
+
+def execute_sparql_query(query, query_class=None, settings=DEFAULT_CASCADE_SETTINGS): # This is the original TGN-specific one, now uses the generic executor
+    auth = (SPARQL_USERNAME, SPARQL_PASSWORD)
+    return execute_generic_sparql_query(query, SPARQL_ENDPOINT_URL, auth_details=auth, query_class=query_class, settings=settings)
+
+def normalize_label_for_local_match(label):
+    # Local equivalent of the case-insensitive "^term$" label match done by the SPARQL templates
+    return label.strip().casefold()
+
+def count_context_usage(sparql_values_to_query):
+    # Number of rows that may need each context URI, used to decide which contexts are worth prefetching
+    context_row_counts = defaultdict(int)
+    for _, potential_top_region_contexts, _ in sparql_values_to_query:
+        for context_info in potential_top_region_contexts:
+            context_row_counts[context_info["uri"]] += 1
+    return context_row_counts
+
+def fetch_context_descendants(top_region_uri, settings):
+    """
+    Downloads every descendant of top_region_uri (up to 5 broaderPreferred levels) with one query.
+    Returns a map of normalized label -> list of (tgn_uri, type_rank, distance_rank), or None if the query failed.
+    """
+    print(f"Prefetching TGN descendants of context <{top_region_uri}>", file=sys.stderr)
+    query = TGN_CONTEXT_DESCENDANTS_QUERY_TEMPLATE.format(top_region_uri=top_region_uri)
+    try:
+        sparql_response_json = execute_sparql_query(query, query_class=QUERY_CLASS_PREFETCH, settings=settings)
+    except SparqlQueryError:
+        print(f"Warning: Prefetch of TGN descendants for context <{top_region_uri}> failed. Rows in this context will be queried individually.", file=sys.stderr)
         return None
 
-def execute_sparql_query(query): # This is the original TGN-specific one, now uses the generic executor
-    auth = (SPARQL_USERNAME, SPARQL_PASSWORD)
-    return execute_generic_sparql_query(query, SPARQL_ENDPOINT_URL, auth_details=auth)
+    label_map = defaultdict(list)
+    for binding in sparql_response_json["results"]["bindings"]:
+        tgn_uri = get_sparql_binding_value(binding, "tgn_uri")
+        found_label = get_sparql_binding_value(binding, "found_label")
+        if not tgn_uri or not found_label:
+            continue
+        try:
+            type_rank = int(get_sparql_binding_value(binding, "type_rank"))
+            distance_rank = int(get_sparql_binding_value(binding, "distance_rank"))
+        except ValueError:
+            print(f"Warning: Skipping prefetched descendant with invalid ranks for context <{top_region_uri}>. Binding: {binding}", file=sys.stderr)
+            continue
+        label_map[normalize_label_for_local_match(found_label)].append((tgn_uri, type_rank, distance_rank))
+
+    print(f"Info: Prefetched {len(label_map)} distinct labels below context <{top_region_uri}>.", file=sys.stderr)
+    return dict(label_map)
+
+def rank_prefetched_candidates(candidates):
+    # Same ordering as the contextual TGN query: lowest type rank first, then lowest distance rank.
+    # An entity can match through several labels, so the ranks are aggregated per entity first (MIN, as in the query).
+    # Returns (tgn_uri, type_rank, distance_rank) per entity, best first.
+    ranks_by_uri = {}
+    for tgn_uri, type_rank, distance_rank in candidates:
+        if tgn_uri in ranks_by_uri:
+            current_type_rank, current_distance_rank = ranks_by_uri[tgn_uri]
+            ranks_by_uri[tgn_uri] = (min(current_type_rank, type_rank), min(current_distance_rank, distance_rank))
+        else:
+            ranks_by_uri[tgn_uri] = (type_rank, distance_rank)
+    # The URI breaks ties so that repeated runs pick the same entity
+    return [(tgn_uri, type_rank, distance_rank) for tgn_uri, (type_rank, distance_rank) in sorted(ranks_by_uri.items(), key=lambda item: (item[1], item[0]))]
 
-def write_output_csv(original_header, original_data_rows, processed_sparql_results):
-    writer = csv.writer(sys.stdout)
+def fetch_wikidata_descendants(parent_tgn_id, settings):
+    """
+    Downloads every Wikidata entity up to 4 wdt:P131 hops below the entity with TGN ID parent_tgn_id.
+    Returns a map of normalized label -> list of (rank, wikidata_uri, tgn_id, wd_desc, label), or None if the query failed.
+    """
+    print(f"Prefetching Wikidata P131 descendants of parent TGN ID {parent_tgn_id}", file=sys.stderr)
+    query = WIKIDATA_P131_DESCENDANTS_QUERY_TEMPLATE.format(parent_tgn_id=parent_tgn_id)
+    try:
+        wikidata_response_json = execute_generic_sparql_query(query, WIKIDATA_SPARQL_ENDPOINT_URL, query_class=QUERY_CLASS_PREFETCH, settings=settings)
+    except SparqlQueryError:
+        print(f"Warning: Prefetch of Wikidata descendants for parent TGN ID {parent_tgn_id} failed. Wikidata fallbacks in this context will be queried individually.", file=sys.stderr)
+        return None
+
+    label_map = defaultdict(list)
+    for binding in wikidata_response_json["results"]["bindings"]:
+        wikidata_uri = get_sparql_binding_value(binding, "wikidata_uri")
+        label = get_sparql_binding_value(binding, "label")
+        if not wikidata_uri or not label:
+            continue
+        try:
+            rank = int(get_sparql_binding_value(binding, "rank"))
+        except ValueError:
+            print(f"Warning: Skipping prefetched Wikidata descendant with invalid rank for parent TGN ID {parent_tgn_id}. Binding: {binding}", file=sys.stderr)
+            continue
+        label_map[normalize_label_for_local_match(label)].append((
+            rank, wikidata_uri, get_sparql_binding_value(binding, "tgn_id"), get_sparql_binding_value(binding, "wd_desc"), label
+        ))
+
+    print(f"Info: Prefetched {len(label_map)} distinct Wikidata labels below parent TGN ID {parent_tgn_id}.", file=sys.stderr)
+    return dict(label_map)
 
-    script_managed_data_columns = [
-        "label", "label_en", "label_it", "label_de", "label_fr", 
-        "type", "scope_note", "wikidata_description", "tgn_uri", "wikidata_uri"
+def select_prefetched_wikidata_response(wikidata_label_map, region_name, max_rank, require_tgn_id):
+    """
+    Answers a contextual Wikidata fallback from prefetched descendants. Returns a response in the shape of a SPARQL JSON
+    result with 0 or 1 bindings (ORDER BY ASC(?rank) LIMIT 1), so the caller can process it like a query response.
+    """
+    candidates = [
+        candidate for candidate in wikidata_label_map.get(normalize_label_for_local_match(region_name), [])
+        if candidate[0] <= max_rank and (candidate[2] or not require_tgn_id)
     ]
+    if not candidates:
+        return {"results": {"bindings": []}}
+    rank, wikidata_uri, tgn_id, wd_desc, label = min(candidates, key=lambda candidate: (candidate[0], candidate[1]))
+    binding = {
+        "wikidata_uri": {"type": "uri", "value": wikidata_uri},
+        "label": {"type": "literal", "value": label},
+    }
+    if tgn_id:
+        binding["tgn_id"] = {"type": "literal", "value": tgn_id}
+    if wd_desc:
+        binding["wd_desc"] = {"type": "literal", "value": wd_desc}
+    return {"results": {"bindings": [binding]}}
+
+def fetch_tgn_details_with_wikidata(tgn_uri, tgn_details_cache, settings, deferred_wikidata=False):
+    # Returns the details binding for tgn_uri, or None if there is no single result. Fetched details are cached per URI.
+    # Raises SparqlQueryError if the fetch failed. With deferred_wikidata the Wikidata columns are left empty.
+    if tgn_uri in tgn_details_cache:
+        return tgn_details_cache[tgn_uri]
+    query_template = settings.tgn_query_template(QUERY_KIND_DETAILS, with_wikidata=not deferred_wikidata)
+    if query_template is None:
+        # --fields tgn_uri: nothing to fetch beyond the URI itself
+        tgn_details_cache[tgn_uri] = {}
+        return tgn_details_cache[tgn_uri]
+    tgn_details_query = query_template.format(tgn_uri_direct=tgn_uri)
+    tgn_details_response_json = execute_sparql_query(tgn_details_query, query_class=QUERY_CLASS_TGN_FETCH_BY_URI, settings=settings)
+    tgn_details_bindings = tgn_details_response_json["results"]["bindings"]
+    if len(tgn_details_bindings) == 1:
+        tgn_details_cache[tgn_uri] = tgn_details_bindings[0]
+        return tgn_details_bindings[0]
+    print(f"Warning: TGN details fetch for <{tgn_uri}> returned {len(tgn_details_bindings)} results (expected 1).", file=sys.stderr)
+    return None
+
+def build_tgn_result_item(tgn_uri, tgn_detail_binding, settings):
+    # Result of a TGN match whose details were fetched with CascadeSettings.tgn_query_template(QUERY_KIND_DETAILS)
+    return {
+        "label": get_sparql_binding_value(tgn_detail_binding, "label"),
+        **settings.label_values(tgn_detail_binding),
+        "type": get_sparql_binding_value(tgn_detail_binding, "type"),
+        "scope_note": get_sparql_binding_value(tgn_detail_binding, "scope_note"),
+        "wikidata_description": get_sparql_binding_value(tgn_detail_binding, "wikidata_description"),
+        "tgn_uri": tgn_uri,
+        "wikidata_uri": get_sparql_binding_value(tgn_detail_binding, "wikidata_uri"),
+    }
+
+def new_candidate(tgn_uri="", wikidata_uri="", label="", place_type="", type_rank=None, distance_rank=None):
+    # One ranked candidate of --top-k; the ranks are None where the stage has none (e.g. the Wikidata fallbacks)
+    return {"tgn_uri": tgn_uri, "wikidata_uri": wikidata_uri, "label": label, "type": place_type, "type_rank": type_rank, "distance_rank": distance_rank}
+
+def ranked_candidate_list(ranked_candidates, settings):
+    # The --top-k candidates of (tgn_uri, type_rank, distance_rank) tuples, best first; None without --top-k
+    if not settings.top_k:
+        return None
+    return [new_candidate(tgn_uri=tgn_uri, type_rank=type_rank, distance_rank=distance_rank) for tgn_uri, type_rank, distance_rank in ranked_candidates[:settings.top_k]]
+
+def binding_rank(binding, key):
+    rank_value = get_sparql_binding_value(binding, key)
+    try:
+        return int(float(rank_value))
+    except ValueError:
+        return None
+
+def tgn_binding_candidates(bindings, region_name, match_mode, settings):
+    # The --top-k candidates of a ranked TGN query response (best first), skipping those whose label does not verify
+    if not settings.top_k:
+        return None
+    candidates = []
+    for binding in bindings[:settings.top_k]:
+        tgn_uri = get_sparql_binding_value(binding, "tgn_uri")
+        if tgn_uri and binding_passes_label_verification(binding, region_name, match_mode, label_key="matched_label"):
+            candidates.append(new_candidate(
+                tgn_uri=tgn_uri, wikidata_uri=get_sparql_binding_value(binding, "wikidata_uri"),
+                label=get_sparql_binding_value(binding, "label"), place_type=get_sparql_binding_value(binding, "type"),
+                type_rank=binding_rank(binding, "type_rank"), distance_rank=binding_rank(binding, "distance_rank"),
+            ))
+    return candidates
+
+def load_place_type_ancestor_table(place_type_table_file=None, settings=DEFAULT_CASCADE_SETTINGS):
+    """
+    Returns the place type -> ancestors table for tgn_ranking.py, read from place_type_table_file if it exists and
+    downloaded (and written to place_type_table_file) otherwise. Returns None if it could not be downloaded.
+    """
+    if place_type_table_file and os.path.exists(place_type_table_file):
+        try:
+            with open(place_type_table_file, 'r', encoding='utf-8') as table_file:
+                stored_table = json.load(table_file)
+            if stored_table.get("format_version") == PLACE_TYPE_TABLE_FORMAT_VERSION:
+                print(f"Info: Reusing place type table '{place_type_table_file}' ({len(stored_table['pairs'])} entries).", file=sys.stderr)
+                return build_place_type_ancestor_table(stored_table["pairs"])
+            print(f"Info: Place type table '{place_type_table_file}' has an old format. Downloading it again.", file=sys.stderr)
+        except (OSError, ValueError, KeyError, AttributeError) as e:
+            print(f"Warning: Could not read place type table '{place_type_table_file}': {e}. Downloading it again.", file=sys.stderr)
+
+    print("Downloading the place type ancestor table", file=sys.stderr)
+    try:
+        sparql_response_json = execute_sparql_query(PLACE_TYPE_ANCESTORS_QUERY, query_class=QUERY_CLASS_PREFETCH, settings=settings)
+    except (SparqlQueryError, EndpointUnavailableError):
+        return None
+    pairs = []
+    for binding in sparql_response_json["results"]["bindings"]:
+        type_uri = get_sparql_binding_value(binding, "type")
+        ancestor_uri = get_sparql_binding_value(binding, "ancestor")
+        if type_uri and ancestor_uri:
+            pairs.append([type_uri, ancestor_uri])
+
+    if place_type_table_file:
+        try:
+            with open(place_type_table_file, 'w', encoding='utf-8') as table_file:
+                json.dump({"format_version": PLACE_TYPE_TABLE_FORMAT_VERSION, "pairs": pairs}, table_file)
+        except OSError as e:
+            print(f"Warning: Could not write place type table '{place_type_table_file}': {e}", file=sys.stderr)
+    print(f"Info: Downloaded {len(pairs)} place type ancestor entries.", file=sys.stderr)
+    return build_place_type_ancestor_table(pairs)
+
+def collect_lean_candidates(sparql_response_json, region_name, match_mode):
+    # Groups the rows of a lean candidate query per entity: all preferred and non-preferred types, smallest depth
+    candidates_by_uri = {}
+    for binding in sparql_response_json["results"]["bindings"]:
+        tgn_uri = get_sparql_binding_value(binding, "tgn_uri")
+        if not tgn_uri or not binding_passes_label_verification(binding, region_name, match_mode, label_key="matched_label"):
+            continue
+        candidate = candidates_by_uri.setdefault(tgn_uri, new_lean_candidate())
+        preferred_type = get_sparql_binding_value(binding, "pref_type")
+        non_preferred_type = get_sparql_binding_value(binding, "nonpref_type")
+        if preferred_type:
+            candidate["preferred_types"].add(preferred_type)
+        if non_preferred_type:
+            candidate["non_preferred_types"].add(non_preferred_type)
+        depth = get_sparql_binding_value(binding, "depth")
+        if depth.isdigit() and (candidate["depth"] is None or int(depth) < candidate["depth"]):
+            candidate["depth"] = int(depth)
+    return candidates_by_uri
+
+def resolve_tgn_match_from_lean_candidates(candidate_query, query_class, region_name, original_row_idx, result_store, reconciliation_state, match_mode, stage, context_label=""):
+    """
+    Runs a lean candidate query, ranks the candidates locally and stores the best one whose details can be fetched.
+    Returns True if a match was stored, False otherwise. Query failures propagate as for the ranked queries.
+    """
+    settings = reconciliation_state["settings"]
+    sparql_response_json = execute_sparql_query(candidate_query, query_class=query_class, settings=settings)
+    candidates_by_uri = collect_lean_candidates(sparql_response_json, region_name, match_mode)
+    ranked_candidates = rank_lean_candidates_with_ranks(candidates_by_uri, reconciliation_state["place_type_ancestors"], contextual=query_class != QUERY_CLASS_TGN_GLOBAL)
+    for candidate_position, (tgn_uri, _, _) in enumerate(ranked_candidates):
+        tgn_detail_binding = fetch_tgn_details_with_wikidata(tgn_uri, reconciliation_state["tgn_details_cache"], settings, reconciliation_state["deferred_wikidata"])
+        if tgn_detail_binding is None:
+            continue
+        # The depth below the context takes the place of the distance rank; global search has none
+        candidates = ranked_candidate_list([(candidate_uri, type_rank, depth if query_class != QUERY_CLASS_TGN_GLOBAL else None) for candidate_uri, type_rank, depth in ranked_candidates[candidate_position:]], settings)
+        result_store.add_match(original_row_idx, build_tgn_result_item(tgn_uri, tgn_detail_binding, settings), stage, candidates=candidates)
+        print(f"Success: Found TGN match for '{region_name}' via {context_label} (lean candidates, {len(ranked_candidates)} ranked locally). TGN URI: <{tgn_uri}>", file=sys.stderr)
+        return True
+    return False
+
+def resolve_tgn_match_from_prefetched_context(region_name, label_map, original_row_idx, result_store, tgn_details_cache, settings, context_label="", deferred_wikidata=False):
+    """
+    Resolves region_name against the prefetched descendants of one context and stores the match if found.
+    Returns True if a match was stored, False if no descendant has that label, and None if the match could not be
+    completed (the caller then falls back to the per-row contextual query).
+    """
+    candidates = label_map.get(normalize_label_for_local_match(region_name))
+    if not candidates:
+        return False
+
+    ranked_candidates = rank_prefetched_candidates(candidates)
+    best_tgn_uri = ranked_candidates[0][0]
+    try:
+        tgn_detail_binding = fetch_tgn_details_with_wikidata(best_tgn_uri, tgn_details_cache, settings, deferred_wikidata)
+    except SparqlQueryError:
+        print(f"Warning: TGN details fetch for <{best_tgn_uri}> failed.", file=sys.stderr)
+        return None
+    if tgn_detail_binding is None:
+        return None
+
+    result_store.add_match(original_row_idx, build_tgn_result_item(best_tgn_uri, tgn_detail_binding, settings), MATCH_STAGE_TGN_PREFETCHED, candidates=ranked_candidate_list(ranked_candidates, settings))
+    print(f"Success: Found TGN match for '{region_name}' via {context_label} (prefetched context). TGN URI: <{best_tgn_uri}>", file=sys.stderr)
+    return True
+
+def fetch_wikidata_by_tgn_ids(tgn_ids, settings):
+    """
+    Looks up the Wikidata entities of a batch of TGN IDs. Returns a map of TGN ID -> (wikidata_uri, English description)
+    for the IDs that have one. If several entities carry the same TGN ID, the smallest URI is taken.
+    Raises SparqlQueryError or EndpointUnavailableError if the query failed.
+    """
+    query = WIKIDATA_BY_TGN_IDS_QUERY_TEMPLATE.format(tgn_id_values=" ".join(f'"{tgn_id}"' for tgn_id in tgn_ids))
+    wikidata_response_json = execute_generic_sparql_query(query, WIKIDATA_SPARQL_ENDPOINT_URL, query_class=QUERY_CLASS_WIKIDATA_ENRICHMENT, settings=settings)
+    wikidata_by_tgn_id = {}
+    for binding in wikidata_response_json["results"]["bindings"]:
+        tgn_id = get_sparql_binding_value(binding, "tgn_id")
+        wikidata_uri = get_sparql_binding_value(binding, "wd_uri")
+        if not tgn_id or not wikidata_uri:
+            continue
+        candidate = (wikidata_uri, get_sparql_binding_value(binding, "wd_desc"))
+        if tgn_id not in wikidata_by_tgn_id or candidate < wikidata_by_tgn_id[tgn_id]:
+            wikidata_by_tgn_id[tgn_id] = candidate
+    return wikidata_by_tgn_id
+
+def enrich_matches_with_wikidata(result_store, batch_size, settings):
+    """
+    Fills in wikidata_uri and wikidata_description of the TGN matches in result_store (--deferred-wikidata): the distinct
+    TGN IDs of all entities matched in MATCH_STAGES_WITH_TGN_WIKIDATA_LOOKUP are looked up batch_size at a time.
+    Returns a map of entity id -> error info for the entities whose batch failed (their Wikidata columns stay empty).
+    """
+    entity_ids_by_tgn_id = defaultdict(list)
+    for entity_id in result_store.entity_ids_for_stages(MATCH_STAGES_WITH_TGN_WIKIDATA_LOOKUP):
+        entity = result_store.entities[entity_id]
+        tgn_id = extract_tgn_id_from_uri(entity.tgn_uri)
+        if tgn_id and not entity.wikidata_uri:
+            entity_ids_by_tgn_id[tgn_id].append(entity_id)
+    if not entity_ids_by_tgn_id:
+        return {}
+
+    tgn_ids = sorted(entity_ids_by_tgn_id)
+    batch_count = (len(tgn_ids) + batch_size - 1) // batch_size
+    print(f"\nInfo: Looking up the Wikidata entities of {len(tgn_ids)} distinct TGN IDs in {batch_count} batches.", file=sys.stderr)
+    enriched_entity_ids = {}
+    failed_entities = {}
+    for batch_number, batch_start in enumerate(range(0, len(tgn_ids), batch_size), start=1):
+        batch_tgn_ids = tgn_ids[batch_start:batch_start + batch_size]
+        wikidata_by_tgn_id = None
+        for attempt in (1, 2):
+            try:
+                wikidata_by_tgn_id = fetch_wikidata_by_tgn_ids(batch_tgn_ids, settings)
+                break
+            except (SparqlQueryError, EndpointUnavailableError) as e:
+                error_info = {"stage": QUERY_CLASS_WIKIDATA_ENRICHMENT, "endpoint": WIKIDATA_SPARQL_ENDPOINT_URL, "error": str(e)}
+                print(f"Warning: Wikidata lookup of batch {batch_number}/{batch_count} failed (attempt {attempt}/2): {e}", file=sys.stderr)
+                if attempt == 1:
+                    time.sleep(seconds_until_endpoints_available())
+        if wikidata_by_tgn_id is None:
+            for tgn_id in batch_tgn_ids:
+                for entity_id in entity_ids_by_tgn_id[tgn_id]:
+                    failed_entities[entity_id] = error_info
+            continue
+        for tgn_id in batch_tgn_ids:
+            if tgn_id not in wikidata_by_tgn_id:
+                continue
+            wikidata_uri, wikidata_description = wikidata_by_tgn_id[tgn_id]
+            for entity_id in entity_ids_by_tgn_id[tgn_id]:
+                enriched_entity_ids[entity_id] = result_store.derive_entity(entity_id, {"wikidata_uri": wikidata_uri, "wikidata_description": wikidata_description})
+
+    result_store.remap_rows(enriched_entity_ids, MATCH_STAGES_WITH_TGN_WIKIDATA_LOOKUP)
+    print(f"Info: Found Wikidata entities for {len(enriched_entity_ids)} of {sum(len(ids) for ids in entity_ids_by_tgn_id.values())} matched TGN entities.", file=sys.stderr)
+    return failed_entities
+
+def resolve_from_gazetteer(gazetteer, region_name, potential_top_region_contexts, original_row_idx, result_store, settings):
+    """
+    Looks region_name up in the gazetteer, in each context of the row (most specific first), or without a context
+    if the row has none. Stores the reviewed match and returns True if one is found.
+    """
+    context_uris = [context_info["uri"] for context_info in potential_top_region_contexts] or [""]
+    for context_uri in context_uris:
+        gazetteer_values = gazetteer.lookup(region_name, context_uri)
+        if gazetteer_values is None:
+            continue
+        result_item = {col_name: gazetteer_values.get(col_name, "") for col_name in settings.data_columns}
+        if not result_item["tgn_uri"] and gazetteer_values.get("term", "").startswith("http://vocab.getty.edu/tgn/"):
+            # Entries built from reconcile_countries.py output carry the TGN URI in "term"
+            result_item["tgn_uri"] = gazetteer_values["term"]
+        result_store.add_match(original_row_idx, result_item, MATCH_STAGE_GAZETTEER)
+        context_description = f"context <{context_uri}>" if context_uri else "no context"
+        print(f"Success: Found reviewed match for '{region_name}' ({context_description}) in gazetteer '{gazetteer.path}'.", file=sys.stderr)
+        return True
+    return False
+
+def write_output_csv(original_header, original_data_rows, result_store, row_indices=None, carried_forward_rows=None, output_stream=None, settings=DEFAULT_CASCADE_SETTINGS):
+    # row_indices restricts the output to these data rows (in this order); all rows are written by default.
+    # carried_forward_rows maps a row index to the script-managed values (and number_of_results) taken over
+    # verbatim from a previous output file (see carry_forward_previous_results). Writes to stdout by default.
+    # The script-managed columns are the output columns of settings (--languages, --fields).
+    writer = csv.writer(output_stream or sys.stdout)
+    carried_forward_rows = carried_forward_rows or {}
+
+    script_managed_data_columns = settings.output_data_columns
 
     # Construct final_header
     final_header = list(original_header)  # Start with a copy
@@ -717,7 +1398,8 @@ def write_output_csv(original_header, original_data_rows, processed_sparql_resul
     # Create a map for quick index lookup in the final header
     final_header_idx_map = {name: idx for idx, name in enumerate(final_header)}
 
-    for i, original_row_values in enumerate(original_data_rows):
+    for i in (range(len(original_data_rows)) if row_indices is None else row_indices):
+        original_row_values = original_data_rows[i]
         # Initialize output_row with empty strings, matching final_header length
         output_row = [""] * len(final_header)
 
@@ -730,243 +1412,45 @@ def write_output_csv(original_header, original_data_rows, processed_sparql_resul
                     target_idx = final_header_idx_map[original_col_name]
                     output_row[target_idx] = original_row_values[original_col_idx]
 
-        sparql_matches = processed_sparql_results.get(i, [])
-        num_results = len(sparql_matches)
+        if i in carried_forward_rows:
+            for col_name, value in carried_forward_rows[i].items():
+                output_row[final_header_idx_map[col_name]] = value
+            writer.writerow(output_row)
+            continue
+
+        match = result_store.get_match(i) if result_store is not None else None
+        num_results = 1 if match is not None else 0
 
-        if sparql_matches:  # If there are reconciliation results for this row
-            match = sparql_matches[0]  # Assuming LIMIT 1 logic, take the first match
+        if match is not None:  # If there is a reconciliation result for this row
             for col_name in script_managed_data_columns:
                 # The column should be in final_header_idx_map due to header construction
                 target_idx = final_header_idx_map[col_name]
-                output_row[target_idx] = match.get(col_name, "")
+                output_row[target_idx] = getattr(match, col_name)
         
         # Set the number_of_results value, converting to string for CSV
         output_row[final_header_idx_map["number_of_results"]] = str(num_results)
 
         writer.writerow(output_row)
 
-def main():
-    args = parse_arguments()
-
-    loaded_lookup_configs = read_top_region_definitions(args.top_region_configs)
-    if not any(config["map_data"] for config in loaded_lookup_configs):
-        print(f"Warning: All top-region lookup maps are empty after processing the definition files. Reconciliation might not yield results.", file=sys.stderr)
-
-    original_regions_header, original_regions_data_rows, sparql_values_to_query = \
-        read_regions_for_reconciliation(args.regions_input_file, loaded_lookup_configs, args.ri_top_region_name_col, args.ri_region_name_col, args.remove_trailing_state) # Pass the flag
-    
-    # new_column_names_for_fallback and empty_reconciliation_fields_for_fallback are removed as this logic
-    # is now handled by the improved write_output_csv function.
-
-    if not sparql_values_to_query:
-        print("No valid region/top-region combinations found to query. Outputting original data with potentially new/updated reconciliation columns.", file=sys.stderr)
-        # Call the modified write_output_csv, passing an empty dict for processed_sparql_results.
-        # This will ensure the header is correctly formed and original data is written with appropriate empty/zero values for reconciliation fields.
-        write_output_csv(original_regions_header, original_regions_data_rows, {})
-        sys.exit(0)
-
-    processed_sparql_data = defaultdict(list)
-    total_queries_to_make = len(sparql_values_to_query)
-    
-    print(f"Starting TGN SPARQL queries for {total_queries_to_make} regions...", file=sys.stderr)
-
-    for i, (region_name, top_region_uri, original_row_idx) in enumerate(sparql_values_to_query):
-        # Escape backslashes and double quotes for SPARQL string literal used in ql:contains-word
-        escaped_region_name = region_name.replace('\\', '\\\\').replace('"', '\\"')
-
-        query = SINGLE_REGION_TGN_SPARQL_QUERY_TEMPLATE.format(
-            search_term_direct=escaped_region_name,
-            top_region_uri=top_region_uri
-        )
-        
-        print(f"Executing TGN query {i+1}/{total_queries_to_make} for region: '{region_name}', top-region TGN URI: <{top_region_uri}>", file=sys.stderr)
-
-        sparql_response_json = execute_sparql_query(query)
-        
-        found_via_primary_tgn_query = False
-        if sparql_response_json and "results" in sparql_response_json and "bindings" in sparql_response_json["results"]:
-            bindings = sparql_response_json["results"]["bindings"]
-            if len(bindings) == 1: 
-                binding = bindings[0]
-                try:
-                    result_item = {
-                        "label": get_sparql_binding_value(binding, "label"),
-                        "label_en": get_sparql_binding_value(binding, "label_en"),
-                        "label_it": get_sparql_binding_value(binding, "label_it"),
-                        "label_de": get_sparql_binding_value(binding, "label_de"),
-                        "label_fr": get_sparql_binding_value(binding, "label_fr"),
-                        "type": get_sparql_binding_value(binding, "type"),
-                        "scope_note": get_sparql_binding_value(binding, "scope_note"),
-                        "wikidata_description": get_sparql_binding_value(binding, "wikidata_description"),
-                        "tgn_uri": get_sparql_binding_value(binding, "tgn_uri"),
-                        "wikidata_uri": get_sparql_binding_value(binding, "wikidata_uri"),
-                    }
-                    if not result_item["tgn_uri"]:
-                        print(f"Warning: Primary TGN query for '{region_name}' succeeded but ?tgn_uri is missing in result. Binding: {binding}", file=sys.stderr)
-                    else:
-                        processed_sparql_data[original_row_idx].append(result_item)
-                        found_via_primary_tgn_query = True
-                except KeyError as e: 
-                    print(f"Warning: Error processing binding for '{region_name}' from primary TGN query. Binding: {binding}. Error: {e}", file=sys.stderr)
-            
-            elif len(bindings) == 0:
-                # This is where we will trigger fallback, so message will be handled below if not found_via_primary_tgn_query
-                pass # No primary TGN match found, will proceed to fallback.
-            
-            else: # More than 1 result from primary TGN query
-                print(f"Warning: Primary TGN Query for '{region_name}' returned {len(bindings)} results, expected 0 or 1 due to LIMIT 1. Using first result if available, but this is unexpected. Bindings: {bindings}", file=sys.stderr)
-                if get_sparql_binding_value(bindings[0], "tgn_uri"): # Check if tgn_uri has a value
-                     binding = bindings[0]
-                     result_item = {
-                        "label": get_sparql_binding_value(binding, "label"),
-                        "label_en": get_sparql_binding_value(binding, "label_en"),
-                        "label_it": get_sparql_binding_value(binding, "label_it"),
-                        "label_de": get_sparql_binding_value(binding, "label_de"),
-                        "label_fr": get_sparql_binding_value(binding, "label_fr"),
-                        "type": get_sparql_binding_value(binding, "type"),
-                        "scope_note": get_sparql_binding_value(binding, "scope_note"),
-                        "wikidata_description": get_sparql_binding_value(binding, "wikidata_description"),
-                        "tgn_uri": get_sparql_binding_value(binding, "tgn_uri"),
-                        "wikidata_uri": get_sparql_binding_value(binding, "wikidata_uri"),
-                    }
-                     processed_sparql_data[original_row_idx].append(result_item)
-                     found_via_primary_tgn_query = True
-        # else: # Primary TGN Query failed or returned malformed/empty data
-            # Fallback will be attempted if found_via_primary_tgn_query is still False
-
-        if not found_via_primary_tgn_query:
-            print(f"Info: No definitive TGN match for '{region_name}' (top-region: <{top_region_uri}>) via primary query. Attempting Wikidata fallback.", file=sys.stderr)
-            parent_tgn_id = extract_tgn_id_from_uri(top_region_uri)
-
-            if parent_tgn_id:
-                # Use the same escaped_region_name for Wikidata query's search_label
-                # The WIKIDATA_FALLBACK_QUERY_TEMPLATE uses "^{search_label}$" for regex.
-                wikidata_query = WIKIDATA_FALLBACK_QUERY_TEMPLATE.format(
-                    search_label=escaped_region_name, # Use the already escaped name
-                    parent_tgn_id=parent_tgn_id
-                )
-                
-                print(f"Executing Wikidata fallback query for '{region_name}', parent TGN ID: {parent_tgn_id}", file=sys.stderr)
-                wikidata_response_json = execute_generic_sparql_query(wikidata_query, WIKIDATA_SPARQL_ENDPOINT_URL)
-
-                if wikidata_response_json and "results" in wikidata_response_json and "bindings" in wikidata_response_json["results"]:
-                    wd_bindings = wikidata_response_json["results"]["bindings"]
-                    if len(wd_bindings) == 1:
-                        wd_binding = wd_bindings[0]
-                        fallback_tgn_id_str = wd_binding.get("tgn_id", {}).get("value", "") # This is the TGN ID string
-                        fallback_wikidata_uri = wd_binding.get("wikidata_uri", {}).get("value", "")
-                        fallback_wikidata_desc = wd_binding.get("wd_desc", {}).get("value", "")
-
-                        if fallback_tgn_id_str and fallback_wikidata_uri:
-                            tgn_uri_from_wikidata = f"http://vocab.getty.edu/tgn/{fallback_tgn_id_str}"
-                            
-                            print(f"Wikidata fallback found TGN ID: {fallback_tgn_id_str}, Wikidata URI: <{fallback_wikidata_uri}>. Fetching details from TGN for <{tgn_uri_from_wikidata}>.", file=sys.stderr)
-
-                            tgn_details_query = TGN_FETCH_BY_URI_QUERY_TEMPLATE.format(tgn_uri_direct=tgn_uri_from_wikidata)
-                            # Execute this query against the TGN endpoint
-                            tgn_details_response_json = execute_sparql_query(tgn_details_query) 
-
-                            if tgn_details_response_json and "results" in tgn_details_response_json and "bindings" in tgn_details_response_json["results"]:
-                                tgn_details_bindings = tgn_details_response_json["results"]["bindings"]
-                                if len(tgn_details_bindings) == 1:
-                                    tgn_detail_binding = tgn_details_bindings[0]
-                                    fallback_result_item = {
-                                        "label": get_sparql_binding_value(tgn_detail_binding, "label"),
-                                        "label_en": get_sparql_binding_value(tgn_detail_binding, "label_en"),
-                                        "label_it": get_sparql_binding_value(tgn_detail_binding, "label_it"),
-                                        "label_de": get_sparql_binding_value(tgn_detail_binding, "label_de"),
-                                        "label_fr": get_sparql_binding_value(tgn_detail_binding, "label_fr"),
-                                        "type": get_sparql_binding_value(tgn_detail_binding, "type"),
-                                        "scope_note": get_sparql_binding_value(tgn_detail_binding, "scope_note"),
-                                        "wikidata_description": fallback_wikidata_desc, # From Wikidata query
-                                        "tgn_uri": tgn_uri_from_wikidata, # The one we just looked up
-                                        "wikidata_uri": fallback_wikidata_uri, # From Wikidata query
-                                    }
-                                    processed_sparql_data[original_row_idx].append(fallback_result_item)
-                                    print(f"Successfully processed TGN details via Wikidata fallback for '{region_name}'.", file=sys.stderr)
-                                else:
-                                    print(f"Warning: TGN details fetch (via Wikidata fallback) for TGN URI <{tgn_uri_from_wikidata}> returned {len(tgn_details_bindings)} results (expected 1) or no bindings. No data added for fallback.", file=sys.stderr)
-                            else:
-                                print(f"Warning: Failed to fetch TGN details (via Wikidata fallback) for TGN URI <{tgn_uri_from_wikidata}> (query failed or malformed response). No data added for fallback.", file=sys.stderr)
-                        else:
-                            print(f"Info: Wikidata fallback query for '{region_name}' did not return a TGN ID or Wikidata URI. wd_binding: {wd_binding}", file=sys.stderr)
-                    elif len(wd_bindings) == 0:
-                        print(f"Info: Wikidata fallback query for '{region_name}' returned no results.", file=sys.stderr)
-                    else: # More than 1 result from Wikidata
-                        print(f"Warning: Wikidata fallback query for '{region_name}' returned {len(wd_bindings)} results. Expected 0 or 1. No fallback action taken.", file=sys.stderr)
-                else:
-                    print(f"Warning: Wikidata fallback query failed or returned malformed/empty data for '{region_name}'.", file=sys.stderr)
-            else:
-                print(f"Warning: Could not extract parent TGN ID from <{top_region_uri}> for Wikidata fallback for region '{region_name}'. Fallback skipped.", file=sys.stderr)
-            
-            # If still no result after first fallback, try second fallback (Wikidata only, no TGN ID needed for match)
-            if not processed_sparql_data[original_row_idx] and parent_tgn_id: # Check parent_tgn_id again, though it should be set if first fallback was attempted
-                print(f"Info: First Wikidata fallback for '{region_name}' did not yield a TGN record. Attempting second Wikidata fallback (Wikidata entity only).", file=sys.stderr)
-                
-                second_wikidata_query = WIKIDATA_SECOND_FALLBACK_QUERY_TEMPLATE.format(
-                    search_label=escaped_region_name,
-                    parent_tgn_id=parent_tgn_id
-                )
-                print(f"Executing second Wikidata fallback query for '{region_name}', parent TGN ID: {parent_tgn_id}", file=sys.stderr)
-                second_wikidata_response_json = execute_generic_sparql_query(second_wikidata_query, WIKIDATA_SPARQL_ENDPOINT_URL)
-
-                if second_wikidata_response_json and "results" in second_wikidata_response_json and "bindings" in second_wikidata_response_json["results"]:
-                    swd_bindings = second_wikidata_response_json["results"]["bindings"]
-                    if len(swd_bindings) == 1:
-                        swd_binding = swd_bindings[0]
-                        second_fallback_wikidata_uri = swd_binding.get("wikidata_uri", {}).get("value", "")
-                        second_fallback_label = swd_binding.get("label", {}).get("value", "") # This is skos:prefLabel
-                        second_fallback_wikidata_desc = swd_binding.get("wd_desc", {}).get("value", "")
-
-                        if second_fallback_wikidata_uri and second_fallback_label:
-                            second_fallback_result_item = {
-                                "label": second_fallback_label, # Use Wikidata label
-                                "label_en": "", # No TGN data
-                                "label_it": "",
-                                "label_de": "",
-                                "label_fr": "",
-                                "type": "",
-                                "scope_note": "",
-                                "wikidata_description": second_fallback_wikidata_desc,
-                                "tgn_uri": "", # No TGN URI from this fallback
-                                "wikidata_uri": second_fallback_wikidata_uri,
-                            }
-                            processed_sparql_data[original_row_idx].append(second_fallback_result_item)
-                            print(f"Successfully processed Wikidata-only fallback for '{region_name}'. Wikidata URI: <{second_fallback_wikidata_uri}>", file=sys.stderr)
-                        else:
-                            print(f"Info: Second Wikidata fallback query for '{region_name}' did not return a complete wikidata_uri and label. swd_binding: {swd_binding}", file=sys.stderr)
-                    elif len(swd_bindings) == 0:
-                        print(f"Info: Second Wikidata fallback query for '{region_name}' returned no results.", file=sys.stderr)
-                    else: # More than 1 result
-                        print(f"Warning: Second Wikidata fallback query for '{region_name}' returned {len(swd_bindings)} results. Expected 0 or 1. No action taken.", file=sys.stderr)
-                else:
-                    print(f"Warning: Second Wikidata fallback query failed or returned malformed/empty data for '{region_name}'.", file=sys.stderr)
-            elif not processed_sparql_data[original_row_idx] and not parent_tgn_id:
-                 print(f"Info: Cannot attempt second Wikidata fallback for '{region_name}' as parent_tgn_id was not extracted.", file=sys.stderr)
-
-
-        # else: Successfully found via primary TGN query, no fallback needed.
-
-    print(f"Finished TGN and potential Wikidata fallback SPARQL queries for {total_queries_to_make} regions.", file=sys.stderr)
-def process_and_store_tgn_match(sparql_response_json, region_name, original_row_idx, processed_sparql_data, context_label=""):
+def process_and_store_tgn_match(sparql_response_json, region_name, original_row_idx, result_store, context_label="", match_mode=DEFAULT_MATCH_MODE, stage=MATCH_STAGE_TGN_CONTEXTUAL, settings=DEFAULT_CASCADE_SETTINGS):
     """
     Processes SPARQL response from a TGN query (contextual or global) and stores the match if found.
     Returns True if a match was successfully processed and stored, False otherwise.
     """
     if sparql_response_json and "results" in sparql_response_json and "bindings" in sparql_response_json["results"]:
         bindings = sparql_response_json["results"]["bindings"]
-        if len(bindings) >= 1: # Expect 0 or 1 due to LIMIT 1, but handle >=1 defensively
-            if len(bindings) > 1:
-                print(f"Warning: TGN Query ({context_label}) for '{region_name}' returned {len(bindings)} results, expected 0 or 1. Using first result.", file=sys.stderr)
+        if len(bindings) >= 1: # Expect 0 or 1 due to LIMIT 1 (up to --top-k with it), but handle more defensively
+            if len(bindings) > (settings.top_k or 1):
+                print(f"Warning: TGN Query ({context_label}) for '{region_name}' returned {len(bindings)} results, expected at most {settings.top_k or 1}. Using first result.", file=sys.stderr)
             
             binding = bindings[0]
+            if not binding_passes_label_verification(binding, region_name, match_mode, label_key="matched_label"):
+                print(f"Info: TGN query ({context_label}) for '{region_name}' returned a candidate whose label '{get_sparql_binding_value(binding, 'matched_label')}' is not an exact match. Discarding.", file=sys.stderr)
+                return False
             try:
                 result_item = {
                     "label": get_sparql_binding_value(binding, "label"),
-                    "label_en": get_sparql_binding_value(binding, "label_en"),
-                    "label_it": get_sparql_binding_value(binding, "label_it"),
-                    "label_de": get_sparql_binding_value(binding, "label_de"),
-                    "label_fr": get_sparql_binding_value(binding, "label_fr"),
+                    **settings.label_values(binding),
                     "type": get_sparql_binding_value(binding, "type"),
                     "scope_note": get_sparql_binding_value(binding, "scope_note"),
                     "wikidata_description": get_sparql_binding_value(binding, "wikidata_description"),
@@ -977,7 +1461,7 @@ def process_and_store_tgn_match(sparql_response_json, region_name, original_row_
                     print(f"Warning: TGN query ({context_label}) for '{region_name}' succeeded but ?tgn_uri is missing. Binding: {binding}", file=sys.stderr)
                     return False
                 else:
-                    processed_sparql_data[original_row_idx].append(result_item)
+                    result_store.add_match(original_row_idx, result_item, stage, candidates=tgn_binding_candidates(bindings, region_name, match_mode, settings))
                     print(f"Success: Found TGN match for '{region_name}' via {context_label} query. TGN URI: <{result_item['tgn_uri']}>", file=sys.stderr)
                     return True
             except KeyError as e: 
@@ -987,33 +1471,52 @@ def process_and_store_tgn_match(sparql_response_json, region_name, original_row_
     # else: query failed or malformed response
     return False
 
-def attempt_wikidata_fallbacks(escaped_region_name, parent_tgn_id_for_context, original_row_idx, processed_sparql_data, context_label=""):
+def attempt_wikidata_fallbacks(region_name, parent_tgn_id_for_context, original_row_idx, result_store, context_label="", match_mode=DEFAULT_MATCH_MODE, wikidata_label_map=None, settings=DEFAULT_CASCADE_SETTINGS):
     """
     Attempts Wikidata fallbacks (first with TGN ID, then Wikidata entity only).
     Uses contextual or global templates based on whether parent_tgn_id_for_context is provided.
+    If wikidata_label_map (prefetched descendants of the context, see fetch_wikidata_descendants) is given,
+    the contextual fallbacks are answered from it instead of querying Wikidata.
     Returns True if any fallback succeeded, False otherwise.
     """
+    if attempt_first_wikidata_fallback(region_name, parent_tgn_id_for_context, original_row_idx, result_store, context_label, match_mode, wikidata_label_map, settings):
+        return True
+    return attempt_second_wikidata_fallback(region_name, parent_tgn_id_for_context, original_row_idx, result_store, context_label, match_mode, wikidata_label_map, settings)
+
+def attempt_first_wikidata_fallback(region_name, parent_tgn_id_for_context, original_row_idx, result_store, context_label="", match_mode=DEFAULT_MATCH_MODE, wikidata_label_map=None, settings=DEFAULT_CASCADE_SETTINGS):
+    """
+    First Wikidata fallback: a Wikidata entity with a TGN ID below the context (or anywhere, for the global fallback),
+    whose TGN details are then fetched. Returns True if a match was stored.
+    """
     # Determine if this is a contextual or global fallback
     is_global_fallback = parent_tgn_id_for_context is None
 
     # --- First Wikidata Fallback (expects TGN ID on Wikidata entity) ---
     if is_global_fallback:
         wikidata_query_template = GLOBAL_WIKIDATA_FALLBACK_QUERY_TEMPLATE
-        wd_query_params = {"search_label": escaped_region_name}
-        print(f"Executing Global Wikidata fallback (1st type) for '{escaped_region_name}'", file=sys.stderr)
+        wd_query_params = {}
+        print(f"Executing Global Wikidata fallback (1st type) for '{region_name}'", file=sys.stderr)
     elif parent_tgn_id_for_context:
         wikidata_query_template = WIKIDATA_FALLBACK_QUERY_TEMPLATE
-        wd_query_params = {"search_label": escaped_region_name, "parent_tgn_id": parent_tgn_id_for_context}
-        print(f"Executing Wikidata fallback (1st type, {context_label}) for '{escaped_region_name}', parent TGN ID: {parent_tgn_id_for_context}", file=sys.stderr)
+        wd_query_params = {"parent_tgn_id": parent_tgn_id_for_context}
+        print(f"Executing Wikidata fallback (1st type, {context_label}) for '{region_name}', parent TGN ID: {parent_tgn_id_for_context}", file=sys.stderr)
     else: # Contextual fallback but no parent_tgn_id (e.g. top_region_uri was invalid)
-        print(f"Info: Skipping Wikidata fallback (1st type, {context_label}) for '{escaped_region_name}' as parent_tgn_id is missing.", file=sys.stderr)
+        print(f"Info: Skipping Wikidata fallback (1st type, {context_label}) for '{region_name}' as parent_tgn_id is missing.", file=sys.stderr)
         return False # Cannot proceed with this type of fallback
 
-    wikidata_query = wikidata_query_template.format(**wd_query_params)
-    wikidata_response_json = execute_generic_sparql_query(wikidata_query, WIKIDATA_SPARQL_ENDPOINT_URL)
+    label_match_clause = build_label_match_clause("label", region_name, match_mode)
+    if wikidata_label_map is not None and not is_global_fallback:
+        wikidata_response_json = select_prefetched_wikidata_response(wikidata_label_map, region_name, WIKIDATA_FALLBACK_MAX_RANK, require_tgn_id=True)
+    else:
+        wikidata_query = wikidata_query_template.format(label_match_clause=label_match_clause, **wd_query_params)
+        wikidata_query_class = QUERY_CLASS_WIKIDATA_GLOBAL if is_global_fallback else QUERY_CLASS_WIKIDATA_CONTEXTUAL
+        wikidata_response_json = execute_generic_sparql_query(wikidata_query, WIKIDATA_SPARQL_ENDPOINT_URL, query_class=wikidata_query_class, settings=settings)
 
     if wikidata_response_json and "results" in wikidata_response_json and "bindings" in wikidata_response_json["results"]:
         wd_bindings = wikidata_response_json["results"]["bindings"]
+        if len(wd_bindings) == 1 and not binding_passes_label_verification(wd_bindings[0], region_name, match_mode, label_key="label"):
+            print(f"Info: Wikidata fallback (1st type, {context_label}) for '{region_name}' returned a candidate whose label is not an exact match. Discarding. wd_binding: {wd_bindings[0]}", file=sys.stderr)
+            wd_bindings = []
         if len(wd_bindings) == 1:
             wd_binding = wd_bindings[0]
             fallback_tgn_id_str = get_sparql_binding_value(wd_binding, "tgn_id")
@@ -1024,8 +1527,13 @@ def attempt_wikidata_fallbacks(escaped_region_name, parent_tgn_id_for_context, o
                 tgn_uri_from_wikidata = f"http://vocab.getty.edu/tgn/{fallback_tgn_id_str}"
                 print(f"Wikidata fallback (1st type, {context_label}) found TGN ID: {fallback_tgn_id_str}, Wikidata URI: <{fallback_wikidata_uri}>. Fetching TGN details for <{tgn_uri_from_wikidata}>.", file=sys.stderr)
 
-                tgn_details_query = TGN_FETCH_BY_URI_QUERY_TEMPLATE.format(tgn_uri_direct=tgn_uri_from_wikidata)
-                tgn_details_response_json = execute_sparql_query(tgn_details_query) # TGN specific auth
+                tgn_details_query_template = settings.tgn_query_template(QUERY_KIND_DETAILS, with_wikidata=False)
+                if tgn_details_query_template is None:
+                    # None of the fetched columns is in --fields
+                    tgn_details_response_json = {"results": {"bindings": [{}]}}
+                else:
+                    tgn_details_query = tgn_details_query_template.format(tgn_uri_direct=tgn_uri_from_wikidata)
+                    tgn_details_response_json = execute_sparql_query(tgn_details_query, query_class=QUERY_CLASS_TGN_FETCH_BY_URI, settings=settings) # TGN specific auth
 
                 if tgn_details_response_json and "results" in tgn_details_response_json and "bindings" in tgn_details_response_json["results"]:
                     tgn_details_bindings = tgn_details_response_json["results"]["bindings"]
@@ -1033,48 +1541,59 @@ def attempt_wikidata_fallbacks(escaped_region_name, parent_tgn_id_for_context, o
                         tgn_detail_binding = tgn_details_bindings[0]
                         fallback_result_item = {
                             "label": get_sparql_binding_value(tgn_detail_binding, "label"),
-                            "label_en": get_sparql_binding_value(tgn_detail_binding, "label_en"),
-                            "label_it": get_sparql_binding_value(tgn_detail_binding, "label_it"),
-                            "label_de": get_sparql_binding_value(tgn_detail_binding, "label_de"),
-                            "label_fr": get_sparql_binding_value(tgn_detail_binding, "label_fr"),
+                            **settings.label_values(tgn_detail_binding),
                             "type": get_sparql_binding_value(tgn_detail_binding, "type"),
                             "scope_note": get_sparql_binding_value(tgn_detail_binding, "scope_note"),
                             "wikidata_description": fallback_wikidata_desc,
                             "tgn_uri": tgn_uri_from_wikidata,
                             "wikidata_uri": fallback_wikidata_uri,
                         }
-                        processed_sparql_data[original_row_idx].append(fallback_result_item)
-                        print(f"Success: Processed TGN details via Wikidata fallback (1st type, {context_label}) for '{escaped_region_name}'.", file=sys.stderr)
+                        result_store.add_match(original_row_idx, fallback_result_item, MATCH_STAGE_WIKIDATA_GLOBAL_TGN_ID if is_global_fallback else MATCH_STAGE_WIKIDATA_TGN_ID)
+                        print(f"Success: Processed TGN details via Wikidata fallback (1st type, {context_label}) for '{region_name}'.", file=sys.stderr)
                         return True
                     else:
                         print(f"Warning: TGN details fetch (via Wikidata fallback 1st type, {context_label}) for TGN URI <{tgn_uri_from_wikidata}> returned {len(tgn_details_bindings)} results. No data added.", file=sys.stderr)
                 else:
                     print(f"Warning: Failed to fetch TGN details (via Wikidata fallback 1st type, {context_label}) for TGN URI <{tgn_uri_from_wikidata}>. No data added.", file=sys.stderr)
             else:
-                print(f"Info: Wikidata fallback (1st type, {context_label}) for '{escaped_region_name}' did not return TGN ID or Wikidata URI. wd_binding: {wd_binding}", file=sys.stderr)
+                print(f"Info: Wikidata fallback (1st type, {context_label}) for '{region_name}' did not return TGN ID or Wikidata URI. wd_binding: {wd_binding}", file=sys.stderr)
         elif len(wd_bindings) == 0:
-            print(f"Info: Wikidata fallback (1st type, {context_label}) for '{escaped_region_name}' returned no results.", file=sys.stderr)
+            print(f"Info: Wikidata fallback (1st type, {context_label}) for '{region_name}' returned no results.", file=sys.stderr)
         else:
-            print(f"Warning: Wikidata fallback (1st type, {context_label}) for '{escaped_region_name}' returned {len(wd_bindings)} results. No action.", file=sys.stderr)
+            print(f"Warning: Wikidata fallback (1st type, {context_label}) for '{region_name}' returned {len(wd_bindings)} results. No action.", file=sys.stderr)
     else:
-        print(f"Warning: Wikidata fallback (1st type, {context_label}) query failed or malformed for '{escaped_region_name}'.", file=sys.stderr)
+        print(f"Warning: Wikidata fallback (1st type, {context_label}) query failed or malformed for '{region_name}'.", file=sys.stderr)
+    return False
+
+def attempt_second_wikidata_fallback(region_name, parent_tgn_id_for_context, original_row_idx, result_store, context_label="", match_mode=DEFAULT_MATCH_MODE, wikidata_label_map=None, settings=DEFAULT_CASCADE_SETTINGS):
+    """
+    Second Wikidata fallback: a Wikidata entity below the context, without a TGN ID. Returns True if a match was stored.
+    """
+    is_global_fallback = parent_tgn_id_for_context is None
+    label_match_clause = build_label_match_clause("label", region_name, match_mode)
 
     # --- Second Wikidata Fallback (Wikidata entity only, no TGN ID needed for match) ---
     # Global version of this fallback has been removed as per user request.
     if not is_global_fallback:
         if parent_tgn_id_for_context: # This check is important, as the contextual query needs parent_tgn_id
             second_wikidata_query_template = WIKIDATA_SECOND_FALLBACK_QUERY_TEMPLATE
-            second_wd_query_params = {"search_label": escaped_region_name, "parent_tgn_id": parent_tgn_id_for_context}
-            print(f"Executing Wikidata fallback (2nd type, {context_label}) for '{escaped_region_name}', parent TGN ID: {parent_tgn_id_for_context}", file=sys.stderr)
+            second_wd_query_params = {"parent_tgn_id": parent_tgn_id_for_context}
+            print(f"Executing Wikidata fallback (2nd type, {context_label}) for '{region_name}', parent TGN ID: {parent_tgn_id_for_context}", file=sys.stderr)
         else: # Contextual fallback but no parent_tgn_id
-            print(f"Info: Skipping Wikidata fallback (2nd type, {context_label}) for '{escaped_region_name}' as parent_tgn_id is missing.", file=sys.stderr)
+            print(f"Info: Skipping Wikidata fallback (2nd type, {context_label}) for '{region_name}' as parent_tgn_id is missing.", file=sys.stderr)
             return False # Cannot proceed with this type of fallback
 
-        second_wikidata_query = second_wikidata_query_template.format(**second_wd_query_params)
-        second_wikidata_response_json = execute_generic_sparql_query(second_wikidata_query, WIKIDATA_SPARQL_ENDPOINT_URL)
+        if wikidata_label_map is not None:
+            second_wikidata_response_json = select_prefetched_wikidata_response(wikidata_label_map, region_name, WIKIDATA_SECOND_FALLBACK_MAX_RANK, require_tgn_id=False)
+        else:
+            second_wikidata_query = second_wikidata_query_template.format(label_match_clause=label_match_clause, **second_wd_query_params)
+            second_wikidata_response_json = execute_generic_sparql_query(second_wikidata_query, WIKIDATA_SPARQL_ENDPOINT_URL, query_class=QUERY_CLASS_WIKIDATA_CONTEXTUAL, settings=settings)
 
         if second_wikidata_response_json and "results" in second_wikidata_response_json and "bindings" in second_wikidata_response_json["results"]:
             swd_bindings = second_wikidata_response_json["results"]["bindings"]
+            if len(swd_bindings) == 1 and not binding_passes_label_verification(swd_bindings[0], region_name, match_mode, label_key="label"):
+                print(f"Info: Wikidata fallback (2nd type, {context_label}) for '{region_name}' returned a candidate whose label is not an exact match. Discarding. swd_binding: {swd_bindings[0]}", file=sys.stderr)
+                swd_bindings = []
             if len(swd_bindings) == 1:
                 swd_binding = swd_bindings[0]
                 second_fallback_wikidata_uri = get_sparql_binding_value(swd_binding, "wikidata_uri")
@@ -1082,108 +1601,968 @@ def attempt_wikidata_fallbacks(escaped_region_name, parent_tgn_id_for_context, o
                 second_fallback_wikidata_desc = get_sparql_binding_value(swd_binding, "wd_desc")
 
                 if second_fallback_wikidata_uri and second_fallback_label:
+                    # No TGN entity, so no label_<code> columns; the result store leaves missing columns empty
                     second_fallback_result_item = {
-                        "label": second_fallback_label, "label_en": "", "label_it": "", "label_de": "", "label_fr": "",
+                        "label": second_fallback_label,
                         "type": "", "scope_note": "", "wikidata_description": second_fallback_wikidata_desc,
                         "tgn_uri": "", "wikidata_uri": second_fallback_wikidata_uri,
                     }
-                    processed_sparql_data[original_row_idx].append(second_fallback_result_item)
-                    print(f"Success: Processed Wikidata-only fallback (2nd type, {context_label}) for '{escaped_region_name}'. Wikidata URI: <{second_fallback_wikidata_uri}>", file=sys.stderr)
+                    result_store.add_match(original_row_idx, second_fallback_result_item, MATCH_STAGE_WIKIDATA_ONLY)
+                    print(f"Success: Processed Wikidata-only fallback (2nd type, {context_label}) for '{region_name}'. Wikidata URI: <{second_fallback_wikidata_uri}>", file=sys.stderr)
                     return True
                 else:
-                    print(f"Info: Wikidata fallback (2nd type, {context_label}) for '{escaped_region_name}' did not return wikidata_uri and label. swd_binding: {swd_binding}", file=sys.stderr)
+                    print(f"Info: Wikidata fallback (2nd type, {context_label}) for '{region_name}' did not return wikidata_uri and label. swd_binding: {swd_binding}", file=sys.stderr)
             elif len(swd_bindings) == 0:
-                print(f"Info: Wikidata fallback (2nd type, {context_label}) for '{escaped_region_name}' returned no results.", file=sys.stderr)
+                print(f"Info: Wikidata fallback (2nd type, {context_label}) for '{region_name}' returned no results.", file=sys.stderr)
             else:
-                print(f"Warning: Wikidata fallback (2nd type, {context_label}) for '{escaped_region_name}' returned {len(swd_bindings)} results. No action.", file=sys.stderr)
+                print(f"Warning: Wikidata fallback (2nd type, {context_label}) for '{region_name}' returned {len(swd_bindings)} results. No action.", file=sys.stderr)
         else:
-            print(f"Warning: Wikidata fallback (2nd type, {context_label}) query failed or malformed for '{escaped_region_name}'.", file=sys.stderr)
+            print(f"Warning: Wikidata fallback (2nd type, {context_label}) query failed or malformed for '{region_name}'.", file=sys.stderr)
     else: # is_global_fallback is true
-        print(f"Info: Global Wikidata fallback (2nd type) for '{escaped_region_name}' was removed by user request. Skipping.", file=sys.stderr)
+        print(f"Info: Global Wikidata fallback (2nd type) for '{region_name}' was removed by user request. Skipping.", file=sys.stderr)
         
     return False
 
 
+def write_dead_letter_file(dead_letter_path, dead_letters):
+    # One JSON object per line, in input order
+    try:
+        with open(dead_letter_path, 'w', encoding='utf-8') as dead_letter_file:
+            for dead_letter in dead_letters:
+                dead_letter_file.write(json.dumps(dead_letter, ensure_ascii=False) + "\n")
+    except OSError as e:
+        print(f"Error: Could not write dead-letter file '{dead_letter_path}': {e}", file=sys.stderr)
+
+def row_candidate_list(result_store, original_row_idx):
+    # The --top-k candidates of a row, best first, with their rank and the match stage. Rows matched by a stage without
+    # ranked candidates (gazetteer, Wikidata fallbacks) list their match as the only candidate; unmatched rows have none.
+    entity = result_store.get_match(original_row_idx)
+    stage = result_store.get_stage(original_row_idx)
+    candidates = [dict(candidate) for candidate in result_store.get_candidates(original_row_idx)]
+    if entity is not None and not candidates:
+        candidates = [new_candidate(tgn_uri=entity.tgn_uri, wikidata_uri=entity.wikidata_uri)]
+    row_candidates = []
+    for candidate_rank, candidate in enumerate(candidates, start=1):
+        if entity is not None and candidate["tgn_uri"] == entity.tgn_uri:
+            # The match itself: its values were fetched (and its Wikidata entity looked up) after ranking
+            for field_name in ("wikidata_uri", "label", "type"):
+                candidate[field_name] = candidate[field_name] or getattr(entity, field_name)
+        row_candidates.append({"rank": candidate_rank, **candidate, "stage": stage})
+    return row_candidates
+
+def write_candidates_file(candidates_path, items, result_store):
+    """Writes the --top-k candidates of the reconciled items (row_candidate_list), one JSON object per row in input order."""
+    try:
+        with open(candidates_path, 'w', encoding='utf-8') as candidates_file:
+            for region_name, _, original_row_idx in sorted(items, key=lambda item: item[2]):
+                row_candidates = row_candidate_list(result_store, original_row_idx)
+                candidates_file.write(json.dumps({"row_index": original_row_idx, "file_row": original_row_idx + 2, "region_name": region_name, "stage": result_store.get_stage(original_row_idx), "candidates": row_candidates}, ensure_ascii=False) + "\n")
+    except OSError as e:
+        print(f"Error: Could not write candidates file '{candidates_path}': {e}", file=sys.stderr)
+
+def read_row_weights(original_header, original_data_rows, priority_col_idx):
+    # Weight of each data row from the --priority-col column; missing, non-numeric and negative values weigh 0
+    row_weights = []
+    invalid_row_count = 0
+    for row in original_data_rows:
+        try:
+            row_weights.append(max(float(row[priority_col_idx]), 0.0))
+        except (IndexError, ValueError):
+            row_weights.append(0.0)
+            invalid_row_count += 1
+    column_name = original_header[priority_col_idx] if priority_col_idx < len(original_header) else f"column {priority_col_idx + 1}"
+    if invalid_row_count:
+        print(f"Warning: {invalid_row_count} rows have no numeric weight in '{column_name}' (--priority-col). They are reconciled last.", file=sys.stderr)
+    return row_weights
+
+def new_progress_report(items, row_weights, interval_seconds, write_partial_output=None):
+    """
+    Returns the progress state of a run over items: the weight of each row (row_weights, or 1 per row without
+    --priority-col) and the callable that rewrites the partial output file (if any). See report_progress.
+    """
+    weights_by_row = {item[2]: (row_weights[item[2]] if row_weights is not None else 1.0) for item in items}
+    now = time.monotonic()
+    return {
+        "weights_by_row": weights_by_row,
+        "total_weight": sum(weights_by_row.values()),
+        "interval_seconds": interval_seconds,
+        "started_at": now,
+        "last_report_at": now,
+        "write_partial_output": write_partial_output,
+        # Held while a report is written; rows finishing meanwhile in other workers skip their report
+        "lock": threading.Lock(),
+    }
+
+def report_progress(reconciliation_state, final=False):
+    """
+    Prints the rows done and the weighted coverage (weight of the matched rows / weight of all queried rows) and
+    rewrites the partial output, at most every interval_seconds, or now if final.
+    """
+    progress = reconciliation_state["progress"]
+    if progress is None:
+        return
+    now = time.monotonic()
+    if not final and now - progress["last_report_at"] < progress["interval_seconds"]:
+        return
+    if not progress["lock"].acquire(blocking=final):
+        return
+    try:
+        progress["last_report_at"] = now
+        weights_by_row = progress["weights_by_row"]
+        row_outcomes = dict(reconciliation_state["row_outcomes"])
+        done_row_count = sum(1 for row_idx in row_outcomes if row_idx in weights_by_row)
+        matched_weight = sum(weights_by_row.get(row_idx, 0.0) for row_idx, outcome in row_outcomes.items() if outcome == ROW_OUTCOME_MATCHED)
+        coverage_percent = 100.0 * matched_weight / progress["total_weight"] if progress["total_weight"] else 0.0
+        print(f"Info: Progress after {now - progress['started_at']:.0f}s: {done_row_count}/{len(weights_by_row)} rows done, weighted coverage {matched_weight:.0f}/{progress['total_weight']:.0f} ({coverage_percent:.1f}%).", file=sys.stderr)
+        if progress["write_partial_output"] is not None:
+            progress["write_partial_output"]()
+    finally:
+        progress["lock"].release()
+
+def write_progress_output(progress_output_path, original_header, original_data_rows, result_store, settings, row_indices=None, carried_forward_rows=None):
+    # Rewrites the partial output through a temporary file, so that a reader never sees a half-written file
+    temporary_path = progress_output_path + ".tmp"
+    try:
+        with open(temporary_path, 'w', newline='', encoding='utf-8') as progress_file:
+            write_output_csv(original_header, original_data_rows, result_store, row_indices=row_indices, carried_forward_rows=carried_forward_rows, output_stream=progress_file, settings=settings)
+        os.replace(temporary_path, progress_output_path)
+    except OSError as e:
+        print(f"Warning: Could not write progress output '{progress_output_path}': {e}", file=sys.stderr)
+
+def read_dead_letter_row_indices(dead_letter_path):
+    """Returns the set of original row indices listed in a dead-letter file written by write_dead_letter_file."""
+    row_indices = set()
+    try:
+        with open(dead_letter_path, 'r', encoding='utf-8') as dead_letter_file:
+            for line_number, line in enumerate(dead_letter_file, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    row_indices.add(int(json.loads(line)["row_index"]))
+                except (ValueError, KeyError, TypeError) as e:
+                    print(f"Warning: Skipping invalid line {line_number} in dead-letter file '{dead_letter_path}': {e}", file=sys.stderr)
+    except FileNotFoundError:
+        print(f"Error: Dead-letter file '{dead_letter_path}' not found.", file=sys.stderr)
+        sys.exit(1)
+    return row_indices
+
+def open_gazetteer(gazetteer_path):
+    try:
+        gazetteer = Gazetteer(gazetteer_path)
+    except (OSError, ValueError) as e:
+        print(f"Error: Could not open gazetteer file '{gazetteer_path}': {e}", file=sys.stderr)
+        sys.exit(1)
+    print(f"Info: Using gazetteer '{gazetteer_path}' ({gazetteer.entry_count} reviewed entries).", file=sys.stderr)
+    return gazetteer
+
+def open_label_filters(args):
+    # Vocabulary (LABEL_FILTER_*) -> LabelFilter of --tgn-label-filter and --wikidata-label-filter
+    label_filters = {}
+    for vocabulary, label_filter_path in ((LABEL_FILTER_TGN, args.tgn_label_filter), (LABEL_FILTER_WIKIDATA, args.wikidata_label_filter)):
+        if not label_filter_path:
+            continue
+        try:
+            label_filters[vocabulary] = LabelFilter(label_filter_path)
+        except (OSError, ValueError) as e:
+            print(f"Error: Could not open label filter file '{label_filter_path}': {e}", file=sys.stderr)
+            sys.exit(1)
+        print(f"Info: Using {vocabulary} label filter '{label_filter_path}' ({label_filters[vocabulary].label_count} labels).", file=sys.stderr)
+    return label_filters
+
+def load_lean_ranking_table(args, settings):
+    if not args.lean_candidates:
+        return None
+    place_type_ancestors = load_place_type_ancestor_table(args.place_type_table_file, settings)
+    if place_type_ancestors is None:
+        print("Warning: The place type table could not be loaded. Using the ranked TGN queries instead of --lean-candidates.", file=sys.stderr)
+    return place_type_ancestors
+
+def new_cascade_planner(args):
+    cascade_planner = CascadePlanner(enabled=args.adaptive_cascade, max_cost_per_hit=args.max_cost_per_hit, min_attempts=args.planner_min_attempts)
+    if args.cascade_stats_file:
+        cascade_planner.load(args.cascade_stats_file)
+    return cascade_planner
+
+def report_cascade_statistics(reconciliation_state, args):
+    if reconciliation_state["label_filter_skips"]:
+        skip_counts = ", ".join(f"{stage} {count}" for stage, count in sorted(reconciliation_state["label_filter_skips"].items()))
+        print(f"Info: Stages skipped by the label filters: {skip_counts}.", file=sys.stderr)
+    cascade_planner = reconciliation_state["cascade_planner"]
+    statistics_lines = cascade_planner.report_lines()
+    if statistics_lines:
+        print("Info: Cascade stage statistics (stage/context specificity):", file=sys.stderr)
+        for line in statistics_lines:
+            print(line, file=sys.stderr)
+    skipped_unmatched_count = sum(1 for row_idx in reconciliation_state["rows_with_skipped_stages"] if reconciliation_state["row_outcomes"].get(row_idx) == ROW_OUTCOME_UNMATCHED)
+    if skipped_unmatched_count:
+        print(f"Warning: {skipped_unmatched_count} rows stayed unmatched after --adaptive-cascade skipped at least one of their stages. Rerun them without --adaptive-cascade (e.g. with --previous-output and --requery-unmatched) to try every stage.", file=sys.stderr)
+    if args.cascade_stats_file:
+        cascade_planner.save(args.cascade_stats_file)
+
+def planned_row_steps(potential_top_region_contexts):
+    # (stage, specificity, context URI) of every network stage of a row, in cascade order (row_cascade_levels)
+    steps = [(stage, context_info["specificity"], context_info["uri"]) for context_info in potential_top_region_contexts for stage in CONTEXTUAL_CASCADE_STAGES]
+    steps.extend((stage, GLOBAL_SPECIFICITY, "") for stage in GLOBAL_CASCADE_STAGES)
+    return steps
+
+def plan_reconciliation(items, args, gazetteer, label_filters, cascade_planner):
+    """
+    Dry run of the cascade for items (--plan): sends no queries. Rows resolved by the gazetteer drop out, rows with the
+    same name and contexts are planned once, stages excluded by the label filters or answered from prefetched contexts
+    send no query, and with --breadth-first rows share their lookups. Returns a dict with the row counts and, per stage,
+    the worst case (no stage ever hits) and the expected number of queries and seconds, from the hit rates and
+    durations recorded in cascade_planner (stages without statistics count as never hitting).
+    """
+    context_row_counts = count_context_usage(items)
+    plan = {
+        "rows": len(items), "gazetteer_rows": 0, "global_only_rows": 0, "distinct_rows": 0, "distinct_lookups": 0,
+        "stages": {stage: {"worst_queries": 0, "expected_queries": 0.0, "worst_seconds": 0.0, "expected_seconds": 0.0, "filtered_rows": 0, "prefetched_rows": 0, "has_statistics": False}
+                   for stage in CONTEXTUAL_CASCADE_STAGES + GLOBAL_CASCADE_STAGES},
+        "tgn_prefetches": set(), "wikidata_prefetches": set(),
+    }
+    rows_by_key = defaultdict(int)
+    contexts_by_key = {}
+    for region_name, potential_top_region_contexts, _ in items:
+        if gazetteer is not None and any(gazetteer.lookup(region_name, context_uri) is not None for context_uri in [context_info["uri"] for context_info in potential_top_region_contexts] or [""]):
+            plan["gazetteer_rows"] += 1
+            continue
+        if not potential_top_region_contexts:
+            plan["global_only_rows"] += 1
+        row_key = (region_name, tuple(context_info["uri"] for context_info in potential_top_region_contexts))
+        rows_by_key[row_key] += 1
+        contexts_by_key[row_key] = potential_top_region_contexts
+    plan["distinct_rows"] = len(rows_by_key)
+
+    # With --breadth-first: lookup (stage, context URI, name) -> [seconds per query, probability that no row reaches it]
+    lookups = {}
+    distinct_lookups = set()
+    for row_key, row_count in rows_by_key.items():
+        region_name = row_key[0]
+        reach_probability = 1.0
+        for stage, specificity, context_uri in planned_row_steps(contexts_by_key[row_key]):
+            stage_plan = plan["stages"][stage]
+            label_filter = label_filters.get(LABEL_FILTER_OF_STAGE.get(stage))
+            if label_filter is not None and label_filter.excludes(region_name, args.match_mode):
+                stage_plan["filtered_rows"] += row_count
+                continue
+            stage_estimate = cascade_planner.stage_estimate(stage, specificity)
+            if stage_estimate is not None:
+                stage_plan["has_statistics"] = True
+            hit_rate, seconds_per_query = stage_estimate or (0.0, DEFAULT_PLAN_SECONDS_PER_QUERY)
+            prefetched = context_uri and context_row_counts[context_uri] >= args.prefetch_min_rows and (
+                (stage == MATCH_STAGE_TGN_CONTEXTUAL and args.prefetch_contexts) or
+                (stage != MATCH_STAGE_TGN_CONTEXTUAL and args.prefetch_wikidata and extract_tgn_id_from_uri(context_uri)))
+            if prefetched:
+                # Answered locally; the context is downloaded once
+                stage_plan["prefetched_rows"] += row_count
+                plan["tgn_prefetches" if stage == MATCH_STAGE_TGN_CONTEXTUAL else "wikidata_prefetches"].add(context_uri)
+            elif args.breadth_first:
+                distinct_lookups.add((stage, context_uri, region_name))
+                lookup = lookups.setdefault((stage, context_uri, region_name), [seconds_per_query, 1.0])
+                if not cascade_planner.predicts_skip(stage, specificity):
+                    lookup[1] *= 1.0 - reach_probability
+            else:
+                distinct_lookups.add((stage, context_uri, region_name))
+                expected_queries = 0.0 if cascade_planner.predicts_skip(stage, specificity) else row_count * reach_probability
+                stage_plan["worst_queries"] += row_count
+                stage_plan["worst_seconds"] += row_count * seconds_per_query
+                stage_plan["expected_queries"] += expected_queries
+                stage_plan["expected_seconds"] += expected_queries * seconds_per_query
+            reach_probability *= 1.0 - hit_rate
+
+    for (stage, _, _), (seconds_per_query, unreached_probability) in lookups.items():
+        stage_plan = plan["stages"][stage]
+        stage_plan["worst_queries"] += 1
+        stage_plan["worst_seconds"] += seconds_per_query
+        stage_plan["expected_queries"] += 1.0 - unreached_probability
+        stage_plan["expected_seconds"] += (1.0 - unreached_probability) * seconds_per_query
+    plan["distinct_lookups"] = len(distinct_lookups)
+    return plan
+
+def format_plan_duration(seconds):
+    if seconds >= 3600:
+        return f"{seconds / 3600:.1f}h"
+    if seconds >= 60:
+        return f"{seconds / 60:.0f}min"
+    return f"{seconds:.0f}s"
+
+def report_reconciliation_plan(plan, args):
+    print(f"Info: Plan: {plan['rows']} rows to query, {plan['gazetteer_rows']} of them resolved by the gazetteer. {plan['distinct_rows']} distinct names and context chains, {plan['distinct_lookups']} distinct stage lookups.", file=sys.stderr)
+    print(f"Info: Plan: {plan['global_only_rows']} rows have no context and fall through to the global search.", file=sys.stderr)
+    if plan["rows"] and plan["global_only_rows"] * 2 > plan["rows"]:
+        print("Warning: Most rows have no context. Check --ri-top-region-name-col and the --trd-name-cols of the definition files.", file=sys.stderr)
+
+    estimate_source = f"recorded hit rates of '{args.cascade_stats_file}'" if args.cascade_stats_file else "no --cascade-stats-file, so the same as the worst case"
+    print(f"Info: Plan: queries per stage, worst case / expected ({estimate_source}):", file=sys.stderr)
+    prefetch_count = len(plan["tgn_prefetches"]) + len(plan["wikidata_prefetches"])
+    worst_seconds = prefetch_count * DEFAULT_PLAN_SECONDS_PER_PREFETCH
+    expected_seconds = worst_seconds
+    worst_queries = prefetch_count
+    expected_queries = float(prefetch_count)
+    for stage, stage_plan in plan["stages"].items():
+        details = []
+        if stage_plan["filtered_rows"]:
+            details.append(f"{stage_plan['filtered_rows']} rows skipped by the label filter")
+        if stage_plan["prefetched_rows"]:
+            details.append(f"{stage_plan['prefetched_rows']} rows answered from prefetched contexts")
+        if not stage_plan["has_statistics"] and stage_plan["worst_queries"]:
+            details.append(f"no recorded statistics, {DEFAULT_PLAN_SECONDS_PER_QUERY:.0f}s per query assumed")
+        details_text = f" ({'; '.join(details)})" if details else ""
+        print(f"  {stage}: {stage_plan['worst_queries']} / {stage_plan['expected_queries']:.0f}{details_text}", file=sys.stderr)
+        worst_queries += stage_plan["worst_queries"]
+        expected_queries += stage_plan["expected_queries"]
+        worst_seconds += stage_plan["worst_seconds"]
+        expected_seconds += stage_plan["expected_seconds"]
+    if prefetch_count:
+        print(f"  prefetch: {len(plan['tgn_prefetches'])} TGN and {len(plan['wikidata_prefetches'])} Wikidata context downloads, {DEFAULT_PLAN_SECONDS_PER_PREFETCH:.0f}s each assumed", file=sys.stderr)
+    print(f"  total: {worst_queries} / {expected_queries:.0f}", file=sys.stderr)
+    # Requests per endpoint are limited adaptively up to --workers; the projection assumes the limit is reached
+    print(f"Info: Plan: projected wall time with --workers {args.workers}: {format_plan_duration(worst_seconds / args.workers)} worst case, {format_plan_duration(expected_seconds / args.workers)} expected. Detail fetches of matches and retries are not included.", file=sys.stderr)
+
+def new_reconciliation_state(sparql_values_to_query, args, settings):
+    # Caches shared by all rows of a run (and by retry passes)
+    return {
+        # Columns, --top-k, executor settings and HTTP session of the engine (CascadeSettings)
+        "settings": settings,
+        # Prefetched contexts (context URI -> label map, or None if the prefetch failed)
+        "prefetched_contexts": {},
+        # Prefetched Wikidata descendants per parent TGN ID (label map, or None if the prefetch failed)
+        "prefetched_wikidata_contexts": {},
+        # Held while a context is prefetched, so that parallel rows (--workers) wait for one download
+        "prefetch_lock": threading.Lock(),
+        # TGN details per URI for locally resolved matches
+        "tgn_details_cache": {},
+        "context_row_counts": count_context_usage(sparql_values_to_query) if (args.prefetch_contexts or args.prefetch_wikidata) else {},
+        "gazetteer": open_gazetteer(args.gazetteer_file) if args.gazetteer_file else None,
+        # Label filters per vocabulary (--tgn-label-filter, --wikidata-label-filter) and the stages they skipped
+        "label_filters": open_label_filters(args),
+        "match_mode": args.match_mode,
+        "label_filter_skips": defaultdict(int),
+        "label_filter_lock": threading.Lock(),
+        # Place type -> ancestors table for --lean-candidates (None: use the ranked TGN queries)
+        "place_type_ancestors": load_lean_ranking_table(args, settings),
+        # TGN details are fetched without the Wikidata SERVICE call (--deferred-wikidata)
+        "deferred_wikidata": args.deferred_wikidata,
+        # Hit rate and cost per (stage, context specificity); skips stages with --adaptive-cascade
+        "cascade_planner": new_cascade_planner(args),
+        # Original row indices whose latest attempt skipped a stage (--adaptive-cascade)
+        "rows_with_skipped_stages": set(),
+        # Original row index -> ROW_OUTCOME_* of the latest attempt
+        "row_outcomes": {},
+        # Original row index -> {"stage", "endpoint", "error"} of the latest failed or deferred attempt
+        "row_errors": {},
+        # Weight of each data row (--priority-col), None without it
+        "row_weights": None,
+        # Weighted coverage and partial output of the run (new_progress_report), None without --priority-col or --progress-output
+        "progress": None,
+    }
+
+def run_cascade_stage(stage, specificity, region_name, original_row_idx, reconciliation_state, attempt_stage):
+    """
+    Runs attempt_stage() (one stage of the cascade, returning True if it stored a match) unless the cascade planner
+    skips it, and records the outcome and duration of the stage. Returns True if a match was stored.
+    """
+    label_filter = reconciliation_state["label_filters"].get(LABEL_FILTER_OF_STAGE.get(stage))
+    if label_filter is not None and label_filter.excludes(region_name, reconciliation_state["match_mode"]):
+        # No label of the stage's vocabulary matches the name, so its queries cannot find anything
+        print(f"  Info: Skipping stage '{stage}' for '{region_name}': the name is not in the {LABEL_FILTER_OF_STAGE[stage]} label filter.", file=sys.stderr)
+        with reconciliation_state["label_filter_lock"]:
+            reconciliation_state["label_filter_skips"][stage] += 1
+        trace_span(f"stage {stage}", "stage", stage=stage, specificity=specificity, outcome="filtered").finish()
+        return False
+    cascade_planner = reconciliation_state["cascade_planner"]
+    if cascade_planner.should_skip(stage, specificity):
+        print(f"  Info: Skipping stage '{stage}' (specificity {specificity}) for '{region_name}': its expected cost per hit is above the limit.", file=sys.stderr)
+        reconciliation_state["rows_with_skipped_stages"].add(original_row_idx)
+        trace_span(f"stage {stage}", "stage", stage=stage, specificity=specificity, outcome="skipped").finish()
+        return False
+    stage_start_time = time.monotonic()
+    with trace_span(f"stage {stage}", "stage", stage=stage, specificity=specificity) as span_args:
+        match_found = attempt_stage()
+        span_args["outcome"] = "hit" if match_found else "miss"
+    cascade_planner.record(stage, specificity, match_found, time.monotonic() - stage_start_time)
+    return match_found
+
+def attempt_contextual_tgn_search(region_name, current_top_region_uri, context_label, original_row_idx, result_store, args, reconciliation_state):
+    # Contextual TGN stage for one context: prefetched descendants, lean candidates or the ranked query
+    settings = reconciliation_state["settings"]
+    prefetched_match = None
+    if args.prefetch_contexts and reconciliation_state["context_row_counts"].get(current_top_region_uri, 0) >= args.prefetch_min_rows:
+        with reconciliation_state["prefetch_lock"]:
+            if current_top_region_uri not in reconciliation_state["prefetched_contexts"]:
+                reconciliation_state["prefetched_contexts"][current_top_region_uri] = fetch_context_descendants(current_top_region_uri, settings)
+        label_map = reconciliation_state["prefetched_contexts"][current_top_region_uri]
+        if label_map is not None:
+            prefetched_match = resolve_tgn_match_from_prefetched_context(region_name, label_map, original_row_idx, result_store, reconciliation_state["tgn_details_cache"], settings, context_label="TGN " + context_label, deferred_wikidata=args.deferred_wikidata)
+    if prefetched_match is not None:
+        return prefetched_match
+
+    if reconciliation_state["place_type_ancestors"] is not None:
+        # Lean candidate query, ranked locally
+        query = LEAN_TGN_CONTEXTUAL_CANDIDATES_QUERY_TEMPLATE.format(
+            label_match_clause=build_label_match_clause("found_label_uri", region_name, args.match_mode),
+            top_region_uri=current_top_region_uri
+        )
+        return resolve_tgn_match_from_lean_candidates(query, QUERY_CLASS_TGN_CONTEXTUAL, region_name, original_row_idx, result_store, reconciliation_state, args.match_mode, MATCH_STAGE_TGN_CONTEXTUAL, context_label="TGN " + context_label)
+
+    # Context not prefetched (or its prefetch/detail fetch failed): query this row individually
+    query_template = settings.tgn_query_template(QUERY_KIND_CONTEXTUAL, with_wikidata=not args.deferred_wikidata)
+    query = query_template.format(
+        label_match_clause=build_label_match_clause("found_label_uri", region_name, args.match_mode),
+        top_region_uri=current_top_region_uri
+    )
+    sparql_response_json = execute_sparql_query(query, query_class=QUERY_CLASS_TGN_CONTEXTUAL, settings=settings)
+    with trace_span("parse and store", "store"):
+        return process_and_store_tgn_match(sparql_response_json, region_name, original_row_idx, result_store, context_label="TGN " + context_label, match_mode=args.match_mode, settings=settings)
+
+def attempt_global_tgn_search(region_name, original_row_idx, result_store, args, reconciliation_state):
+    settings = reconciliation_state["settings"]
+    if reconciliation_state["place_type_ancestors"] is not None:
+        global_tgn_query = LEAN_TGN_GLOBAL_CANDIDATES_QUERY_TEMPLATE.format(label_match_clause=build_label_match_clause("found_label_uri", region_name, args.match_mode))
+        return resolve_tgn_match_from_lean_candidates(global_tgn_query, QUERY_CLASS_TGN_GLOBAL, region_name, original_row_idx, result_store, reconciliation_state, args.match_mode, MATCH_STAGE_TGN_GLOBAL, context_label="TGN Global")
+    query_template = settings.tgn_query_template(QUERY_KIND_GLOBAL, with_wikidata=not args.deferred_wikidata)
+    global_tgn_query = query_template.format(label_match_clause=build_label_match_clause("found_label_uri", region_name, args.match_mode))
+    sparql_response_json = execute_sparql_query(global_tgn_query, query_class=QUERY_CLASS_TGN_GLOBAL, settings=settings)
+    with trace_span("parse and store", "store"):
+        return process_and_store_tgn_match(sparql_response_json, region_name, original_row_idx, result_store, context_label="TGN Global", match_mode=args.match_mode, stage=MATCH_STAGE_TGN_GLOBAL, settings=settings)
+
+def context_wikidata_label_map(current_top_region_uri, parent_tgn_id, args, reconciliation_state):
+    # Prefetched Wikidata descendants of a context for the contextual Wikidata fallbacks (--prefetch-wikidata), or None
+    if not (args.prefetch_wikidata and parent_tgn_id and reconciliation_state["context_row_counts"].get(current_top_region_uri, 0) >= args.prefetch_min_rows):
+        return None
+    with reconciliation_state["prefetch_lock"]:
+        if parent_tgn_id not in reconciliation_state["prefetched_wikidata_contexts"]:
+            reconciliation_state["prefetched_wikidata_contexts"][parent_tgn_id] = fetch_wikidata_descendants(parent_tgn_id, reconciliation_state["settings"])
+    return reconciliation_state["prefetched_wikidata_contexts"][parent_tgn_id]
+
+def contextual_cascade_level(region_name, context_info, original_row_idx, result_store, args, reconciliation_state):
+    # The stages of one context: contextual TGN search, then the Wikidata fallbacks for this context
+    current_top_region_uri = context_info["uri"]
+    specificity = context_info["specificity"]
+    context_label = f"contextual (source: {context_info['source_file']}, specificity: {specificity})"
+    parent_tgn_id = extract_tgn_id_from_uri(current_top_region_uri)
+    settings = reconciliation_state["settings"]
+    return [
+        (MATCH_STAGE_TGN_CONTEXTUAL, specificity, current_top_region_uri,
+         f"  Trying TGN search for '{region_name}' with top-region <{current_top_region_uri}> ({context_label})",
+         lambda: attempt_contextual_tgn_search(region_name, current_top_region_uri, context_label, original_row_idx, result_store, args, reconciliation_state)),
+        (MATCH_STAGE_WIKIDATA_TGN_ID, specificity, current_top_region_uri,
+         f"  TGN search failed for context <{current_top_region_uri}>. Attempting Wikidata fallbacks for this context.",
+         lambda: attempt_first_wikidata_fallback(region_name, parent_tgn_id, original_row_idx, result_store, "Wikidata " + context_label, args.match_mode,
+                                                 context_wikidata_label_map(current_top_region_uri, parent_tgn_id, args, reconciliation_state), settings)),
+        (MATCH_STAGE_WIKIDATA_ONLY, specificity, current_top_region_uri,
+         None,
+         lambda: attempt_second_wikidata_fallback(region_name, parent_tgn_id, original_row_idx, result_store, "Wikidata " + context_label, args.match_mode,
+                                                  context_wikidata_label_map(current_top_region_uri, parent_tgn_id, args, reconciliation_state), settings)),
+    ]
+
+def row_cascade_levels(region_name, potential_top_region_contexts, original_row_idx, result_store, args, reconciliation_state):
+    """
+    The network stages of one row in precedence order: one level per context (most specific first), then the global level.
+    Returns a list of (context_info or None, steps). Each step is (stage, specificity, context URI, announcement or None,
+    attempt), where attempt() runs the stage for this row and returns True if it stored a match. The first hit wins.
+    """
+    cascade_levels = [
+        (context_info, contextual_cascade_level(region_name, context_info, original_row_idx, result_store, args, reconciliation_state))
+        for context_info in potential_top_region_contexts
+    ]
+    # Global Wikidata Fallbacks: parent_tgn_id_for_context is None for global; the global 2nd type fallback was removed
+    cascade_levels.append((None, [
+        (MATCH_STAGE_TGN_GLOBAL, GLOBAL_SPECIFICITY, "",
+         f"Hierarchical search failed or no contexts for '{region_name}'. Attempting global search.\n  Trying Global TGN search for '{region_name}'",
+         lambda: attempt_global_tgn_search(region_name, original_row_idx, result_store, args, reconciliation_state)),
+        (MATCH_STAGE_WIKIDATA_GLOBAL_TGN_ID, GLOBAL_SPECIFICITY, "",
+         f"  Global TGN search failed for '{region_name}'. Attempting Global Wikidata fallbacks.",
+         lambda: attempt_first_wikidata_fallback(region_name, None, original_row_idx, result_store, "Wikidata Global", args.match_mode, settings=reconciliation_state["settings"])),
+    ]))
+    return cascade_levels
+
+def announce_cascade(region_name, potential_top_region_contexts):
+    if potential_top_region_contexts:
+        print(f"Attempting hierarchical search with {len(potential_top_region_contexts)} context(s) for '{region_name}'.", file=sys.stderr)
+    else:
+        print(f"No hierarchical contexts found for '{region_name}'. Proceeding to global search.", file=sys.stderr)
+
+def reconcile_region_item(region_name, potential_top_region_contexts, original_row_idx, result_store, args, reconciliation_state):
+    """
+    Runs the full cascade (contextual TGN and Wikidata per context, then global TGN and Wikidata) for one row.
+    Returns True if a match was stored in result_store, False otherwise.
+    Raises EndpointUnavailableError if a needed endpoint's circuit breaker is open; the row should then be retried later.
+    Raises SparqlQueryError if a query failed before a match was found; the row's result is then unknown.
+    """
+    reconciliation_state["rows_with_skipped_stages"].discard(original_row_idx)
+
+    # --- Reviewed matches (no network access) ---
+    if reconciliation_state["gazetteer"] is not None:
+        if resolve_from_gazetteer(reconciliation_state["gazetteer"], region_name, potential_top_region_contexts, original_row_idx, result_store, reconciliation_state["settings"]):
+            return True
+
+    # --- Hierarchical context search, then global search ---
+    announce_cascade(region_name, potential_top_region_contexts)
+    for context_info, steps in row_cascade_levels(region_name, potential_top_region_contexts, original_row_idx, result_store, args, reconciliation_state):
+        level_span = trace_span("context", "context", context_uri=context_info["uri"], specificity=context_info["specificity"], source_file=context_info["source_file"]) if context_info is not None else nullcontext()
+        with level_span:
+            for stage, specificity, _, announcement, attempt_stage in steps:
+                if announcement:
+                    print(announcement, file=sys.stderr)
+                if run_cascade_stage(stage, specificity, region_name, original_row_idx, reconciliation_state, attempt_stage):
+                    return True # Found a match, move to next region_name
+    return False
+
+def write_reconciliation_trace(trace_path):
+    try:
+        span_count = write_trace_file(trace_path)
+    except OSError as e:
+        print(f"Error: Could not write trace file '{trace_path}': {e}", file=sys.stderr)
+        return
+    print(f"Info: Wrote {span_count} trace spans to '{trace_path}'.", file=sys.stderr)
+
+# Result of reconcile_pass_item for a row deferred because an endpoint's circuit breaker was open
+PASS_ITEM_DEFERRED = "deferred"
+
+def record_row_failure(item, error, result_store, reconciliation_state):
+    """
+    Clears the row of an item whose cascade raised error and records the error.
+    Returns PASS_ITEM_DEFERRED for an unavailable endpoint (EndpointUnavailableError), ROW_OUTCOME_ERRORED for a failed query.
+    """
+    region_name, _, original_row_idx = item
+    result_store.clear_row(original_row_idx)
+    reconciliation_state["row_outcomes"][original_row_idx] = ROW_OUTCOME_ERRORED
+    report_progress(reconciliation_state)
+    if isinstance(error, EndpointUnavailableError):
+        print(f"Info: Deferring '{region_name}' (Original Row Index: {original_row_idx}): {error}", file=sys.stderr)
+        reconciliation_state["row_errors"][original_row_idx] = {"stage": DEAD_LETTER_STAGE_ENDPOINT_UNAVAILABLE, "endpoint": error.endpoint_url, "error": str(error)}
+        return PASS_ITEM_DEFERRED
+    print(f"Warning: Lookup of '{region_name}' (Original Row Index: {original_row_idx}) failed in stage '{error.query_class}': {error.message}", file=sys.stderr)
+    reconciliation_state["row_errors"][original_row_idx] = {"stage": error.query_class, "endpoint": error.endpoint_url, "error": error.message}
+    return ROW_OUTCOME_ERRORED
+
+def record_row_result(item, match_found, reconciliation_state):
+    # Records the outcome of an item whose cascade ran to its end (or to its first hit). Returns the ROW_OUTCOME_*.
+    region_name, _, original_row_idx = item
+    reconciliation_state["row_errors"].pop(original_row_idx, None)
+    if match_found:
+        reconciliation_state["row_outcomes"][original_row_idx] = ROW_OUTCOME_MATCHED
+        report_progress(reconciliation_state)
+        return ROW_OUTCOME_MATCHED
+    reconciliation_state["row_outcomes"][original_row_idx] = ROW_OUTCOME_UNMATCHED
+    report_progress(reconciliation_state)
+    print(f"Exhausted all search methods for '{region_name}'. No match found.", file=sys.stderr)
+    return ROW_OUTCOME_UNMATCHED
+
+def reconcile_pass_item(item_label, item, result_store, args, reconciliation_state):
+    """
+    Reconciles one item of a pass and records its outcome in reconciliation_state["row_outcomes"].
+    Returns the ROW_OUTCOME_* of the row, or PASS_ITEM_DEFERRED if an endpoint was unavailable.
+    """
+    region_name, potential_top_region_contexts, original_row_idx = item
+    print(f"\nProcessing item {item_label}: '{region_name}' (Original Row Index: {original_row_idx})", file=sys.stderr)
+    row_span = trace_span("row", "row", term=region_name, row_index=original_row_idx, context_count=len(potential_top_region_contexts))
+    try:
+        match_found_for_row = reconcile_region_item(region_name, potential_top_region_contexts, original_row_idx, result_store, args, reconciliation_state)
+    except (EndpointUnavailableError, SparqlQueryError) as e:
+        row_span.finish(outcome=ROW_OUTCOME_ERRORED, error=str(e))
+        return record_row_failure(item, e, result_store, reconciliation_state)
+    row_span.finish(outcome=ROW_OUTCOME_MATCHED if match_found_for_row else ROW_OUTCOME_UNMATCHED, stage=result_store.get_stage(original_row_idx))
+    return record_row_result(item, match_found_for_row, reconciliation_state)
+
+def run_breadth_first_pass(items_to_reconcile, result_store, args, reconciliation_state, worker_count=1):
+    """
+    Reconciles every item once, like run_reconciliation_pass, but stage by stage (--breadth-first): each wave runs the
+    next stage of every row that is still pending, so every stage sees its whole pending set at once. Rows waiting for
+    the same lookup (stage, context and name) share one execution, and the lookups of a wave run in worker_count threads.
+    Each row still tries its stages in cascade order and keeps its first hit, so it gets the same match as depth-first.
+    Returns (deferred_items, errored_items) in input order.
+    """
+    pass_outcomes = {}
+    # Original row index -> [item, steps of row_cascade_levels in precedence order, position of the next step]
+    pending_rows = {}
+    for item in items_to_reconcile:
+        region_name, potential_top_region_contexts, original_row_idx = item
+        reconciliation_state["rows_with_skipped_stages"].discard(original_row_idx)
+        if reconciliation_state["gazetteer"] is not None and resolve_from_gazetteer(reconciliation_state["gazetteer"], region_name, potential_top_region_contexts, original_row_idx, result_store, reconciliation_state["settings"]):
+            pass_outcomes[original_row_idx] = record_row_result(item, True, reconciliation_state)
+            continue
+        cascade_levels = row_cascade_levels(region_name, potential_top_region_contexts, original_row_idx, result_store, args, reconciliation_state)
+        pending_rows[original_row_idx] = [item, [step for _, steps in cascade_levels for step in steps], 0]
+
+    def run_lookup(representative_row_idx):
+        # Returns (True/False or the raised error, whether the planner skipped the stage for this row)
+        item, steps, step_position = pending_rows[representative_row_idx]
+        stage, specificity, _, announcement, attempt_stage = steps[step_position]
+        skipped_before = representative_row_idx in reconciliation_state["rows_with_skipped_stages"]
+        if step_position == 0:
+            announce_cascade(item[0], item[1])
+        if announcement:
+            print(announcement, file=sys.stderr)
+        try:
+            lookup_outcome = run_cascade_stage(stage, specificity, item[0], representative_row_idx, reconciliation_state, attempt_stage)
+        except (EndpointUnavailableError, SparqlQueryError) as e:
+            lookup_outcome = e
+        return lookup_outcome, not skipped_before and representative_row_idx in reconciliation_state["rows_with_skipped_stages"]
+
+    wave_number = 0
+    while pending_rows:
+        wave_number += 1
+        rows_by_lookup = {}
+        for original_row_idx, (item, steps, step_position) in pending_rows.items():
+            stage, _, context_uri, _, _ = steps[step_position]
+            rows_by_lookup.setdefault((stage, context_uri, item[0]), []).append(original_row_idx)
+        # Lookups of the same stage and context run next to each other (prefetched contexts, warm server caches)
+        lookup_keys = sorted(rows_by_lookup)
+        if reconciliation_state["row_weights"] is not None:
+            # --priority-col: the lookups of the heaviest rows first
+            row_weights = reconciliation_state["row_weights"]
+            lookup_keys.sort(key=lambda lookup_key: -sum(row_weights[row_idx] for row_idx in rows_by_lookup[lookup_key]))
+        print(f"\nInfo: Breadth-first wave {wave_number}: {len(pending_rows)} rows pending, {len(lookup_keys)} distinct lookups.", file=sys.stderr)
+        with trace_span("wave", "wave", wave=wave_number, row_count=len(pending_rows), lookup_count=len(lookup_keys)):
+            representative_rows = [rows_by_lookup[lookup_key][0] for lookup_key in lookup_keys]
+            if worker_count > 1:
+                with ThreadPoolExecutor(max_workers=worker_count) as executor:
+                    lookup_outcomes = list(executor.map(run_lookup, representative_rows))
+            else:
+                lookup_outcomes = [run_lookup(representative_row_idx) for representative_row_idx in representative_rows]
+
+        for lookup_key, (lookup_outcome, stage_skipped) in zip(lookup_keys, lookup_outcomes):
+            representative_row_idx = rows_by_lookup[lookup_key][0]
+            for original_row_idx in rows_by_lookup[lookup_key]:
+                row_state = pending_rows[original_row_idx]
+                if stage_skipped:
+                    reconciliation_state["rows_with_skipped_stages"].add(original_row_idx)
+                if isinstance(lookup_outcome, Exception):
+                    pass_outcomes[original_row_idx] = record_row_failure(row_state[0], lookup_outcome, result_store, reconciliation_state)
+                elif lookup_outcome:
+                    if original_row_idx != representative_row_idx:
+                        result_store.copy_match(representative_row_idx, original_row_idx)
+                    pass_outcomes[original_row_idx] = record_row_result(row_state[0], True, reconciliation_state)
+                else:
+                    row_state[2] += 1
+                    if row_state[2] < len(row_state[1]):
+                        continue
+                    pass_outcomes[original_row_idx] = record_row_result(row_state[0], False, reconciliation_state)
+                del pending_rows[original_row_idx]
+
+    deferred_items = [item for item in items_to_reconcile if pass_outcomes[item[2]] == PASS_ITEM_DEFERRED]
+    errored_items = [item for item in items_to_reconcile if pass_outcomes[item[2]] == ROW_OUTCOME_ERRORED]
+    return deferred_items, errored_items
+
+def run_reconciliation_pass(items_to_reconcile, result_store, args, reconciliation_state, row_delay_seconds=0, worker_count=1, breadth_first=False):
+    """
+    Reconciles every item once and records its outcome in reconciliation_state["row_outcomes"].
+    With worker_count > 1, rows are reconciled in that many threads; the requests per endpoint are further limited
+    by adaptive_concurrency.py. Each row's cascade still runs in order, so every row gets the same match.
+    With breadth_first, the rows run stage by stage instead (see run_breadth_first_pass).
+    Returns (deferred_items, errored_items): the items deferred because an endpoint was unavailable and the items
+    whose lookups failed, in input order.
+    """
+    if breadth_first:
+        return run_breadth_first_pass(items_to_reconcile, result_store, args, reconciliation_state, worker_count)
+    total_items_to_reconcile = len(items_to_reconcile)
+    item_labels = [f"{item_idx+1}/{total_items_to_reconcile}" for item_idx in range(total_items_to_reconcile)]
+    if worker_count > 1:
+        with ThreadPoolExecutor(max_workers=worker_count) as executor:
+            pass_outcomes = list(executor.map(lambda item_label, item: reconcile_pass_item(item_label, item, result_store, args, reconciliation_state), item_labels, items_to_reconcile))
+    else:
+        pass_outcomes = []
+        for item_idx, item in enumerate(items_to_reconcile):
+            if row_delay_seconds and item_idx:
+                time.sleep(row_delay_seconds)
+            pass_outcomes.append(reconcile_pass_item(item_labels[item_idx], item, result_store, args, reconciliation_state))
+
+    deferred_items = [item for item, pass_outcome in zip(items_to_reconcile, pass_outcomes) if pass_outcome == PASS_ITEM_DEFERRED]
+    errored_items = [item for item, pass_outcome in zip(items_to_reconcile, pass_outcomes) if pass_outcome == ROW_OUTCOME_ERRORED]
+    return deferred_items, errored_items
+
+DEFAULT_ENGINE_BATCH_SIZE = 500
+
+class ReconciliationResult:
+    """
+    Result of one record of ReconciliationEngine.reconcile(): the processed name, the context URIs tried (most specific
+    first), the ROW_OUTCOME_*, the match stage, the match (output column -> value, None if unmatched), the ranked
+    candidates (with --top-k), the error info of a failed lookup ({"stage", "endpoint", "error"}, or None) and whether
+    --adaptive-cascade skipped a stage of the record (an unmatched record may then match in a later call).
+    """
+    __slots__ = ("name", "contexts", "outcome", "stage", "match", "candidates", "error", "stages_skipped")
+
+    def __init__(self, name, contexts, outcome, stage="", match=None, candidates=None, error=None, stages_skipped=False):
+        self.name = name
+        self.contexts = contexts
+        self.outcome = outcome
+        self.stage = stage
+        self.match = match
+        self.candidates = candidates or []
+        self.error = error
+        self.stages_skipped = stages_skipped
+
+    def __repr__(self):
+        return f"ReconciliationResult({self.name!r}, outcome={self.outcome!r}, stage={self.stage!r})"
+
+class ReconciliationEngine:
+    """
+    The reconciliation cascade as a library. The engine owns the settings (engine_arguments(), as CascadeSettings),
+    the HTTP session, the context index and the caches (gazetteer, prefetched contexts, TGN details, label filters,
+    cascade planner), and shares them between all calls, from any number of threads:
+
+        engine = ReconciliationEngine(engine_arguments(["--top-region-def-file", "countries.csv", "--trd-name-cols", "2", "--trd-uri-col", "7"]))
+        for result in engine.reconcile([("Firenze", ["Italia", "Toscana"]), ("Lyon", ["France"])]):
+            print(result.name, result.outcome, result.match["tgn_uri"] if result.match else "")
+
+    Engines with different settings can be used side by side; only the circuit breakers, concurrency limits and
+    replica statistics of the endpoints are shared. connection_pool_size defaults to --workers.
+    """
+
+    def __init__(self, args, connection_pool_size=None):
+        self.args = args
+        self.settings = new_cascade_settings(args, new_http_session(connection_pool_size or args.workers))
+        # top_region_configs is already sorted by specificity (num_name_cols desc) by validate_cascade_arguments
+        self.context_index = load_top_region_context_index(args.top_region_configs, args.context_index_file)
+        self.reconciliation_state = None
+        self.state_lock = threading.Lock()
+
+    def shared_state(self):
+        # The caches shared by all calls; created on first use, as opening them may download the place type table
+        with self.state_lock:
+            if self.reconciliation_state is None:
+                self.reconciliation_state = new_reconciliation_state([], self.args, self.settings)
+                # Number of rows per context URI so far; contexts reaching --prefetch-min-rows are prefetched
+                self.reconciliation_state["context_row_counts"] = defaultdict(int)
+            return self.reconciliation_state
+
+    def count_context_usage(self, items):
+        if not (self.args.prefetch_contexts or self.args.prefetch_wikidata):
+            return
+        reconciliation_state = self.shared_state()
+        with self.state_lock:
+            for _, potential_top_region_contexts, _ in items:
+                for context_info in potential_top_region_contexts:
+                    reconciliation_state["context_row_counts"][context_info["uri"]] += 1
+
+    def resolve_contexts(self, context_names):
+        """Candidate contexts of a context chain (top-region names, most general first), as read_regions_for_reconciliation resolves a row."""
+        context_parts = [name.strip() for name in context_names]
+        while context_parts and not context_parts[-1]:
+            context_parts.pop()
+        if not context_parts:
+            return []
+        return lookup_context_candidates(self.context_index, normalize_context_name_parts(context_parts))
+
+    def prepare_record(self, name, context_names):
+        # (region name, candidate contexts) of a record of reconcile(), cleaned up like a row of the input file
+        region_name = name.strip()
+        if self.args.remove_trailing_state:
+            region_name = strip_trailing_state(region_name)
+        return region_name, self.resolve_contexts(context_names or [])
+
+    def reconcile_items(self, items, result_store, reconciliation_state, retry=True):
+        """
+        Reconciles items [(region name, contexts, row index)] into result_store: one pass, then the retry rounds of
+        the rows deferred by an open circuit breaker and a final retry pass over the errored rows. Without retry
+        only the first pass runs, so nothing waits for a breaker cooldown or --error-retry-delay.
+        Returns (deferred_items, errored_items), the rows that still failed.
+        """
+        args = self.args
+        row_weights = reconciliation_state["row_weights"]
+        deferred_items, errored_items = run_reconciliation_pass(items, result_store, args, reconciliation_state, worker_count=args.workers, breadth_first=args.breadth_first)
+        if not retry:
+            return deferred_items, errored_items
+
+        # Rows deferred because an endpoint's circuit breaker was open are retried once the breaker lets requests through again
+        retry_round = 0
+        while deferred_items and retry_round < args.deferred_retry_rounds:
+            retry_round += 1
+            wait_seconds = seconds_until_endpoints_available()
+            print(f"\nInfo: {len(deferred_items)} rows were deferred because an endpoint was unavailable. Retry round {retry_round}/{args.deferred_retry_rounds} starts in {wait_seconds:.0f}s.", file=sys.stderr)
+            time.sleep(wait_seconds)
+            deferred_items, newly_errored_items = run_reconciliation_pass(deferred_items, result_store, args, reconciliation_state, worker_count=args.workers, breadth_first=args.breadth_first)
+            errored_items.extend(newly_errored_items)
+
+        # Final retry pass over rows whose lookups failed, one row at a time with a pause in between (also with --workers)
+        if errored_items and args.error_retry_delay >= 0:
+            wait_seconds = seconds_until_endpoints_available()
+            print(f"\nInfo: Lookups failed for {len(errored_items)} rows. Final retry pass starts in {wait_seconds:.0f}s.", file=sys.stderr)
+            time.sleep(wait_seconds)
+            errored_items.sort(key=lambda item: (-row_weights[item[2]], item[2]) if row_weights is not None else item[2])
+            retry_deferred_items, errored_items = run_reconciliation_pass(errored_items, result_store, args, reconciliation_state, row_delay_seconds=args.error_retry_delay)
+            deferred_items.extend(retry_deferred_items)
+        return deferred_items, errored_items
+
+    def enrich_with_wikidata(self, items, result_store, reconciliation_state):
+        """
+        Looks up the Wikidata entities of the TGN matches of items (--deferred-wikidata). Returns the matched items
+        whose lookup failed; they keep their TGN match and their error is recorded in reconciliation_state["row_errors"].
+        """
+        with trace_span("wikidata enrichment", "stage"):
+            failed_entities = enrich_matches_with_wikidata(result_store, self.args.wikidata_batch_size, self.settings)
+        errored_items = []
+        for item in items:
+            original_row_idx = item[2]
+            entity_id = result_store.row_entity_ids[original_row_idx]
+            if entity_id in failed_entities and result_store.get_stage(original_row_idx) in MATCH_STAGES_WITH_TGN_WIKIDATA_LOOKUP:
+                reconciliation_state["row_errors"][original_row_idx] = failed_entities[entity_id]
+                errored_items.append(item)
+        if failed_entities:
+            print(f"Warning: The Wikidata lookup failed for {len(failed_entities)} matched TGN entities. Their rows are written without Wikidata columns.", file=sys.stderr)
+        return errored_items
+
+    def plan(self, items):
+        """Dry run of reconcile_items for items (plan_reconciliation); opens the gazetteer and label filters but sends no queries."""
+        gazetteer = open_gazetteer(self.args.gazetteer_file) if self.args.gazetteer_file else None
+        return plan_reconciliation(items, self.args, gazetteer, open_label_filters(self.args), new_cascade_planner(self.args))
+
+    def reconcile(self, records, batch_size=DEFAULT_ENGINE_BATCH_SIZE, retry=True):
+        """
+        Reconciles records, an iterable of (name, context chain) with the context chain a list of top-region names,
+        most general first (like the --ri-top-region-name-col columns). Yields a ReconciliationResult per record, in
+        order. Records are read and reconciled batch_size at a time, so --workers and --breadth-first work within a
+        batch and an endless iterable is fine. Without retry the rows deferred by an open circuit breaker and the
+        errored rows are not retried (see reconcile_items) and come back with their error right away.
+        """
+        batch = []
+        for record in records:
+            batch.append(record)
+            if len(batch) >= batch_size:
+                yield from self.reconcile_batch(batch, retry)
+                batch = []
+        if batch:
+            yield from self.reconcile_batch(batch, retry)
+
+    def reconcile_batch(self, records, retry=True):
+        items = []
+        record_names = []
+        record_contexts = []
+        for record_idx, (name, context_names) in enumerate(records):
+            region_name, potential_top_region_contexts = self.prepare_record(name, context_names)
+            record_names.append(region_name)
+            record_contexts.append([context_info["uri"] for context_info in potential_top_region_contexts])
+            if region_name:
+                items.append((region_name, potential_top_region_contexts, record_idx))
+
+        self.count_context_usage(items)
+        # Caches are shared with the other batches and threads; outcomes and errors are per batch (row indices restart at 0)
+        batch_state = dict(self.shared_state(), row_outcomes={}, row_errors={}, rows_with_skipped_stages=set(), row_weights=None, progress=None)
+        result_store = ResultStore(len(records), entity_fields=self.settings.data_columns)
+        self.reconcile_items(items, result_store, batch_state, retry)
+        if self.args.deferred_wikidata:
+            self.enrich_with_wikidata(items, result_store, batch_state)
+
+        results = []
+        for record_idx, region_name in enumerate(record_names):
+            entity = result_store.get_match(record_idx)
+            match = {col_name: getattr(entity, col_name) for col_name in self.settings.output_data_columns} if entity is not None else None
+            results.append(ReconciliationResult(
+                region_name, record_contexts[record_idx], batch_state["row_outcomes"].get(record_idx, ROW_OUTCOME_UNMATCHED),
+                stage=result_store.get_stage(record_idx), match=match, candidates=row_candidate_list(result_store, record_idx) if self.settings.top_k else [],
+                error=batch_state["row_errors"].get(record_idx), stages_skipped=record_idx in batch_state["rows_with_skipped_stages"],
+            ))
+        return results
+
 def main():
     args = parse_arguments()
-
-    # loaded_lookup_configs is already sorted by specificity (num_name_cols desc) by parse_arguments
-    loaded_lookup_configs = read_top_region_definitions(args.top_region_configs)
-    if not any(config["map_data"] for config in loaded_lookup_configs) and args.top_region_def_file: # Check if def files were given but all empty
+    if args.trace_file:
+        enable_tracing()
+    engine = ReconciliationEngine(args)
+    settings = engine.settings
+    context_index = engine.context_index
+    if not context_index["entry_count"] and args.top_region_def_file: # Check if def files were given but all empty
         print(f"Warning: All top-region lookup maps are empty after processing definition files. Only global search will be effective if no contexts are found per item.", file=sys.stderr)
 
     original_regions_header, original_regions_data_rows, sparql_values_to_query = \
-        read_regions_for_reconciliation(args.regions_input_file, loaded_lookup_configs, args.ri_top_region_name_col, args.ri_region_name_col, args.remove_trailing_state)
+        read_regions_for_reconciliation(args.regions_input_file, context_index, args.ri_top_region_name_col, args.ri_region_name_col, args.remove_trailing_state)
+
+    output_row_indices = None
+    carried_forward_rows = {}
+    dead_letter_row_indices = read_dead_letter_row_indices(args.retry_dead_letters) if args.retry_dead_letters else None
+    if args.previous_output:
+        # Reuse the previous results; dead-letter rows (if given) are queried again and the full file is written
+        key_col_indices = args.ri_top_region_name_col + [args.ri_region_name_col]
+        key_column_names = [original_regions_header[idx] if idx < len(original_regions_header) else "" for idx in key_col_indices]
+        previous_rows_by_key = read_previous_output(args.previous_output, key_column_names, settings.output_data_columns)
+        sparql_values_to_query, carried_forward_rows = carry_forward_previous_results(
+            original_regions_data_rows, sparql_values_to_query, previous_rows_by_key, key_col_indices,
+            requery_unmatched=args.requery_unmatched, forced_row_indices=dead_letter_row_indices
+        )
+        print(f"Info: Reusing the previous results of {len(carried_forward_rows)} rows from '{args.previous_output}'. {len(sparql_values_to_query)} rows will be queried.", file=sys.stderr)
+    elif dead_letter_row_indices is not None:
+        # Only the rows listed in the dead-letter file are reconciled and written
+        sparql_values_to_query = [item for item in sparql_values_to_query if item[2] in dead_letter_row_indices]
+        output_row_indices = sorted(row_idx for row_idx in dead_letter_row_indices if 0 <= row_idx < len(original_regions_data_rows))
+        print(f"Info: Retrying {len(sparql_values_to_query)} rows from dead-letter file '{args.retry_dead_letters}'.", file=sys.stderr)
     
+    if args.plan:
+        if not args.previous_output and dead_letter_row_indices is None and len(sparql_values_to_query) < len(original_regions_data_rows):
+            print(f"Warning: Plan: {len(original_regions_data_rows) - len(sparql_values_to_query)} of {len(original_regions_data_rows)} data rows are skipped because they are too short or have an empty name. Check --ri-region-name-col and --ri-top-region-name-col.", file=sys.stderr)
+        report_reconciliation_plan(engine.plan(sparql_values_to_query), args)
+        sys.exit(0)
+
     if not sparql_values_to_query:
         print("No regions to query based on input. Outputting original data with potentially new/updated reconciliation columns.", file=sys.stderr)
-        write_output_csv(original_regions_header, original_regions_data_rows, {})
+        write_output_csv(original_regions_header, original_regions_data_rows, None, row_indices=output_row_indices, carried_forward_rows=carried_forward_rows, settings=settings)
         sys.exit(0)
 
-    processed_sparql_data = defaultdict(list)
-    total_items_to_reconcile = len(sparql_values_to_query)
-    
-    print(f"Starting reconciliation for {total_items_to_reconcile} regions...", file=sys.stderr)
-
-    for item_idx, (region_name, potential_top_region_contexts, original_row_idx) in enumerate(sparql_values_to_query):
-        print(f"\nProcessing item {item_idx+1}/{total_items_to_reconcile}: '{region_name}' (Original Row Index: {original_row_idx})", file=sys.stderr)
-        escaped_region_name = region_name.replace('\\', '\\\\').replace('"', '\\"')
-        match_found_for_row = False
-
-        # --- Hierarchical Context Search ---
-        if potential_top_region_contexts:
-            print(f"Attempting hierarchical search with {len(potential_top_region_contexts)} context(s) for '{region_name}'.", file=sys.stderr)
-            for context_info in potential_top_region_contexts:
-                current_top_region_uri = context_info["uri"]
-                context_label = f"contextual (source: {context_info['source_file']}, specificity: {context_info['specificity']})"
-                
-                print(f"  Trying TGN search for '{region_name}' with top-region <{current_top_region_uri}> ({context_label})", file=sys.stderr)
-                query = SINGLE_REGION_TGN_SPARQL_QUERY_TEMPLATE.format(
-                    search_term_direct=escaped_region_name,
-                    top_region_uri=current_top_region_uri
-                )
-                sparql_response_json = execute_sparql_query(query)
-                if process_and_store_tgn_match(sparql_response_json, region_name, original_row_idx, processed_sparql_data, context_label="TGN " + context_label):
-                    match_found_for_row = True
-                    break # Found a match, move to next region_name
-
-                # If TGN contextual search failed for this context, try Wikidata fallbacks for THIS context
-                print(f"  TGN search failed for context <{current_top_region_uri}>. Attempting Wikidata fallbacks for this context.", file=sys.stderr)
-                parent_tgn_id = extract_tgn_id_from_uri(current_top_region_uri)
-                if attempt_wikidata_fallbacks(escaped_region_name, parent_tgn_id, original_row_idx, processed_sparql_data, context_label="Wikidata " + context_label):
-                    match_found_for_row = True
-                    break # Found a match, move to next region_name
-            
-            if match_found_for_row:
-                continue # To next item in sparql_values_to_query
-        else:
-            print(f"No hierarchical contexts found for '{region_name}'. Proceeding to global search.", file=sys.stderr)
-
-
-        # --- Global Search Stage (if no match found in hierarchical contexts) ---
-        if not match_found_for_row:
-            print(f"Hierarchical search failed or no contexts for '{region_name}'. Attempting global search.", file=sys.stderr)
-            
-            # Global TGN Search
-            print(f"  Trying Global TGN search for '{region_name}'", file=sys.stderr)
-            global_tgn_query = GLOBAL_TGN_SPARQL_QUERY_TEMPLATE.format(search_term_direct=escaped_region_name)
-            sparql_response_json = execute_sparql_query(global_tgn_query)
-            if process_and_store_tgn_match(sparql_response_json, region_name, original_row_idx, processed_sparql_data, context_label="TGN Global"):
-                match_found_for_row = True
-            
-            if not match_found_for_row:
-                # Global Wikidata Fallbacks (parent_tgn_id_for_context is None for global)
-                print(f"  Global TGN search failed for '{region_name}'. Attempting Global Wikidata fallbacks.", file=sys.stderr)
-                if attempt_wikidata_fallbacks(escaped_region_name, None, original_row_idx, processed_sparql_data, context_label="Wikidata Global"):
-                    match_found_for_row = True
-
-        if not match_found_for_row:
-            print(f"Exhausted all search methods for '{region_name}'. No match found.", file=sys.stderr)
-        # else: match was found at some stage.
-
-    print(f"\nFinished all reconciliation attempts.", file=sys.stderr)
-    
-    write_output_csv(original_regions_header, original_regions_data_rows, processed_sparql_data)
+    row_weights = None
+    if args.priority_col is not None:
+        # Heaviest rows first; rows of equal weight keep the file order
+        row_weights = read_row_weights(original_regions_header, original_regions_data_rows, args.priority_col)
+        sparql_values_to_query.sort(key=lambda item: -row_weights[item[2]])
+        print(f"Info: Reconciling {len(sparql_values_to_query)} rows by descending weight (total weight {sum(row_weights[item[2]] for item in sparql_values_to_query):.0f}).", file=sys.stderr)
+
+    result_store = ResultStore(len(original_regions_data_rows), entity_fields=settings.data_columns)
+    reconciliation_state = engine.shared_state()
+    engine.count_context_usage(sparql_values_to_query)
+    reconciliation_state["row_weights"] = row_weights
+    progress_output_path = args.progress_output or (f"{args.regions_input_file}.partial.csv" if args.priority_col is not None else None)
+    if progress_output_path:
+        write_partial_output = lambda: write_progress_output(progress_output_path, original_regions_header, original_regions_data_rows, result_store, settings, row_indices=output_row_indices, carried_forward_rows=carried_forward_rows)
+        reconciliation_state["progress"] = new_progress_report(sparql_values_to_query, row_weights, args.progress_interval, write_partial_output)
+
+    print(f"Starting reconciliation for {len(sparql_values_to_query)} regions...", file=sys.stderr)
+    deferred_items, errored_items = engine.reconcile_items(sparql_values_to_query, result_store, reconciliation_state)
+
+    row_outcomes = reconciliation_state["row_outcomes"]
+    outcome_counts = {outcome: 0 for outcome in (ROW_OUTCOME_MATCHED, ROW_OUTCOME_UNMATCHED, ROW_OUTCOME_ERRORED)}
+    for outcome in row_outcomes.values():
+        outcome_counts[outcome] += 1
+    print(f"\nFinished all reconciliation attempts. Matched: {outcome_counts[ROW_OUTCOME_MATCHED]}, unmatched: {outcome_counts[ROW_OUTCOME_UNMATCHED]}, errored: {outcome_counts[ROW_OUTCOME_ERRORED]}.", file=sys.stderr)
+    print(f"Info: {result_store.match_count()} matches resolve to {result_store.entity_count()} distinct entities.", file=sys.stderr)
+    report_cascade_statistics(reconciliation_state, args)
+    if args.workers > 1:
+        print("Info: Adaptive concurrency limits per endpoint:", file=sys.stderr)
+        for line in concurrency_report_lines():
+            print(line, file=sys.stderr)
+    replica_lines = replica_report_lines(settings.replica_urls)
+    if replica_lines:
+        print("Info: Endpoint replicas:", file=sys.stderr)
+        for line in replica_lines:
+            print(line, file=sys.stderr)
+
+    if args.deferred_wikidata:
+        # Matched rows whose Wikidata lookup failed keep their TGN match and are listed in the dead-letter file
+        errored_items.extend(engine.enrich_with_wikidata(sparql_values_to_query, result_store, reconciliation_state))
+
+    dead_letters = []
+    for region_name, potential_top_region_contexts, original_row_idx in sorted(deferred_items + errored_items, key=lambda item: item[2]):
+        dead_letter = {"row_index": original_row_idx, "file_row": original_row_idx + 2, "region_name": region_name, "contexts": [context_info["uri"] for context_info in potential_top_region_contexts]}
+        dead_letter.update(reconciliation_state["row_errors"].get(original_row_idx, {}))
+        dead_letters.append(dead_letter)
+    dead_letter_path = args.dead_letter_file or f"{args.regions_input_file}.dead_letters.jsonl"
+    if dead_letters:
+        write_dead_letter_file(dead_letter_path, dead_letters)
+        print(f"Warning: {len(dead_letters)} rows could not be reconciled completely. They are listed in '{dead_letter_path}'; rerun with --retry-dead-letters {dead_letter_path} to reprocess only those rows.", file=sys.stderr)
+    elif os.path.exists(dead_letter_path):
+        # Don't leave the dead letters of an earlier run behind
+        write_dead_letter_file(dead_letter_path, [])
+        print(f"Info: No errored rows. Emptied dead-letter file '{dead_letter_path}'.", file=sys.stderr)
+
+    # Last report, with the partial output rewritten as the complete result
+    report_progress(reconciliation_state, final=True)
+    with trace_span("write output", "store"):
+        write_output_csv(original_regions_header, original_regions_data_rows, result_store, row_indices=output_row_indices, carried_forward_rows=carried_forward_rows, settings=settings)
+    if args.top_k:
+        candidates_path = args.top_k_file or f"{args.regions_input_file}.candidates.jsonl"
+        write_candidates_file(candidates_path, sparql_values_to_query, result_store)
+        print(f"Info: Wrote up to {args.top_k} ranked candidates per row to '{candidates_path}'.", file=sys.stderr)
+    if args.trace_file:
+        write_reconciliation_trace(args.trace_file)
 
 if __name__ == "__main__":
     main()
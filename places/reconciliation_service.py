@@ -0,0 +1,345 @@
+import argparse
+import json
+import sys
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import reconcile_countries
+from reconcile_region import (
+    MATCH_STAGE_GAZETTEER,
+    MATCH_STAGE_TGN_CONTEXTUAL,
+    MATCH_STAGE_TGN_GLOBAL,
+    MATCH_STAGE_TGN_PREFETCHED,
+    MATCH_STAGE_WIKIDATA_GLOBAL_TGN_ID,
+    MATCH_STAGE_WIKIDATA_ONLY,
+    MATCH_STAGE_WIKIDATA_TGN_ID,
+    ReconciliationEngine,
+    add_engine_arguments,
+    extract_tgn_id_from_uri,
+    report_cascade_statistics,
+    validate_engine_arguments,
+)
+
+# Long-running HTTP service implementing the Reconciliation Service API (the batch "queries" endpoint used by
+# OpenRefine) on top of a ReconciliationEngine of reconcile_region.py and the country query of reconcile_countries.py.
+#
+# The engine (context index, gazetteer, prefetched contexts, TGN details, cascade statistics and endpoint
+# connections) is created once and shared by all requests, and the candidates of every answered query are kept in
+# a bounded result cache, so repeated names are answered without querying any endpoint. The place queries of a
+# request are reconciled as one batch of the engine, with its --top-k candidates and --fields but without its retry
+# rounds: a lookup that fails is answered with an error right away and not cached.
+#
+# Queries of type "place" (the default) run the region cascade. Their context is passed as "context" properties,
+# most general first, like the --ri-top-region-name-col columns of reconcile_region.py:
+#
+#   {"q0": {"query": "Firenze", "properties": [{"pid": "context", "v": ["Italia", "Toscana"]}]}}
+#
+# Queries of type "country" run the reconcile_countries.py query and may return several candidates, as do place
+# queries with --top-k (the match first, then the other ranked candidates, which are never auto-matched).
+
+SERVICE_NAME = "ArtResearch TGN place reconciliation"
+TGN_IDENTIFIER_SPACE = "http://vocab.getty.edu/tgn/"
+TGN_SCHEMA_SPACE = "http://vocab.getty.edu/ontology#"
+TGN_VIEW_URL = "http://vocab.getty.edu/page/tgn/{{id}}"
+
+QUERY_TYPE_PLACE = "place"
+QUERY_TYPE_COUNTRY = "country"
+SERVICE_TYPES = [
+    {"id": QUERY_TYPE_PLACE, "name": "Place (TGN, within the given context)"},
+    {"id": QUERY_TYPE_COUNTRY, "name": "Country (TGN sovereign state)"},
+]
+CONTEXT_PROPERTY_ID = "context"
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8000
+DEFAULT_RESULT_CACHE_SIZE = 100000
+
+# Score of a place candidate per cascade stage; matches from a context or the gazetteer are safe to auto-match
+STAGE_SCORES = {
+    MATCH_STAGE_GAZETTEER: 100,
+    MATCH_STAGE_TGN_CONTEXTUAL: 100,
+    MATCH_STAGE_TGN_PREFETCHED: 100,
+    MATCH_STAGE_WIKIDATA_TGN_ID: 90,
+    MATCH_STAGE_TGN_GLOBAL: 80,
+    MATCH_STAGE_WIKIDATA_GLOBAL_TGN_ID: 70,
+    MATCH_STAGE_WIKIDATA_ONLY: 60,
+}
+AUTO_MATCH_STAGES = {MATCH_STAGE_GAZETTEER, MATCH_STAGE_TGN_CONTEXTUAL, MATCH_STAGE_TGN_PREFETCHED}
+
+class QueryError(ValueError):
+    """A malformed query or queries object; answered with HTTP 400."""
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Serve the Reconciliation Service API (OpenRefine) for TGN places, using the cascade of reconcile_region.py and the country query of reconcile_countries.py.")
+    parser.add_argument("--host", default=DEFAULT_HOST, help=f"Address to listen on (default: {DEFAULT_HOST}).")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"Port to listen on (default: {DEFAULT_PORT}).")
+    parser.add_argument("--result-cache-size", type=int, default=DEFAULT_RESULT_CACHE_SIZE, help=f"Number of answered queries (type, name and contexts) whose candidates are kept in memory (default: {DEFAULT_RESULT_CACHE_SIZE}). 0 disables the cache.")
+    add_engine_arguments(parser)
+    args = parser.parse_args()
+    validate_engine_arguments(parser, args)
+    if "tgn_uri" not in args.fields:
+        parser.error("--fields must include tgn_uri: the candidates of the service are identified by their TGN ID.")
+    if args.result_cache_size < 0:
+        parser.error("--result-cache-size must not be negative.")
+    return args
+
+def context_values_from_properties(properties):
+    # Flattens the values of the "context" properties (strings, lists of strings or {"id", "name"} objects) in order
+    context_values = []
+    for query_property in properties or []:
+        if not isinstance(query_property, dict) or query_property.get("pid") != CONTEXT_PROPERTY_ID:
+            continue
+        values = query_property.get("v")
+        for value in values if isinstance(values, list) else [values]:
+            if isinstance(value, dict):
+                value = value.get("name") or value.get("id")
+            if value is not None:
+                context_values.append(str(value))
+    return context_values
+
+def place_candidate(match, stage, tgn_id):
+    # The match of a ReconciliationResult (output column -> value) with the TGN ID tgn_id; columns left out by --fields count as empty
+    return {
+        "id": tgn_id,
+        "name": match.get("label") or match.get("label_en", ""),
+        "description": match.get("scope_note") or match.get("wikidata_description", ""),
+        "type": [{"id": QUERY_TYPE_PLACE, "name": match.get("type") or "place"}],
+        "score": STAGE_SCORES.get(stage, 50),
+        "match": stage in AUTO_MATCH_STAGES,
+    }
+
+def ranked_place_candidate(candidate):
+    # A further --top-k candidate of a place query (see row_candidate_list), scored below the match by its rank
+    return {
+        "id": extract_tgn_id_from_uri(candidate["tgn_uri"]),
+        "name": candidate["label"] or candidate["tgn_uri"],
+        "description": "",
+        "type": [{"id": QUERY_TYPE_PLACE, "name": candidate["type"] or "place"}],
+        "score": STAGE_SCORES.get(candidate["stage"], 50) // candidate["rank"],
+        "match": False,
+    }
+
+def place_candidates(result):
+    # The candidates of a ReconciliationResult: the match, then the other --top-k candidates (the first one is the match).
+    # Wikidata-only matches have no TGN ID, so they are not candidates in the TGN identifier space of the service.
+    tgn_id = extract_tgn_id_from_uri(result.match.get("tgn_uri")) if result.match is not None else None
+    if tgn_id is None:
+        return []
+    return [place_candidate(result.match, result.stage, tgn_id)] + [ranked_place_candidate(candidate) for candidate in result.candidates[1:] if candidate["tgn_uri"]]
+
+def country_candidates(result_items):
+    candidates = []
+    for result_item in result_items:
+        tgn_id = extract_tgn_id_from_uri(result_item["term"])
+        if tgn_id is None:
+            continue
+        candidates.append({
+            "id": tgn_id,
+            "name": result_item["label_en"] or result_item["wikidata_label"],
+            "description": result_item["scope_note"] or result_item["wikidata_description"],
+            "type": [{"id": QUERY_TYPE_COUNTRY, "name": "sovereign state"}],
+            "score": 100 // len(result_items),
+            "match": len(result_items) == 1,
+        })
+    return candidates
+
+class ReconciliationService:
+    """State shared by all requests: the ReconciliationEngine (context index, cascade caches, HTTP session) and the result cache."""
+
+    def __init__(self, args):
+        self.args = args
+        # One keep-alive connection pool, sized for the parallel rows of several requests, also used by the country queries
+        self.engine = ReconciliationEngine(args, connection_pool_size=args.workers * 4)
+        # Country query templates by tuple of fields, built by the first country query
+        self.country_query_templates = {}
+        self.result_cache = OrderedDict()
+        self.result_cache_lock = threading.Lock()
+
+    def manifest(self):
+        return {
+            "versions": ["0.1", "0.2"],
+            "name": SERVICE_NAME,
+            "identifierSpace": TGN_IDENTIFIER_SPACE,
+            "schemaSpace": TGN_SCHEMA_SPACE,
+            "defaultTypes": SERVICE_TYPES,
+            "view": {"url": TGN_VIEW_URL},
+        }
+
+    def cached_candidates(self, cache_key):
+        with self.result_cache_lock:
+            candidates = self.result_cache.get(cache_key)
+            if candidates is not None:
+                self.result_cache.move_to_end(cache_key)
+            return candidates
+
+    def cache_candidates(self, cache_key, candidates):
+        if not self.args.result_cache_size:
+            return
+        with self.result_cache_lock:
+            self.result_cache[cache_key] = candidates
+            self.result_cache.move_to_end(cache_key)
+            while len(self.result_cache) > self.args.result_cache_size:
+                self.result_cache.popitem(last=False)
+
+    def parse_query(self, query_key, query):
+        """
+        Returns (query type, name, contexts, limit, record) of one query of a batch, record being the (name, context
+        values) to pass to the engine. Raises QueryError if it is malformed.
+        """
+        if isinstance(query, str):
+            query = {"query": query}
+        if not isinstance(query, dict) or not isinstance(query.get("query"), str):
+            raise QueryError(f"Query '{query_key}' must be an object with a 'query' string.")
+        query_type = query.get("type") or QUERY_TYPE_PLACE
+        if isinstance(query_type, dict):
+            query_type = query_type.get("id")
+        if query_type not in (QUERY_TYPE_PLACE, QUERY_TYPE_COUNTRY):
+            raise QueryError(f"Query '{query_key}' has unknown type '{query_type}'. Expected one of: {QUERY_TYPE_PLACE}, {QUERY_TYPE_COUNTRY}.")
+        try:
+            limit = int(query.get("limit") or 0)
+        except (TypeError, ValueError):
+            raise QueryError(f"Query '{query_key}' has a limit that is not an integer.")
+        context_values = context_values_from_properties(query.get("properties")) if query_type == QUERY_TYPE_PLACE else []
+        name, contexts = self.engine.prepare_record(query["query"], context_values)
+        return query_type, name, contexts, limit, (query["query"], context_values)
+
+    def reconcile_places(self, place_queries):
+        """
+        Reconciles [(query key, record)] as one batch of the engine and returns query key -> (candidates, error or
+        None, cacheable). The batch runs without the engine's retry rounds, so a failing endpoint answers with an
+        error instead of holding the request for a breaker cooldown.
+        """
+        records = [record for _, record in place_queries]
+        answers = {}
+        for (query_key, _), result in zip(place_queries, self.engine.reconcile(records, batch_size=len(records), retry=False)):
+            error = f"Lookup failed in stage '{result.error['stage']}': {result.error['error']}" if result.error else None
+            candidates = place_candidates(result)
+            # A failed lookup, or a name left unmatched after --adaptive-cascade skipped a stage, may be answered differently later; neither is cached
+            answers[query_key] = (candidates, error, error is None and (bool(candidates) or not result.stages_skipped))
+        return answers
+
+    def reconcile_countries(self, country_queries):
+        """Runs the country query for [(query key, name)] and returns query key -> (candidates, error or None, cacheable)."""
+        gazetteer = self.engine.shared_state()["gazetteer"]
+
+        def reconcile_country(name):
+            gazetteer_values = gazetteer.lookup(name) if gazetteer is not None else None
+            if gazetteer_values is not None:
+                return country_candidates([reconcile_countries.country_result_from_gazetteer(gazetteer_values)]), None, True
+            result_items = reconcile_countries.query_country_term(name, self.args.match_mode, "service query", query_templates=self.country_query_templates, http_session=self.engine.settings.http_session)
+            if result_items is None:
+                return [], "Country query failed.", False
+            return country_candidates(result_items), None, True
+
+        with ThreadPoolExecutor(max_workers=self.args.workers) as executor:
+            country_answers = list(executor.map(lambda country_query: reconcile_country(country_query[1]), country_queries))
+        return {query_key: answer for (query_key, _), answer in zip(country_queries, country_answers)}
+
+    def reconcile_batch(self, queries):
+        """Answers a Reconciliation Service API queries object ({key: query}). Raises QueryError if it is malformed."""
+        if not isinstance(queries, dict):
+            raise QueryError("'queries' must be a JSON object of queries.")
+        parsed_queries = {query_key: self.parse_query(query_key, query) for query_key, query in queries.items()}
+
+        answers = {}
+        place_queries = []
+        country_queries = []
+        for query_key, (query_type, name, contexts, _, record) in parsed_queries.items():
+            cache_key = (query_type, name, tuple(context_info["uri"] for context_info in contexts))
+            candidates = self.cached_candidates(cache_key)
+            if candidates is not None:
+                answers[query_key] = (candidates, None, False)
+            elif not name:
+                answers[query_key] = ([], None, False)
+            elif query_type == QUERY_TYPE_PLACE:
+                place_queries.append((query_key, record))
+            else:
+                country_queries.append((query_key, name))
+        cached_count = len(answers)
+
+        if place_queries:
+            answers.update(self.reconcile_places(place_queries))
+        if country_queries:
+            answers.update(self.reconcile_countries(country_queries))
+
+        response = {}
+        for query_key, (query_type, name, contexts, limit, _) in parsed_queries.items():
+            candidates, error, cacheable = answers[query_key]
+            if cacheable:
+                self.cache_candidates((query_type, name, tuple(context_info["uri"] for context_info in contexts)), candidates)
+            response[query_key] = {"result": candidates[:limit] if limit > 0 else candidates}
+            if error:
+                response[query_key]["error"] = error
+        print(f"Info: Answered {len(parsed_queries)} queries ({cached_count} from the result cache).", file=sys.stderr)
+        return response
+
+class ReconciliationRequestHandler(BaseHTTPRequestHandler):
+    # GET or POST with "queries" (batch) or "query" (single); without either the service manifest is returned.
+    # A "callback" parameter wraps the response as JSONP, as older OpenRefine versions expect.
+
+    def do_GET(self):
+        self.handle_parameters(parse_qs(urlparse(self.path).query))
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0)).decode("utf-8")
+        if self.headers.get("Content-Type", "").startswith("application/json"):
+            parameters = {"queries": [body]}
+        else:
+            parameters = parse_qs(body)
+        parameters.update({key: values for key, values in parse_qs(urlparse(self.path).query).items() if key not in parameters})
+        self.handle_parameters(parameters)
+
+    def handle_parameters(self, parameters):
+        service = self.server.reconciliation_service
+        callback = parameters.get("callback", [None])[0]
+        try:
+            if "queries" in parameters:
+                response = service.reconcile_batch(json.loads(parameters["queries"][0]))
+            elif "query" in parameters:
+                query_text = parameters["query"][0]
+                try:
+                    query = json.loads(query_text)
+                except json.JSONDecodeError:
+                    query = query_text # A plain name
+                response = service.reconcile_batch({"q0": query})["q0"]
+            else:
+                response = service.manifest()
+        except (json.JSONDecodeError, QueryError) as e:
+            self.send_json({"error": str(e)}, callback, status=400)
+            return
+        self.send_json(response, callback)
+
+    def send_json(self, response, callback, status=200):
+        body = json.dumps(response, ensure_ascii=False)
+        content_type = "application/json"
+        if callback:
+            body = f"{callback}({body});"
+            content_type = "application/javascript"
+        encoded_body = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", f"{content_type}; charset=utf-8")
+        self.send_header("Content-Length", str(len(encoded_body)))
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.end_headers()
+        self.wfile.write(encoded_body)
+
+def main():
+    args = parse_arguments()
+    service = ReconciliationService(args)
+    server = ThreadingHTTPServer((args.host, args.port), ReconciliationRequestHandler)
+    server.daemon_threads = True
+    server.reconciliation_service = service
+    print(f"Info: Reconciliation service listening on http://{args.host}:{server.server_port}/ ({service.engine.context_index['entry_count']} top-region entries loaded).", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nInfo: Shutting down.", file=sys.stderr)
+    finally:
+        server.server_close()
+        report_cascade_statistics(service.engine.shared_state(), args)
+
+if __name__ == "__main__":
+    main()
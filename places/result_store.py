@@ -0,0 +1,142 @@
+import sys
+import threading
+from array import array
+
+# Compact store for the matches of reconcile_region.py.
+#
+# Many rows resolve to the same entity (every "Roma" row of a city file ends up at tgn:7000874), and the
+# entity's values (labels, type, multi-kilobyte scope notes) used to be copied into a dict per row.
+# Here every distinct entity is stored once as a __slots__ record with interned strings, and each row only
+# holds an entity id and a stage code in two flat arrays. Memory grows with the number of distinct entities,
+# plus a few bytes per input row. The fields are ENTITY_FIELDS, or the label columns of --languages instead of
+# the four default languages. With --top-k, the ranked candidates of a matched row are kept next to its match.
+
+ENTITY_FIELDS = (
+    "label", "label_en", "label_it", "label_de", "label_fr",
+    "type", "scope_note", "wikidata_description", "tgn_uri", "wikidata_uri",
+)
+
+NO_ENTITY = -1
+
+class ReconciliationEntity:
+    __slots__ = ENTITY_FIELDS
+
+    def __init__(self, values):
+        for field_name, value in zip(self.__slots__, values):
+            setattr(self, field_name, value)
+
+entity_classes = {ENTITY_FIELDS: ReconciliationEntity}
+
+def entity_class(entity_fields):
+    # ReconciliationEntity with the slots entity_fields (one class per field tuple)
+    entity_fields = tuple(entity_fields)
+    if entity_fields not in entity_classes:
+        entity_classes[entity_fields] = type("ReconciliationEntity", (), {"__slots__": entity_fields, "__init__": ReconciliationEntity.__init__})
+    return entity_classes[entity_fields]
+
+def intern_value(value):
+    if not value:
+        return ""
+    return sys.intern(value) if isinstance(value, str) else sys.intern(str(value))
+
+class ResultStore:
+    """Holds at most one match per row: an entity id and the name of the stage that found it."""
+
+    def __init__(self, row_count, entity_fields=ENTITY_FIELDS):
+        self.entity_fields = tuple(entity_fields)
+        self.entity_class = entity_class(self.entity_fields)
+        self.entities = []
+        self.entity_ids_by_values = {}
+        self.stage_names = []
+        self.stage_codes = {}
+        self.row_entity_ids = array('i', [NO_ENTITY]) * row_count
+        self.row_stage_codes = array('B', [0]) * row_count
+        # Row index -> tuple of the ranked candidates (dicts, best first) stored with the match, for --top-k
+        self.row_candidates = {}
+        # Rows are reconciled in parallel with --workers; interning must not add the same entity twice
+        self.lock = threading.Lock()
+
+    def intern_entity(self, result_item):
+        # Returns the id of the entity with exactly these values, adding it if it is new
+        values = tuple(intern_value(result_item.get(field_name, "")) for field_name in self.entity_fields)
+        entity_id = self.entity_ids_by_values.get(values)
+        if entity_id is None:
+            entity_id = len(self.entities)
+            self.entities.append(self.entity_class(values))
+            self.entity_ids_by_values[values] = entity_id
+        return entity_id
+
+    def derive_entity(self, entity_id, updated_values):
+        # Returns the id of an entity with the values of entity_id, except for updated_values (a dict of field -> value)
+        entity = self.entities[entity_id]
+        result_item = {field_name: getattr(entity, field_name) for field_name in self.entity_fields}
+        result_item.update(updated_values)
+        return self.intern_entity(result_item)
+
+    def stage_code(self, stage_name):
+        code = self.stage_codes.get(stage_name)
+        if code is None:
+            code = len(self.stage_names)
+            self.stage_names.append(stage_name)
+            self.stage_codes[stage_name] = code
+        return code
+
+    def add_match(self, row_idx, result_item, stage_name, candidates=None):
+        """
+        Stores result_item (a dict with the entity_fields keys) as the match of row_idx, with its ranked candidates
+        if given. An existing match is kept.
+        """
+        with self.lock:
+            if self.row_entity_ids[row_idx] != NO_ENTITY:
+                return
+            self.row_entity_ids[row_idx] = self.intern_entity(result_item)
+            self.row_stage_codes[row_idx] = self.stage_code(stage_name)
+            if candidates:
+                self.row_candidates[row_idx] = tuple(candidates)
+
+    def copy_match(self, source_row_idx, row_idx):
+        """Gives row_idx the match (entity, stage and candidates) of source_row_idx. An existing match of row_idx is kept."""
+        with self.lock:
+            if self.row_entity_ids[row_idx] != NO_ENTITY:
+                return
+            self.row_entity_ids[row_idx] = self.row_entity_ids[source_row_idx]
+            self.row_stage_codes[row_idx] = self.row_stage_codes[source_row_idx]
+            if source_row_idx in self.row_candidates:
+                self.row_candidates[row_idx] = self.row_candidates[source_row_idx]
+
+    def remap_rows(self, new_entity_ids, stage_names):
+        """Points the rows matched in one of stage_names from each entity id in new_entity_ids (old id -> new id) to its new id."""
+        stage_codes = {self.stage_codes[stage_name] for stage_name in stage_names if stage_name in self.stage_codes}
+        for row_idx, entity_id in enumerate(self.row_entity_ids):
+            if entity_id in new_entity_ids and self.row_stage_codes[row_idx] in stage_codes:
+                self.row_entity_ids[row_idx] = new_entity_ids[entity_id]
+
+    def entity_ids_for_stages(self, stage_names):
+        # Ids of the entities matched by at least one row in one of stage_names
+        stage_codes = {self.stage_codes[stage_name] for stage_name in stage_names if stage_name in self.stage_codes}
+        return sorted({entity_id for entity_id, stage_code in zip(self.row_entity_ids, self.row_stage_codes) if entity_id != NO_ENTITY and stage_code in stage_codes})
+
+    def clear_row(self, row_idx):
+        self.row_entity_ids[row_idx] = NO_ENTITY
+        self.row_stage_codes[row_idx] = 0
+        self.row_candidates.pop(row_idx, None)
+
+    def has_match(self, row_idx):
+        return self.row_entity_ids[row_idx] != NO_ENTITY
+
+    def get_match(self, row_idx):
+        # Returns the ReconciliationEntity of row_idx, or None
+        entity_id = self.row_entity_ids[row_idx]
+        return None if entity_id == NO_ENTITY else self.entities[entity_id]
+
+    def get_candidates(self, row_idx):
+        return self.row_candidates.get(row_idx, ())
+
+    def get_stage(self, row_idx):
+        return self.stage_names[self.row_stage_codes[row_idx]] if self.has_match(row_idx) else ""
+
+    def match_count(self):
+        return sum(1 for entity_id in self.row_entity_ids if entity_id != NO_ENTITY)
+
+    def entity_count(self):
+        return len(self.entities)
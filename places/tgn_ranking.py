@@ -0,0 +1,69 @@
+# Client-side ranking of TGN candidates for the lean candidate queries of reconcile_region.py (--lean-candidates).
+#
+# The ranked templates (SINGLE_REGION_TGN_SPARQL_QUERY_TEMPLATE, GLOBAL_TGN_SPARQL_QUERY_TEMPLATE) compute a type rank
+# on the server with OPTIONAL getty:placeTypePreferred/getty:broaderPreferred* paths and sort every candidate there.
+# The lean templates only return the candidates with their place types and depth below the context; the same rules
+# are applied here, with a local table of the broaderPreferred ancestors of every place type instead of the path
+# expansion. The rules are data, so they can be changed without touching the SPARQL.
+
+POLITICAL_DIVISION_TYPE_URI = "http://vocab.getty.edu/aat/300236157"
+INHABITED_PLACE_TYPE_URI = "http://vocab.getty.edu/aat/300008347"
+
+PLACE_TYPE_PREFERRED = "preferred"
+PLACE_TYPE_NON_PREFERRED = "non-preferred"
+
+# (rank, which place types, ancestor type) in order; the first matching rule gives the rank, otherwise the default.
+# Contextual search: political divisions first, then inhabited places (same rules as the ranked contextual template)
+CONTEXTUAL_TYPE_RANK_RULES = [
+    (1, PLACE_TYPE_PREFERRED, POLITICAL_DIVISION_TYPE_URI),
+    (2, PLACE_TYPE_PREFERRED, INHABITED_PLACE_TYPE_URI),
+    (3, PLACE_TYPE_NON_PREFERRED, INHABITED_PLACE_TYPE_URI),
+]
+CONTEXTUAL_DEFAULT_TYPE_RANK = 4
+# Global search: inhabited places first (same rules as the ranked global template)
+GLOBAL_TYPE_RANK_RULES = [
+    (1, PLACE_TYPE_PREFERRED, INHABITED_PLACE_TYPE_URI),
+    (2, PLACE_TYPE_NON_PREFERRED, INHABITED_PLACE_TYPE_URI),
+]
+GLOBAL_DEFAULT_TYPE_RANK = 3
+
+def build_place_type_ancestor_table(type_ancestor_pairs):
+    """
+    Builds the map of place type URI -> frozenset of its ancestors (getty:broaderPreferred*, including itself)
+    from (type URI, ancestor URI) pairs.
+    """
+    ancestors_by_type = {}
+    for type_uri, ancestor_uri in type_ancestor_pairs:
+        ancestors_by_type.setdefault(type_uri, {type_uri}).add(ancestor_uri)
+    return {type_uri: frozenset(ancestors) for type_uri, ancestors in ancestors_by_type.items()}
+
+def place_types_fall_under(type_uris, ancestor_uri, ancestor_table):
+    return any(ancestor_uri in ancestor_table.get(type_uri, (type_uri,)) for type_uri in type_uris)
+
+def rank_place_types(preferred_types, non_preferred_types, ancestor_table, rules, default_rank):
+    for rank, which_types, ancestor_uri in rules:
+        type_uris = preferred_types if which_types == PLACE_TYPE_PREFERRED else non_preferred_types
+        if place_types_fall_under(type_uris, ancestor_uri, ancestor_table):
+            return rank
+    return default_rank
+
+def new_lean_candidate():
+    return {"preferred_types": set(), "non_preferred_types": set(), "depth": None}
+
+def rank_lean_candidates(candidates_by_uri, ancestor_table, contextual):
+    """
+    Returns the candidate URIs best first: by type rank, then (contextual only) by the smallest depth below the
+    context, as the ranked templates order them. The URI breaks ties so that repeated runs pick the same entity.
+    """
+    return [tgn_uri for tgn_uri, _, _ in rank_lean_candidates_with_ranks(candidates_by_uri, ancestor_table, contextual)]
+
+def rank_lean_candidates_with_ranks(candidates_by_uri, ancestor_table, contextual):
+    # (tgn_uri, type rank, depth) of every candidate in the order of rank_lean_candidates; the depth is 0 for global search
+    rules, default_rank = (CONTEXTUAL_TYPE_RANK_RULES, CONTEXTUAL_DEFAULT_TYPE_RANK) if contextual else (GLOBAL_TYPE_RANK_RULES, GLOBAL_DEFAULT_TYPE_RANK)
+    ranked_candidates = []
+    for tgn_uri, candidate in candidates_by_uri.items():
+        type_rank = rank_place_types(candidate["preferred_types"], candidate["non_preferred_types"], ancestor_table, rules, default_rank)
+        depth = candidate["depth"] if contextual and candidate["depth"] is not None else 0
+        ranked_candidates.append((tgn_uri, type_rank, depth))
+    ranked_candidates.sort(key=lambda ranked_candidate: (ranked_candidate[1], ranked_candidate[2], ranked_candidate[0]))
+    return ranked_candidates
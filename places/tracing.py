@@ -0,0 +1,80 @@
+import json
+import os
+import threading
+import time
+
+# Opt-in span tracing for reconcile_region.py (--trace-file). Every row (or --breadth-first wave), context attempt,
+# cascade stage, SPARQL request and parse/store step becomes a "complete" event in the Chrome trace-event format, which chrome://tracing,
+# Perfetto (ui.perfetto.dev) and speedscope can open. Spans of one thread nest by time, so a row's stages and
+# queries show up below the row. Tracing is off by default; trace_span() then returns a shared no-op span.
+
+_trace_events = None
+_trace_events_lock = threading.Lock()
+_trace_origin = time.perf_counter()
+
+def enable_tracing():
+    global _trace_events
+    _trace_events = []
+
+def tracing_enabled():
+    return _trace_events is not None
+
+class TraceSpan:
+    """A running span; its args dict can be filled in until finish() (or the end of the with block)."""
+    __slots__ = ("name", "category", "args", "start")
+
+    def __init__(self, name, category, args):
+        self.name = name
+        self.category = category
+        self.args = args
+        self.start = time.perf_counter()
+
+    def finish(self, **args):
+        end = time.perf_counter()
+        self.args.update(args)
+        event = {
+            "name": self.name, "cat": self.category, "ph": "X",
+            "ts": round((self.start - _trace_origin) * 1e6), "dur": round((end - self.start) * 1e6),
+            "pid": os.getpid(), "tid": threading.get_ident(), "args": self.args,
+        }
+        with _trace_events_lock:
+            if _trace_events is not None:
+                _trace_events.append(event)
+
+    def __enter__(self):
+        return self.args
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.args.setdefault("error", f"{exc_type.__name__}: {exc_value}")
+        self.finish()
+        return False
+
+class _NoOpSpan:
+    __slots__ = ()
+
+    def finish(self, **args):
+        pass
+
+    def __enter__(self):
+        return {}
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+_NO_OP_SPAN = _NoOpSpan()
+
+def trace_span(name, category="reconcile", **args):
+    """Starts a span. Use it as a context manager (yielding the args dict) or call finish(**args) on it."""
+    if _trace_events is None:
+        return _NO_OP_SPAN
+    return TraceSpan(name, category, args)
+
+def write_trace_file(trace_path):
+    """Writes the recorded spans as Chrome trace-event JSON. Returns the number of spans written."""
+    with _trace_events_lock:
+        trace_events = list(_trace_events or [])
+    trace_events.sort(key=lambda event: event["ts"])
+    with open(trace_path, 'w', encoding='utf-8') as trace_file:
+        json.dump({"traceEvents": trace_events, "displayTimeUnit": "ms"}, trace_file, ensure_ascii=False)
+    return len(trace_events)